@@ -0,0 +1,95 @@
+import logging
+import os
+import stat
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+def area_paths():
+    """Directories whose usage is tracked, by area name"""
+    return {
+        'media': str(settings.MEDIA_ROOT),
+        'backups': os.path.join(settings.BASE_DIR, 'backups'),
+    }
+
+def directory_usage(path):
+    """
+    Walk path once and return (bytes, files), ignoring symlinks. Hardlinked
+    files (as in incremental media snapshots) are counted once, like du.
+    """
+    total_bytes = total_files = 0
+    seen = set()
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, filename))
+            except OSError:
+                continue  # Removed while walking
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            if st.st_nlink > 1:
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+            total_bytes += st.st_size
+            total_files += 1
+    return total_bytes, total_files
+
+def record(area, size, files=1):
+    """
+    Adjust the counters of an area by size bytes and files files (negative to
+    subtract). Done with a single UPDATE so concurrent workers don't lose updates.
+    An area that was never reconciled has no row yet and is left alone: its
+    first reconciliation counts everything on disk anyway.
+    """
+    from .models import StorageStats
+
+    try:
+        StorageStats.objects.filter(area=area).update(
+            bytes=F('bytes') + size, files=F('files') + files, updated_at=timezone.now()
+        )
+    except Exception as e:
+        # Accounting must never break an upload or a delete; reconciliation fixes drift
+        logger.warning(f"Failed to record storage change for {area}: {e}")
+
+def reconcile(areas=None):
+    """
+    Recount areas from disk and overwrite their counters, returning the drift
+    (counted minus recorded) per area. Changes made while the walk runs can leave
+    a small drift of their own, which the next reconciliation corrects.
+    """
+    from .models import StorageStats
+
+    paths = area_paths()
+    drift = {}
+    for area in areas or paths:
+        size, files = directory_usage(paths[area])
+        previous = StorageStats.objects.filter(area=area).first()
+        drift[area] = {
+            'bytes': size - (previous.bytes if previous else 0),
+            'files': files - (previous.files if previous else 0),
+        }
+        now = timezone.now()
+        StorageStats.objects.update_or_create(
+            area=area, defaults={'bytes': size, 'files': files, 'reconciled_at': now, 'updated_at': now}
+        )
+        logger.info(f"Reconciled {area} storage: {files} files, {size} bytes "
+                    f"(drift {drift[area]['files']} files, {drift[area]['bytes']} bytes)")
+    return drift
+
+def get_usage():
+    """Current counters per area; areas never counted are reconciled once first"""
+    from .models import StorageStats
+
+    stats = {row.area: row for row in StorageStats.objects.all()}
+    missing = [area for area in area_paths() if area not in stats]
+    if missing:
+        reconcile(missing)
+        stats = {row.area: row for row in StorageStats.objects.all()}
+
+    return {
+        area: {'bytes': row.bytes, 'files': row.files, 'reconciled_at': row.reconciled_at}
+        for area, row in stats.items()
+    }
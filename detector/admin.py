@@ -1,15 +1,18 @@
 from django.contrib import admin
 from django.http import JsonResponse
-from django.urls import path
+from django.urls import path, reverse
 from django.template.response import TemplateResponse
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
 from django.core.cache import cache
 from django.conf import settings
 import datetime
 import psutil
 import os
 from .models import Image
-from .tasks import background_tasks
+from .tasks import scheduler
+from .memory import governor
+from . import accounting, analytics, embeddings, search
+from .metrics import sampler
 
 @admin.register(Image)
 class ImageAdmin(admin.ModelAdmin):
@@ -18,7 +21,7 @@ class ImageAdmin(admin.ModelAdmin):
     list_filter = ('is_real', 'uploaded_at')
     search_fields = ('original_filename', 'analysis_result')
     readonly_fields = ('image_preview', 'file_size_display', 'dimensions_display', 
-                      'uploaded_at', 'confidence_score')
+                      'uploaded_at', 'confidence_score', 'similar_images')
     fieldsets = (
         ('Image Information', {
             'fields': ('image_preview', 'image', 'original_filename')
@@ -29,8 +32,28 @@ class ImageAdmin(admin.ModelAdmin):
         ('Technical Details', {
             'fields': ('file_size_display', 'dimensions_display', 'uploaded_at')
         }),
+        ('Similar Images', {
+            'fields': ('similar_images',)
+        }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Terms of 3+ characters go through the FTS5 trigram index instead of
+        LIKE '%term%' scans; shorter ones, which trigrams can't match, still use
+        LIKE on the rows the index already narrowed down.
+        """
+        terms = search.split_terms(search_term)
+        long_terms = [term for term in terms if len(term) >= search.MIN_TERM_LENGTH]
+        if not long_terms or not search.fts_available(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+
+        queryset = search.filter_fts(queryset, long_terms)
+        short_terms = [term for term in terms if len(term) < search.MIN_TERM_LENGTH]
+        if short_terms:
+            return super().get_search_results(request, queryset, ' '.join(short_terms))
+        return queryset, False
+
     def get_urls(self):
         urls = super().get_urls()
         custom_urls = [
@@ -43,23 +66,43 @@ class ImageAdmin(admin.ModelAdmin):
             path('task-status/',
                  self.admin_site.admin_view(self.task_status),
                  name='task_status'),
+            path('analytics/',
+                 self.admin_site.admin_view(self.analytics_view),
+                 name='analytics'),
         ]
         return custom_urls + urls
 
     def thumbnail(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" />', 
-                             obj.image.url)
+            return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" loading="lazy" />', 
+                             obj.thumbnail_url(64))
         return "No image"
     thumbnail.short_description = 'Thumbnail'
 
     def image_preview(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 300px; max-width: 100%;" />', 
-                             obj.image.url)
+            return format_html('<a href="{}"><img src="{}" style="max-height: 300px; max-width: 100%;" /></a>', 
+                             obj.image.url, obj.thumbnail_url(320))
         return "No image"
     image_preview.short_description = 'Image Preview'
 
+    def similar_images(self, obj):
+        """Closest previously analyzed images by embedding, for spotting re-uploads and variants"""
+        if not obj.pk or not obj.model_version or not embeddings.get_config()['ENABLED']:
+            return "Not analyzed"
+        store = embeddings.get_store(obj.model_version)
+        vector = store.get(obj.pk)
+        if vector is None:
+            return "No embedding stored"
+        matches = embeddings.find_similar(store, vector, k=8, exclude=obj.pk)
+        if not matches:
+            return "No similar images"
+        return format_html_join('',
+            '<a href="{}" title="{} ({})"><img src="{}" style="max-height: 80px; max-width: 80px; margin: 2px;" loading="lazy" /></a>',
+            ((reverse('admin:detector_image_change', args=[image.pk]), image.analysis_result or 'Not analyzed',
+              f'{score:.3f}', image.thumbnail_url(64)) for image, score in matches))
+    similar_images.short_description = 'Similar Images'
+
     def file_size_display(self, obj):
         if obj.file_size < 1024:
             return f"{obj.file_size} bytes"
@@ -89,45 +132,51 @@ class ImageAdmin(admin.ModelAdmin):
 
     def system_health(self, request):
         """Get system health information"""
-        process = psutil.Process()
-        
+        metrics = sampler.latest()
         try:
-            media_size = sum(
-                os.path.getsize(os.path.join(dirpath, filename))
-                for dirpath, dirnames, filenames in os.walk(settings.MEDIA_ROOT)
-                for filename in filenames
-            )
-        except Exception:
-            media_size = 0
-            
-        try:
-            backup_size = sum(
-                os.path.getsize(os.path.join(dirpath, filename))
-                for dirpath, dirnames, filenames in os.walk(settings.BASE_DIR / 'backups')
-                for filename in filenames
-            )
-        except Exception:
-            backup_size = 0
+            window = int(request.GET.get('window', 600))
+        except ValueError:
+            window = 600
+        usage = accounting.get_usage()
+        media_size = usage.get('media', {}).get('bytes', 0)
+        backup_size = usage.get('backups', {}).get('bytes', 0)
 
         return JsonResponse({
             'system': {
-                'cpu_percent': psutil.cpu_percent(interval=1),
-                'memory_percent': process.memory_percent(),
+                'cpu_percent': metrics['cpu_percent'],
+                'memory_percent': metrics['memory_percent'],
+                'rss_mb': metrics['rss_mb'],
+                'open_files': metrics['open_files'],
+                'in_flight_requests': metrics['in_flight_requests'],
+                'listen_queue': metrics['listen_queue'],
                 'disk_usage': {
                     'media': self._format_size(media_size),
                     'backups': self._format_size(backup_size),
                 },
                 'uptime': str(datetime.timedelta(seconds=int(psutil.boot_time())))
             },
+            'metrics_history': sampler.history(
+                seconds=window,
+                fields=('cpu_percent', 'rss_mb', 'listen_queue', 'in_flight_requests'),
+            ),
+            'memory_governor': governor.get_stats(),
             'cache': {
                 'backend': settings.CACHES['default']['BACKEND'],
                 'status': self._check_cache_status()
             }
         })
 
+    def analytics_view(self, request):
+        """Daily upload and verdict rollups for the dashboard"""
+        try:
+            days = min(max(int(request.GET.get('days', 30)), 1), 366)
+        except ValueError:
+            days = 30
+        return JsonResponse(analytics.summary(days))
+
     def task_status(self, request):
-        """Get background tasks status"""
-        return JsonResponse(background_tasks.get_tasks_status())
+        """Get scheduled jobs status"""
+        return JsonResponse(scheduler.get_jobs_status())
 
     def _format_size(self, size):
         """Format file size for display"""
@@ -1,26 +1,209 @@
+import copy
 import torch
-from torchvision import models, transforms
+from torchvision import models
 from PIL import Image
 import numpy as np
 import os
+import hashlib
 import gc
+import queue
+import threading
+from contextlib import contextmanager
 from django.conf import settings
+from .utils.cpu import cpu_supports_bf16
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Model variants that can be built without an artifact (see ImageAnalyzer.from_variant)
+MODEL_VARIANTS = ('resnet50', 'mobilenet_v2', 'resnet50_quantized', 'mobilenet_v2_quantized')
+
+# Inference modes as ImageAnalyzer options, for the benchmark and evaluation commands
+INFERENCE_MODES = {
+    'fp32': {},
+    'channels_last': {'channels_last': True},
+    'bf16': {'bf16': True},
+    'channels_last_bf16': {'channels_last': True, 'bf16': True},
+}
+
+def build_classifier(arch='resnet50', pretrained=False):
+    """Build the binary real/fake classifier on top of a torchvision backbone"""
+    if arch == 'mobilenet_v2':
+        model = models.mobilenet_v2(weights=None)
+        # Modify the classifier for binary classification
+        model.classifier = torch.nn.Sequential(
+            torch.nn.Dropout(0.2),
+            torch.nn.Linear(model.last_channel, 1),
+            torch.nn.Sigmoid()
+        )
+    elif arch == 'resnet50':
+        # Use ResNet50 as base model with pretrained weights if requested
+        if pretrained:
+            model = models.resnet50(weights=models.ResNet50_Weights.IMAGENET1K_V2)
+        else:
+            model = models.resnet50(weights=None)
+
+        # Modify the final layer for binary classification
+        num_features = model.fc.in_features
+        model.fc = torch.nn.Sequential(
+            torch.nn.Linear(num_features, 1024),
+            torch.nn.ReLU(),
+            torch.nn.Dropout(0.2),
+            torch.nn.Linear(1024, 1),
+            torch.nn.Sigmoid()
+        )
+    else:
+        raise ValueError(f"Unknown model architecture: {arch}")
+    return model
+
+class TensorPool:
+    """
+    Thread-safe pool of preallocated input batches, so steady-state inference
+    reuses the same tensors instead of allocating one per request
+    """
+    def __init__(self, shape, size=2, memory_format=torch.contiguous_format):
+        self.shape = shape
+        self.size = size
+        self.memory_format = memory_format
+        self.free = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.overflow = 0
+        for _ in range(size):
+            self.free.put(self._allocate())
+
+    def _allocate(self):
+        return torch.empty(self.shape, memory_format=self.memory_format)
+
+    @contextmanager
+    def acquire(self):
+        """Borrow a batch tensor, allocating a temporary one if all are in use"""
+        try:
+            tensor = self.free.get_nowait()
+            pooled = True
+        except queue.Empty:
+            with self.lock:
+                self.overflow += 1
+            tensor = self._allocate()
+            pooled = False
+        try:
+            yield tensor
+        finally:
+            if pooled:
+                self.free.put(tensor)
+
+def artifact_version(path):
+    """Short stable identifier of a weights file: its name and a prefix of its SHA-256"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return f"{os.path.splitext(os.path.basename(path))[0]}-{hasher.hexdigest()[:12]}"
+
+def _is_channels_last(model):
+    """Whether every convolution weight is already in channels_last layout"""
+    return all(param.is_contiguous(memory_format=torch.channels_last)
+               for param in model.parameters() if param.dim() == 4)
+
+def _supports_autocast(model):
+    """
+    Dynamically quantized layers only accept float32 activations, and a
+    TorchScript artifact may have been traced with fixed dtypes
+    """
+    if isinstance(model, torch.jit.ScriptModule):
+        return False
+    return not any(type(module).__module__.startswith('torch.ao.nn.quantized') for module in model.modules())
+
 class ImageAnalyzer:
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, model=None, max_batch_size=8, pool_size=2,
+                 channels_last=False, bf16=False, model_version=None):
         # Force CPU usage for Render deployment
         self.device = torch.device('cpu')
-        self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-        ])
-        self.model = self._load_or_create_model(model_path)
-        logger.info(f"ImageAnalyzer initialized using device: {self.device}")
+        self.input_size = (224, 224)
+        # ImageNet normalization folded into the 0-255 range: (x - 255 * mean) / (255 * std)
+        self.mean = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1) * 255
+        self.std = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1) * 255
+
+        # oneDNN convolutions are faster on NHWC inputs; bf16 only pays off with native instructions
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.bf16 = bf16 and cpu_supports_bf16()
+        if bf16 and not self.bf16:
+            logger.warning("bfloat16 autocast requested but this CPU lacks native bf16 support, using float32")
+
+        self.max_batch_size = max_batch_size
+        self.input_pool = TensorPool((max_batch_size, 3) + self.input_size, size=pool_size,
+                                     memory_format=self.memory_format)
+        # Recorded with every analysis so results can be compared across model releases
+        self.model_version = model_version or 'untrained'
+        if model is not None:
+            self.model = model.to(self.device)
+            self.model.eval()
+        else:
+            self.model = self._load_or_create_model(model_path)
+            if model_version is None and hasattr(self, 'weights_path'):
+                self.model_version = artifact_version(self.weights_path)
+        if channels_last:
+            if model is not None and not _is_channels_last(self.model):
+                # Module.to converts in place; leave a caller's model, which may be shared, as it was
+                self.model = copy.deepcopy(self.model)
+            self.model = self.model.to(memory_format=torch.channels_last)
+        if self.bf16 and not _supports_autocast(self.model):
+            logger.warning("bfloat16 autocast is not supported by quantized or TorchScript models, using float32")
+            self.bf16 = False
+        self._capture = threading.local()
+        self.embedding_dim = self._hook_embeddings()
+        logger.info(f"ImageAnalyzer initialized using device: {self.device} "
+                    f"(channels_last={channels_last}, bf16={self.bf16})")
+
+    @classmethod
+    def from_variant(cls, variant='resnet50', artifact=None, **options):
+        """
+        Build an analyzer for one of MODEL_VARIANTS, or for a saved artifact.
+        A TorchScript artifact is used as-is; anything else is treated as a
+        state_dict for the variant's architecture.
+        """
+        options.setdefault('model_version', artifact_version(artifact) if artifact else variant)
+        if artifact:
+            try:
+                model = torch.jit.load(artifact, map_location='cpu')
+                logger.info(f"Loaded TorchScript artifact {artifact}")
+                return cls(model=model, **options)
+            except RuntimeError:
+                pass  # Not a TorchScript archive, load it as a state_dict below
+
+        if variant not in MODEL_VARIANTS:
+            raise ValueError(f"Unknown model variant: {variant}")
+
+        arch = 'mobilenet_v2' if variant.startswith('mobilenet_v2') else 'resnet50'
+        model = build_classifier(arch)
+        if artifact:
+            model.load_state_dict(torch.load(artifact, map_location='cpu'))
+        model.eval()
+
+        if variant.endswith('_quantized'):
+            # Dynamic int8 quantization of the Linear layers
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        return cls(model=model, **options)
         
+    def _hook_embeddings(self):
+        """
+        Capture the input of the classification head (the backbone's pooled
+        features) on threads that asked for embeddings. Returns the embedding
+        size, or None for models that can't be hooked, such as TorchScript.
+        """
+        head = getattr(self.model, 'fc', None) or getattr(self.model, 'classifier', None)
+        if not isinstance(head, torch.nn.Module) or isinstance(self.model, torch.jit.ScriptModule):
+            return None
+
+        def capture(module, inputs):
+            features = getattr(self._capture, 'features', None)
+            if features is not None:
+                features.append(inputs[0].detach().float())
+
+        head.register_forward_pre_hook(capture)
+        # First Linear of the head, float or dynamically quantized
+        return next(layer.in_features for layer in head.modules() if hasattr(layer, 'in_features'))
+
     def _load_or_create_model(self, model_path):
         try:
             if model_path and os.path.exists(os.path.join(settings.BASE_DIR, model_path)):
@@ -35,6 +218,7 @@ class ImageAnalyzer:
                     # Load state_dict with the new weight_only=True (default in PyTorch 2.6+)
                     state_dict = torch.load(model_full_path, map_location=self.device)
                     model.load_state_dict(state_dict)
+                    self.weights_path = model_full_path
                     logger.info("Successfully loaded model weights")
                     
                     # Force garbage collection to free memory
@@ -63,29 +247,9 @@ class ImageAnalyzer:
         
         # Use lightweight model for Render's free tier if memory_efficient is True
         if memory_efficient:
-            model = models.mobilenet_v2(weights=None)
-            # Modify the classifier for binary classification
-            model.classifier = torch.nn.Sequential(
-                torch.nn.Dropout(0.2),
-                torch.nn.Linear(model.last_channel, 1),
-                torch.nn.Sigmoid()
-            )
+            model = build_classifier('mobilenet_v2')
         else:
-            # Use ResNet50 as base model with pretrained weights if requested
-            if initialize_weights:
-                model = models.resnet50(weights=models.ResNet50_Weights.IMAGENET1K_V2)
-            else:
-                model = models.resnet50(weights=None)
-            
-            # Modify the final layer for binary classification
-            num_features = model.fc.in_features
-            model.fc = torch.nn.Sequential(
-                torch.nn.Linear(num_features, 1024),
-                torch.nn.ReLU(),
-                torch.nn.Dropout(0.2),
-                torch.nn.Linear(1024, 1),
-                torch.nn.Sigmoid()
-            )
+            model = build_classifier('resnet50', pretrained=initialize_weights)
         
         # Move model to appropriate device (GPU/CPU)
         model = model.to(self.device)
@@ -102,38 +266,96 @@ class ImageAnalyzer:
     def preprocess_image(self, image_path):
         """Preprocess image for model input"""
         try:
-            img = Image.open(image_path).convert('RGB')
-            img_tensor = self.transform(img)
-            img_tensor = img_tensor.unsqueeze(0)  # Add batch dimension
-            return img_tensor.to(self.device)
+            img_tensor = torch.empty((1, 3) + self.input_size, memory_format=self.memory_format)
+            self._load_into(image_path, img_tensor[0])
+            return self._normalize(img_tensor)
         except Exception as e:
             logger.error(f"Error preprocessing image: {e}")
             raise
-    
-    def analyze_image(self, image_path):
+
+    def _load_into(self, image, out):
+        """
+        Decode and resize an image straight into a preallocated (3, H, W) float
+        tensor. out.numpy() shares memory with the tensor, so the uint8 pixels
+        are converted while being written into place, with no intermediate tensor.
+        """
+        with Image.open(image) as img:
+            # Same bilinear, antialiased resize torchvision's Resize applies to PIL images
+            img = img.convert('RGB').resize(self.input_size, Image.Resampling.BILINEAR)
+        self._copy_pixels(np.asarray(img), out)
+
+    def _copy_pixels(self, pixels, out):
+        """Write uint8 (H, W, 3) pixels into a preallocated (3, H, W) float tensor"""
+        np.copyto(out.numpy().transpose(1, 2, 0), pixels)
+
+    def _normalize(self, batch):
+        """Normalize a batch of 0-255 pixel values in place"""
+        return batch.sub_(self.mean).div_(self.std)
+
+    def analyze_image(self, image_path, embeddings=False):
         """Analyze an image and return prediction"""
         try:
             if not os.path.exists(image_path):
                 logger.error(f"Image path does not exist: {image_path}")
                 return None
 
-            with torch.no_grad():
-                img_tensor = self.preprocess_image(image_path)
-                prediction = self.model(img_tensor)
-                prob = prediction.item()
-                
-                # Clear memory
-                del img_tensor
-                gc.collect()
-                
-                return {
-                    'is_real': bool(prob > 0.5),
-                    'confidence': float(prob if prob > 0.5 else 1 - prob)
-                }
+            return self.analyze_batch([image_path], embeddings=embeddings)[0]
         except Exception as e:
             logger.error(f"Error analyzing image: {e}")
             return None
 
+    def analyze_batch(self, images, embeddings=False):
+        """
+        Analyze several images (paths or file objects), max_batch_size at a time,
+        using pooled input tensors. Unlike analyze_image, errors are raised to the caller.
+        With embeddings, each result also carries the backbone's float32
+        feature vector under 'embedding' (when the model can be hooked).
+        """
+        return self._analyze(images, self._load_into, embeddings)
+
+    def analyze_pixels(self, images, embeddings=False):
+        """
+        Like analyze_batch, for images already decoded to uint8 (H, W, 3) arrays
+        of input_size, as detector.batch decode workers produce them
+        """
+        return self._analyze(images, self._copy_pixels, embeddings)
+
+    def _analyze(self, images, load, embeddings=False):
+        capture = embeddings and self.embedding_dim is not None
+        results = []
+        for start in range(0, len(images), self.max_batch_size):
+            chunk = images[start:start + self.max_batch_size]
+            with self.input_pool.acquire() as buffer, torch.no_grad():
+                batch = buffer[:len(chunk)]
+                for index, image in enumerate(chunk):
+                    load(image, batch[index])
+                if capture:
+                    self._capture.features = []
+                try:
+                    probs = self._forward(self._normalize(batch))
+                    features = self._capture.features[0].numpy() if capture else None
+                finally:
+                    self._capture.features = None
+            for index, prob in enumerate(probs):
+                result = self._format_result(prob)
+                if capture:
+                    result['embedding'] = features[index]
+                results.append(result)
+        return results
+
+    def _forward(self, batch):
+        """Run the model, under bf16 autocast when enabled, and return probabilities"""
+        with torch.autocast('cpu', dtype=torch.bfloat16, enabled=self.bf16):
+            prediction = self.model(batch)
+        return prediction.float().view(-1).tolist()
+
+    def _format_result(self, prob):
+        """Turn the model's probability of a real image into a result dict"""
+        return {
+            'is_real': bool(prob > 0.5),
+            'confidence': float(prob if prob > 0.5 else 1 - prob)
+        }
+
 # Create the models directory if it doesn't exist
 models_dir = os.path.join(settings.BASE_DIR, 'detector', 'models')
 if not os.path.exists(models_dir):
@@ -142,4 +364,13 @@ if not os.path.exists(models_dir):
 
 # Initialize the model with pretrained weights
 MODEL_PATH = os.path.join('detector', 'models', 'realface_model.pth')
-analyzer = ImageAnalyzer(model_path=MODEL_PATH)
\ No newline at end of file
+INFERENCE = getattr(settings, 'INFERENCE', {})
+analyzer = ImageAnalyzer(
+    model_path=MODEL_PATH,
+    # Web requests analyze one image at a time; one pooled tensor per gunicorn thread
+    max_batch_size=INFERENCE.get('MAX_BATCH_SIZE', 1),
+    pool_size=INFERENCE.get('POOL_SIZE', 2),
+    channels_last=INFERENCE.get('CHANNELS_LAST', False),
+    bf16=INFERENCE.get('BF16_AUTOCAST', False),
+    model_version=INFERENCE.get('MODEL_VERSION'),
+)
\ No newline at end of file
@@ -0,0 +1,182 @@
+import datetime
+import logging
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, Sum
+from django.db.models.functions import Cast, Least
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Confidence is the probability of the predicted class, so it lies in [0.5, 1]
+HISTOGRAM_BUCKETS = 10
+HISTOGRAM_MIN = 0.5
+BUCKET_WIDTH = (1 - HISTOGRAM_MIN) / HISTOGRAM_BUCKETS
+
+COUNTERS = ('uploads', 'upload_bytes', 'analyzed', 'real_count', 'ai_count', 'failed', 'cache_hits',
+            'coalesced', 'coalesce_timeouts', 'confidence_sum')
+
+def confidence_bucket(confidence):
+    return max(0, min(int((confidence - HISTOGRAM_MIN) / BUCKET_WIDTH), HISTOGRAM_BUCKETS - 1))
+
+def _increment(model, keys, **deltas):
+    """Add deltas to the row identified by keys with one UPDATE, creating the row if needed"""
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**keys).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:
+        # Another worker created it first
+        model.objects.filter(**keys).update(**updates)
+
+def _record(day, model_version, bucket=None, **deltas):
+    from .models import DailyConfidenceBucket, DailyRollup
+
+    keys = {'day': day, 'model_version': model_version}
+    try:
+        _increment(DailyRollup, keys, **deltas)
+        if bucket is not None:
+            _increment(DailyConfidenceBucket, dict(keys, bucket=bucket), count=1)
+    except Exception as e:
+        # Analytics must never fail a request; backfill_rollups can rebuild the numbers
+        logger.warning(f"Failed to update analytics rollup: {e}")
+
+def record_analysis(image):
+    """Count an upload that was analyzed successfully"""
+    _record(
+        timezone.localdate(image.uploaded_at), image.model_version,
+        bucket=confidence_bucket(image.confidence_score),
+        uploads=1, upload_bytes=image.file_size, analyzed=1,
+        real_count=int(bool(image.is_real)), ai_count=int(not image.is_real),
+        confidence_sum=image.confidence_score,
+    )
+
+def record_failure(image, model_version):
+    """Count an upload whose analysis failed"""
+    _record(timezone.localdate(image.uploaded_at), model_version,
+            uploads=1, upload_bytes=image.file_size, failed=1)
+
+def record_cache_hit(model_version):
+    """Count an upload answered from the result cache"""
+    _record(timezone.localdate(), model_version, cache_hits=1)
+
+def record_coalesced(model_version):
+    """Count an upload answered by an identical one analyzed at the same time"""
+    _record(timezone.localdate(), model_version, coalesced=1)
+
+def record_coalesce_timeout(model_version):
+    """Count an upload that stopped waiting for an identical one and was analyzed itself"""
+    _record(timezone.localdate(), model_version, coalesce_timeouts=1)
+
+def summary(days=30):
+    """
+    Per-day totals and the confidence histogram for the last days days, by
+    model version. Reads at most days x versions rollup rows, however many
+    images there are.
+    """
+    from .models import DailyConfidenceBucket, DailyRollup
+
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+    per_day = {}
+    versions = {}
+    for row in DailyRollup.objects.filter(day__gte=since).order_by('day').values('day', 'model_version', *COUNTERS):
+        day = per_day.setdefault(row['day'].isoformat(), dict.fromkeys(COUNTERS, 0))
+        version = versions.setdefault(row['model_version'], dict.fromkeys(COUNTERS, 0))
+        for field in COUNTERS:
+            day[field] += row[field]
+            version[field] += row[field]
+
+    histogram = {}
+    for row in (DailyConfidenceBucket.objects.filter(day__gte=since)
+                .values('model_version', 'bucket').annotate(total=Sum('count'))):
+        histogram.setdefault(row['model_version'], [0] * HISTOGRAM_BUCKETS)[row['bucket']] = row['total']
+
+    for totals in list(per_day.values()) + list(versions.values()):
+        totals['mean_confidence'] = round(totals.pop('confidence_sum') / totals['analyzed'], 4) if totals['analyzed'] else None
+        requests = totals['uploads'] + totals['cache_hits'] + totals['coalesced']
+        totals['cache_hit_rate'] = round(totals['cache_hits'] / requests, 4) if requests else None
+        totals['coalesced_rate'] = round(totals['coalesced'] / requests, 4) if requests else None
+
+    return {
+        'since': since.isoformat(),
+        'days': per_day,
+        'model_versions': versions,
+        'histogram': {
+            'bucket_edges': [round(HISTOGRAM_MIN + i * BUCKET_WIDTH, 3) for i in range(HISTOGRAM_BUCKETS + 1)],
+            'counts': histogram,
+        },
+    }
+
+def first_complete_day():
+    """
+    Oldest day whose uploads are all still in the Image table. Cleanup
+    deletes analyzed images after IMAGE_CLEANUP MAX_AGE_DAYS, so the day
+    holding that cutoff is already partly gone and earlier ones entirely.
+    """
+    max_age = getattr(settings, 'IMAGE_CLEANUP', {}).get('MAX_AGE_DAYS', 7)
+    return timezone.localdate(timezone.now() - datetime.timedelta(days=max_age)) + datetime.timedelta(days=1)
+
+def rebuild_day(day, force=False):
+    """
+    Recompute one day's rollups from the Image table. Uploads whose analysis
+    failed were deleted, and cache hits and coalesced uploads never had rows,
+    so those counts are kept rather than recomputed. Days cleanup has
+    reached would lose the counts of their deleted images, so they are
+    refused unless forced.
+    """
+    from .models import DailyConfidenceBucket, DailyRollup, Image
+
+    if not force and day < first_complete_day():
+        raise ValueError(f"{day} is older than the cleanup retention; its images are no longer all stored")
+
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    images = Image.objects.filter(uploaded_at__gte=start, uploaded_at__lt=start + datetime.timedelta(days=1))
+
+    rows = {}
+    for row in images.values('model_version', 'is_real').annotate(
+        uploads=Count('id'), upload_bytes=Sum('file_size'), confidence_sum=Sum('confidence_score'),
+    ):
+        # Images from before versions were recorded have an empty model_version
+        totals = rows.setdefault(row['model_version'] or 'unknown', dict.fromkeys(COUNTERS, 0))
+        totals['uploads'] += row['uploads']
+        totals['upload_bytes'] += row['upload_bytes'] or 0
+        if row['is_real'] is not None:
+            totals['analyzed'] += row['uploads']
+            totals['real_count' if row['is_real'] else 'ai_count'] += row['uploads']
+            totals['confidence_sum'] += row['confidence_sum'] or 0
+
+    bucket_expression = Least(
+        Cast((F('confidence_score') - HISTOGRAM_MIN) / BUCKET_WIDTH, IntegerField()),
+        HISTOGRAM_BUCKETS - 1,
+    )
+    buckets = {}
+    for row in (images.filter(confidence_score__isnull=False)
+                .annotate(bucket=bucket_expression).values('model_version', 'bucket')
+                .annotate(count=Count('id'))):
+        key = (row['model_version'] or 'unknown', max(row['bucket'], 0))
+        buckets[key] = buckets.get(key, 0) + row['count']
+
+    with transaction.atomic():
+        kept = {
+            row['model_version']: row
+            for row in DailyRollup.objects.filter(day=day).values(
+                'model_version', 'failed', 'cache_hits', 'coalesced', 'coalesce_timeouts')
+        }
+        DailyRollup.objects.filter(day=day).delete()
+        DailyConfidenceBucket.objects.filter(day=day).delete()
+        for version, previous in kept.items():
+            totals = rows.setdefault(version, dict.fromkeys(COUNTERS, 0))
+            totals['failed'] = previous['failed']
+            for field in ('cache_hits', 'coalesced', 'coalesce_timeouts'):
+                totals[field] = previous[field]
+            totals['uploads'] += previous['failed']
+        DailyRollup.objects.bulk_create([
+            DailyRollup(day=day, model_version=version, **totals) for version, totals in rows.items()
+        ])
+        DailyConfidenceBucket.objects.bulk_create([
+            DailyConfidenceBucket(day=day, model_version=version, bucket=bucket, count=count)
+            for (version, bucket), count in buckets.items()
+        ])
+    return len(rows)
@@ -6,10 +6,27 @@ class DetectorConfig(AppConfig):
     name = 'detector'
 
     def ready(self):
-        # Avoid running background tasks in manage.py commands except runserver
+        # Let the memory governor sample RSS after each response is sent
+        from django.core.signals import request_finished
+        from .memory import governor
+        request_finished.connect(governor.check, dispatch_uid='detector_memory_governor')
+
+        # Count requests in progress for the metrics sampler
+        from django.core.signals import request_started
+        from .metrics import sampler
+        request_started.connect(sampler.request_started, dispatch_uid='detector_metrics_started')
+        request_finished.connect(sampler.request_finished, dispatch_uid='detector_metrics_finished')
+
+        # Apply the SQLite performance profile to every new database connection
+        from django.db.backends.signals import connection_created
+        from .db import configure_sqlite_connection
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='detector_sqlite_profile')
+
+        # Avoid running scheduled jobs in manage.py commands except runserver;
+        # gunicorn workers start the scheduler from post_worker_init
         if 'runserver' not in sys.argv:
             return
 
-        # Start all background tasks
-        from .tasks import background_tasks
-        background_tasks.start()
+        from .tasks import scheduler
+        scheduler.start()
+        sampler.start()
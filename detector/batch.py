@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import time
+import numpy as np
+from PIL import Image as PILImage, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+# ImageAnalyzer.input_size
+INPUT_SIZE = (224, 224)
+
+DecodedImage = collections.namedtuple('DecodedImage', 'path pixels digest error decode_seconds')
+
+def iter_images(root, after=None):
+    """
+    Yield image paths under root lazily, depth-first in sorted order, so a
+    tree of millions of files is never listed up front. With after (a path
+    relative to root, as yielded before), continue with the paths sorting after
+    it, skipping whole directories that come before.
+    """
+    yield from _walk(root, [], after.split(os.sep) if after else None)
+
+def _walk(directory, parts, after):
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+    except OSError as e:
+        logger.warning(f"Cannot list {directory}: {e}")
+        return
+    for entry in entries:
+        entry_parts = parts + [entry.name]
+        if after is not None and entry_parts < after[:len(entry_parts)]:
+            continue  # Everything in it sorts before after
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk(entry.path, entry_parts, after)
+        elif (entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file()
+              and (after is None or entry_parts > after)):
+            yield entry.path
+
+def decode_image(path, size=INPUT_SIZE, with_digest=False):
+    """
+    Read an image and decode it to uint8 (H, W, 3) pixels resized exactly like
+    ImageAnalyzer does, optionally with the SHA-256 of the file
+    """
+    started = time.perf_counter()
+    digest = None
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if with_digest:
+            digest = hashlib.sha256(data).hexdigest()
+        with PILImage.open(io.BytesIO(data)) as img:
+            img = img.convert('RGB').resize(size, PILImage.Resampling.BILINEAR)
+            pixels = np.asarray(img)
+        return DecodedImage(path, pixels, digest, None, time.perf_counter() - started)
+    except UnidentifiedImageError:
+        return DecodedImage(path, None, digest, 'not a recognised image format', time.perf_counter() - started)
+    except Exception as e:
+        return DecodedImage(path, None, digest, str(e), time.perf_counter() - started)
+
+def _decode_chunk(paths, size, with_digest):
+    return [decode_image(path, size, with_digest) for path in paths]
+
+class DecodePool:
+    """
+    Decode images in worker processes while the caller runs inference on the
+    previous ones. Results come back in input order, and at most window chunks
+    are in flight, so memory stays flat however long the stream of paths is
+    (Pool.imap would queue every path and buffer every result).
+    """
+    def __init__(self, workers=None, chunk_size=8, window=None, size=INPUT_SIZE, with_digest=False):
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.window = window or 2 * self.workers
+        self.size = size
+        self.with_digest = with_digest
+        self.pool = None
+
+    def __enter__(self):
+        self.pool = multiprocessing.Pool(self.workers)
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.pool.close()
+        else:
+            self.pool.terminate()
+        self.pool.join()
+
+    def imap(self, paths):
+        """Yield a DecodedImage for every path, in order"""
+        pending = collections.deque()
+        chunk = []
+        for path in paths:
+            chunk.append(path)
+            if len(chunk) == self.chunk_size:
+                pending.append(self._submit(chunk))
+                chunk = []
+                if len(pending) >= self.window:
+                    yield from pending.popleft().get()
+        if chunk:
+            pending.append(self._submit(chunk))
+        while pending:
+            yield from pending.popleft().get()
+
+    def _submit(self, chunk):
+        return self.pool.apply_async(_decode_chunk, (chunk, self.size, self.with_digest))
+
+def batched(items, size):
+    """Group an iterable into lists of up to size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
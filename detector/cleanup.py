@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+class BulkCleanup:
+    """
+    Delete the Image rows of a queryset in chunks instead of one row at a time.
+
+    Candidates are paged by primary key (keyset pagination). Each chunk's
+    file references are released and its rows removed with a single DELETE
+    inside one short transaction; files left without references are then
+    unlinked from a thread pool.
+    """
+    def __init__(self, queryset, chunk_size=None, max_rows_per_second=None, workers=None,
+                 checkpoint_path=None, progress=None):
+        config = getattr(settings, 'IMAGE_CLEANUP', {})
+        self.queryset = queryset
+        self.model = queryset.model
+        self.storage = self.model._meta.get_field('image').storage
+        self.chunk_size = chunk_size or config.get('CHUNK_SIZE', 500)
+        self.max_rows_per_second = max_rows_per_second or config.get('MAX_ROWS_PER_SECOND')
+        self.workers = workers or config.get('UNLINK_WORKERS', 4)
+        self.checkpoint_path = checkpoint_path
+        self.progress = progress
+        self.stats = {'deleted': 0, 'files_deleted': 0, 'file_errors': 0, 'chunks': 0, 'last_pk': 0}
+
+    def run(self):
+        """Delete all matching rows and their files, returning the run statistics"""
+        self._load_checkpoint()
+        total = self.queryset.filter(pk__gt=self.stats['last_pk']).count()
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                chunk = list(
+                    self.queryset.filter(pk__gt=self.stats['last_pk'])
+                    .order_by('pk')
+                    .values_list('pk', 'image')[:self.chunk_size]
+                )
+                if not chunk:
+                    break
+
+                self._delete_chunk(chunk, executor)
+                self._save_checkpoint()
+                if self.progress:
+                    self.progress(self.stats, total)
+                self._throttle(started)
+
+        self.stats['elapsed'] = round(time.monotonic() - started, 2)
+        logger.info(f"Bulk cleanup deleted {self.stats['deleted']} rows and "
+                    f"{self.stats['files_deleted']} files in {self.stats['elapsed']}s")
+        self._clear_checkpoint()
+        return self.stats
+
+    def _delete_chunk(self, chunk, executor):
+        pks = [pk for pk, _ in chunk]
+        names = [name for _, name in chunk if name]
+
+        started = time.time()
+        with transaction.atomic():
+            # Files shared with rows outside the chunk only lose a reference
+            doomed = self.storage.release_references(names)
+            # No signals or relations on Image, so this is one DELETE ... WHERE id IN (...)
+            deleted, _ = self.model.objects.filter(pk__in=pks).delete()
+        results = self.storage.delete_unreferenced(doomed, started, executor)
+
+        for result in results.values():
+            if result:
+                self.stats['files_deleted'] += 1
+            elif result is None:
+                self.stats['file_errors'] += 1
+        self.stats['deleted'] += deleted
+        self.stats['chunks'] += 1
+        self.stats['last_pk'] = pks[-1]
+
+    def _throttle(self, started):
+        """Sleep so the overall delete rate stays under max_rows_per_second"""
+        if not self.max_rows_per_second:
+            return
+        expected = self.stats['deleted'] / self.max_rows_per_second
+        elapsed = time.monotonic() - started
+        if expected > elapsed:
+            time.sleep(expected - elapsed)
+
+    def _load_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                self.stats['last_pk'] = json.load(f).get('last_pk', 0)
+            logger.info(f"Resuming cleanup after id {self.stats['last_pk']}")
+
+    def _save_checkpoint(self):
+        if self.checkpoint_path:
+            with open(self.checkpoint_path, 'w') as f:
+                json.dump({'last_pk': self.stats['last_pk']}, f)
+
+    def _clear_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from django.conf import settings
+from .scheduler import LeaderLock
+
+logger = logging.getLogger(__name__)
+
+# Override with settings.COALESCING
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    # Shared by every worker on the host (default <tmp>/realface-inflight)
+    'DIR': None,
+    # Seconds a duplicate waits for the first request before doing the work itself
+    'TIMEOUT': 30,
+    # Seconds between checks on a flight running in another worker
+    'POLL_INTERVAL': 0.05,
+    # Seconds a finished flight's result stays readable by late duplicates
+    'RESULT_TTL': 60,
+}
+
+# How a call to SingleFlight.do got its result
+LEADER = 'leader'        # Ran the function
+SHARED = 'shared'        # Waited for an identical call in this or another worker
+LATE = 'late'            # Reused the result of an identical call that had already finished
+TIMED_OUT = 'timed_out'  # Gave up waiting and ran the function
+
+def get_config():
+    config = dict(DEFAULT_CONFIG, **getattr(settings, 'COALESCING', {}))
+    config['DIR'] = config['DIR'] or os.path.join(tempfile.gettempdir(), 'realface-inflight')
+    return config
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+class SingleFlight:
+    """
+    Runs a function at most once at a time per key across all workers, so
+    identical uploads arriving together are analyzed once. Duplicates in the
+    same process wait on an event; duplicates in other workers wait for the
+    leader's file lock to be released and read the JSON result it left next
+    to it. A duplicate arriving within RESULT_TTL after the leader finished
+    reads that result too, but as LATE rather than SHARED: it never waited.
+    A duplicate whose leader fails, or that waits longer than TIMEOUT, runs
+    the function itself, so coalescing can delay a request but never lose one.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.stats = dict.fromkeys(
+            ('leaders', 'shared_in_process', 'shared_across_workers', 'late_results', 'timeouts'), 0
+        )
+        self.last_cleanup = 0
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def do(self, key, func):
+        """(result, how) of func(), which must return JSON-serializable data; how is LEADER, SHARED, LATE or TIMED_OUT"""
+        config = get_config()
+        if not config['ENABLED']:
+            return func(), LEADER
+
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+
+        if not leader:
+            if not flight.done.wait(config['TIMEOUT']):
+                self._count('timeouts')
+                logger.warning(f"Gave up after {config['TIMEOUT']}s waiting for flight {key}")
+                return func(), TIMED_OUT
+            if flight.failed:
+                return self._across_workers(key, func, config)
+            self._count('shared_in_process')
+            return flight.result, SHARED
+
+        try:
+            flight.result, how = self._across_workers(key, func, config)
+            return flight.result, how
+        except BaseException:
+            flight.failed = True
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def _across_workers(self, key, func, config):
+        os.makedirs(config['DIR'], exist_ok=True)
+        path = os.path.join(config['DIR'], key)
+        lock = LeaderLock(f'{path}.lock')
+        deadline = time.monotonic() + config['TIMEOUT']
+        waited = False
+        try:
+            while not lock.acquire():
+                waited = True
+                if time.monotonic() >= deadline:
+                    self._count('timeouts')
+                    logger.warning(f"Gave up after {config['TIMEOUT']}s waiting for flight {key} in another worker")
+                    return func(), TIMED_OUT
+                time.sleep(config['POLL_INTERVAL'])
+
+            os.utime(f'{path}.lock')  # Marks it in use for _cleanup
+            # A flight in another worker ended while we waited, or before we
+            # arrived; without a fresh result it failed and we take over
+            result = self._read_result(path, config['RESULT_TTL'])
+            if result is not None:
+                self._count('shared_across_workers' if waited else 'late_results')
+                return result, SHARED if waited else LATE
+
+            self._count('leaders')
+            result = func()
+            self._write_result(path, result)
+            return result, LEADER
+        finally:
+            lock.release()
+            self._cleanup(config)
+
+    def _read_result(self, path, ttl):
+        try:
+            if time.time() - os.path.getmtime(f'{path}.json') > ttl:
+                return None
+            with open(f'{path}.json') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_result(self, path, result):
+        with open(f'{path}.json.tmp', 'w') as f:
+            json.dump(result, f)
+        os.replace(f'{path}.json.tmp', f'{path}.json')
+
+    def _cleanup(self, config):
+        """
+        Remove expired results and idle lock files, at most once per
+        RESULT_TTL per worker. A lock file is only removed while nobody holds
+        it; losing the race with a new flight at worst means one duplicate
+        analysis.
+        """
+        now = time.time()
+        if now - self.last_cleanup < config['RESULT_TTL']:
+            return
+        self.last_cleanup = now
+        try:
+            entries = list(os.scandir(config['DIR']))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if now - entry.stat().st_mtime <= config['RESULT_TTL']:
+                    continue
+                if entry.name.endswith('.lock'):
+                    lock = LeaderLock(entry.path)
+                    if lock.acquire():
+                        os.remove(entry.path)
+                        lock.release()
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats, in_flight=len(self.flights))
+        shared = stats['shared_in_process'] + stats['shared_across_workers']
+        calls = stats['leaders'] + shared + stats['late_results'] + stats['timeouts']
+        stats['coalesced_rate'] = round(shared / calls, 4) if calls else None
+        return stats
+
+flights = SingleFlight()
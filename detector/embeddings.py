@@ -0,0 +1,466 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import torch
+from django.conf import settings
+from .models import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Override with settings.EMBEDDINGS
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    # One store per model version under this directory (default BASE_DIR/embeddings)
+    'DIR': None,
+    # Inverted lists an IVF query scans; more is slower and closer to exact
+    'NPROBE': 8,
+    # IVF candidates rescored against the full vectors, per requested result
+    'RERANK': 10,
+    # Rows scored at a time by an exact scan
+    'CHUNK_ROWS': 65536,
+}
+
+VECTORS_FILE = 'vectors.f16'
+IDS_FILE = 'ids.i64'
+META_FILE = 'meta.json'
+INDEX_LINK = 'ivf'
+ROWS_LINK = 'rows'
+
+def get_config():
+    config = dict(DEFAULT_CONFIG, **getattr(settings, 'EMBEDDINGS', {}))
+    config['DIR'] = config['DIR'] or os.path.join(settings.BASE_DIR, 'embeddings')
+    return config
+
+def normalize(vectors):
+    """Scale float vectors (the last axis) to unit length, so dot products are cosine similarities"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+def _top_k(rows, scores, k):
+    """(rows, scores) of the k highest scores, best first"""
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k)[:k]
+        rows, scores = rows[keep], scores[keep]
+    order = np.argsort(-scores, kind='stable')
+    return rows[order], scores[order]
+
+def _scores(vectors, query):
+    """
+    Dot products of float16 rows with a query. Torch multiplies float16
+    directly (accumulating in float32), several times faster than converting
+    the rows to float32 in NumPy first.
+    """
+    return torch.mv(torch.from_numpy(np.asarray(vectors)), torch.from_numpy(query).half()).float().numpy()
+
+def _scan(query, vectors, start, stop, k, chunk_rows):
+    """Exact top k of rows start:stop of a float16 matrix, a chunk at a time"""
+    rows = np.empty(0, dtype=np.int64)
+    scores = np.empty(0, dtype=np.float32)
+    for offset in range(start, stop, chunk_rows):
+        end = min(offset + chunk_rows, stop)
+        chunk_scores = _scores(vectors[offset:end], query)
+        rows, scores = _top_k(
+            np.concatenate([rows, np.arange(offset, end)]), np.concatenate([scores, chunk_scores]), k
+        )
+    return rows, scores
+
+class EmbeddingStore:
+    """
+    Append-only store of unit-length float16 embeddings for one model version:
+    row i of vectors.f16 belongs to the Image whose id is entry i of ids.i64.
+    Writers append under an exclusive file lock, vector first and id second,
+    and readers memory-map as many rows as there are ids. A vector left
+    without its id by a crashed writer is overwritten by the next append.
+    compact() rewrites both files into a new rows-<ns> directory and swaps the
+    rows symlink to it; until the first compaction they live in the store
+    directory itself.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_LINK)
+        self.rows_path = os.path.join(directory, ROWS_LINK)
+        self.dim = self._read_dim()
+        self._lock = threading.Lock()
+        self._snapshot = (None, None, None, None)
+        self._index = (None, None)
+
+    def _read_dim(self):
+        try:
+            with open(os.path.join(self.directory, META_FILE)) as f:
+                return json.load(f)['dim']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _rows_dir(self):
+        """Directory holding the current vectors.f16 and ids.i64"""
+        try:
+            return os.path.join(self.directory, os.readlink(self.rows_path))
+        except OSError:
+            return self.directory
+
+    @staticmethod
+    def _count(rows_dir):
+        try:
+            return os.path.getsize(os.path.join(rows_dir, IDS_FILE)) // 8
+        except OSError:
+            return 0
+
+    def __len__(self):
+        return self._count(self._rows_dir())
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive across threads and worker processes, blocking"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'write.lock'), 'a+') as handle:
+            if fcntl:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+            yield
+
+    def add(self, image_ids, vectors):
+        """Append embeddings for some images"""
+        vectors = normalize(np.atleast_2d(vectors)).astype(np.float16)
+        image_ids = np.asarray(image_ids, dtype=np.int64).reshape(-1)
+        if len(image_ids) != len(vectors):
+            raise ValueError(f"{len(image_ids)} ids for {len(vectors)} vectors")
+
+        with self._write_lock():
+            self.dim = self._read_dim()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                meta_path = os.path.join(self.directory, META_FILE)
+                with open(meta_path + '.tmp', 'w') as f:
+                    json.dump({'dim': self.dim}, f)
+                os.replace(meta_path + '.tmp', meta_path)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embeddings of size {vectors.shape[1]} for a store of size {self.dim}")
+
+            self._append(self._rows_dir(), image_ids, vectors)
+
+    def _append(self, rows_dir, image_ids, vectors):
+        count = self._count(rows_dir)
+        fd = os.open(os.path.join(rows_dir, VECTORS_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, np.ascontiguousarray(vectors).tobytes(), count * self.dim * 2)
+        finally:
+            os.close(fd)
+        with open(os.path.join(rows_dir, IDS_FILE), 'ab') as f:
+            f.truncate(count * 8)  # Drop a partial id from an interrupted write
+            f.write(np.ascontiguousarray(image_ids).tobytes())
+
+    def _rows(self):
+        """(rows directory, vectors, ids) memory maps of every committed row"""
+        rows_dir = self._rows_dir()
+        count = self._count(rows_dir)
+        with self._lock:
+            if self._snapshot[:2] != (rows_dir, count):
+                if count and self.dim is None:
+                    self.dim = self._read_dim()
+                if count:
+                    # Copy-on-write maps: never written, but torch only wraps writable arrays
+                    vectors = np.memmap(os.path.join(rows_dir, VECTORS_FILE), dtype=np.float16, mode='c',
+                                        shape=(count, self.dim))
+                    ids = np.memmap(os.path.join(rows_dir, IDS_FILE), dtype=np.int64, mode='r', shape=(count,))
+                else:
+                    vectors, ids = np.empty((0, self.dim or 0), dtype=np.float16), np.empty(0, dtype=np.int64)
+                self._snapshot = (rows_dir, count, vectors, ids)
+            return rows_dir, *self._snapshot[2:]
+
+    def snapshot(self):
+        """(vectors, ids) memory maps of every committed row"""
+        return self._rows()[1:]
+
+    def compact(self, keep_ids):
+        """
+        Rewrite the store with only the latest row of each image in keep_ids
+        and swap it in atomically. Rows appended meanwhile are carried over;
+        the IVF index is dropped since its row numbers no longer apply.
+        Returns the number of rows removed.
+        """
+        rows_dir, vectors, ids = self._rows()
+        count = len(ids)
+        ids = np.asarray(ids)
+        _, last = np.unique(ids[::-1], return_index=True)
+        rows = np.sort(count - 1 - last)
+        rows = rows[np.isin(ids[rows], keep_ids)]
+        if len(rows) == count:
+            return 0
+
+        new_dir = os.path.join(self.directory, f'{ROWS_LINK}-{time.time_ns()}')
+        os.makedirs(new_dir)
+        chunk_rows = get_config()['CHUNK_ROWS']
+        for start in range(0, len(rows), chunk_rows):
+            chunk = rows[start:start + chunk_rows]
+            self._append(new_dir, ids[chunk], vectors[chunk])
+
+        with self._write_lock():
+            if self._rows_dir() != rows_dir:
+                shutil.rmtree(new_dir, ignore_errors=True)
+                logger.warning(f"{self.directory} was compacted concurrently, skipping")
+                return 0
+            _, vectors, ids = self._rows()
+            if len(ids) > count:
+                self._append(new_dir, ids[count:], vectors[count:])
+            if os.path.lexists(self.index_path):
+                os.remove(self.index_path)
+            link = self.rows_path + '.tmp'
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(os.path.basename(new_dir), link)
+            os.replace(link, self.rows_path)
+
+        # Processes still reading the old rows keep their files open until they remap
+        if rows_dir == self.directory:
+            for name in (VECTORS_FILE, IDS_FILE):
+                os.remove(os.path.join(self.directory, name))
+        else:
+            shutil.rmtree(rows_dir, ignore_errors=True)
+        for name in os.listdir(self.directory):
+            if name.startswith(f'{INDEX_LINK}-'):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        logger.info(f"Compacted {self.directory} from {count} to {len(rows)} embeddings")
+        return count - len(rows)
+
+    def get(self, image_id):
+        """Latest embedding stored for an image as float32, or None"""
+        vectors, ids = self.snapshot()
+        rows = np.flatnonzero(ids == image_id)
+        return vectors[rows[-1]].astype(np.float32) if len(rows) else None
+
+    def stored_ids(self):
+        return set(self.snapshot()[1].tolist())
+
+    def load_index(self):
+        """The current IVF index, reloaded when build_index swaps in a new one"""
+        try:
+            target = os.readlink(self.index_path)
+        except OSError:
+            return None
+        with self._lock:
+            if self._index[0] != target:
+                self._index = (target, IVFIndex(os.path.join(self.directory, target)))
+            return self._index[1]
+
+    def search(self, query, k=10):
+        """
+        (image id, cosine similarity) of the k stored embeddings closest to
+        query, best first. With an IVF index, rows it covers are searched
+        approximately and rows added since it was built exactly.
+        """
+        config = get_config()
+        rows_dir, vectors, ids = self._rows()
+        if not len(ids):
+            return []
+        query = normalize(query)
+        if query.shape != (self.dim,):
+            raise ValueError(f"Query of shape {query.shape} for a store of size {self.dim}")
+
+        index = self.load_index()
+        # An index built before a compaction numbers rows that have since moved
+        if index is not None and index.rows == os.path.basename(rows_dir) and index.built_count <= len(ids):
+            rows, scores = index.search(query, vectors, k, config['NPROBE'], config['RERANK'])
+            tail_rows, tail_scores = _scan(query, vectors, index.built_count, len(ids), k, config['CHUNK_ROWS'])
+            rows, scores = _top_k(np.concatenate([rows, tail_rows]), np.concatenate([scores, tail_scores]), k)
+        else:
+            rows, scores = _scan(query, vectors, 0, len(ids), k, config['CHUNK_ROWS'])
+        return [(int(ids[row]), float(score)) for row, score in zip(rows, scores)]
+
+class IVFIndex:
+    """
+    Inverted file index over a store snapshot: rows grouped by their nearest
+    k-means centroid, with their (optionally PCA-projected) vectors stored in
+    list order so each probed list is one sequential read
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        self.built_count = meta['built_count']
+        self.rows = meta['rows']
+        self.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        self.order = np.load(os.path.join(directory, 'rows.npy'), mmap_mode='r')
+        components_path = os.path.join(directory, 'components.npy')
+        self.components = np.load(components_path) if os.path.exists(components_path) else None
+        self.codes = np.memmap(os.path.join(directory, 'codes.f16'), dtype=np.float16, mode='c',
+                               shape=(self.built_count, meta['code_dim']))
+
+    def project(self, vectors):
+        return vectors @ self.components.T if self.components is not None else vectors
+
+    def search(self, query, vectors, k, nprobe, rerank):
+        """
+        Approximate top k store rows: score the rows in the nprobe closest
+        lists on their codes, then rescore the best k * rerank on vectors
+        """
+        code = self.project(query)
+        lists = np.argsort(-(self.centroids @ code))[:nprobe]
+        rows, scores = [], []
+        for number in lists:
+            start, stop = self.offsets[number], self.offsets[number + 1]
+            rows.append(self.order[start:stop])
+            scores.append(_scores(self.codes[start:stop], code))
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        candidates, _ = _top_k(np.concatenate(rows), np.concatenate(scores), k * rerank)
+        candidates = np.sort(candidates)  # In file order
+        return _top_k(candidates, _scores(vectors[candidates], query), k)
+
+def _assign(points, centroids, chunk_rows=65536):
+    """Index of the closest centroid for every point"""
+    return np.concatenate([
+        np.argmax(points[start:start + chunk_rows] @ centroids.T, axis=1)
+        for start in range(0, len(points), chunk_rows)
+    ])
+
+def _kmeans(points, nlist, iterations, rng):
+    """Spherical k-means: unit-length centroids maximising cosine similarity"""
+    centroids = points[rng.choice(len(points), nlist, replace=False)]
+    for _ in range(iterations):
+        assignments = _assign(points, centroids)
+        counts = np.bincount(assignments, minlength=nlist)
+        order = np.argsort(assignments, kind='stable')
+        sums = np.zeros_like(centroids)
+        used = np.flatnonzero(counts)
+        sums[used] = np.add.reduceat(points[order], np.cumsum(counts)[used] - counts[used])
+        empty = counts == 0
+        sums[empty] = points[rng.choice(len(points), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+def build_index(store, nlist, pca=None, sample=100000, iterations=20, seed=0):
+    """
+    Build an IVF index of every row currently in store and swap it in
+    atomically; searches keep using the previous index until then. Returns
+    the index metadata.
+    """
+    config = get_config()
+    rows_dir, vectors, ids = store._rows()
+    count = len(ids)
+    if count < nlist:
+        raise ValueError(f"{count} embeddings are too few for {nlist} lists")
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    training = vectors[np.sort(rng.choice(count, min(sample, count), replace=False))].astype(np.float32)
+
+    components = None
+    if pca:
+        # Uncentred, so dot products of projections approximate the cosine similarities
+        _, _, vt = np.linalg.svd(training, full_matrices=False)
+        components = vt[:pca]
+        training = training @ components.T
+    centroids = _kmeans(normalize(training), nlist, iterations, rng)
+
+    def project(start, stop):
+        chunk = vectors[start:stop].astype(np.float32)
+        return chunk @ components.T if components is not None else chunk
+
+    chunk_rows = config['CHUNK_ROWS']
+    assignments = np.concatenate([
+        _assign(normalize(project(start, start + chunk_rows)), centroids)
+        for start in range(0, count, chunk_rows)
+    ])
+    order = np.argsort(assignments, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+
+    directory = os.path.join(store.directory, f'{INDEX_LINK}-{time.time_ns()}')
+    os.makedirs(directory)
+    code_dim = pca or store.dim
+    codes = np.memmap(os.path.join(directory, 'codes.f16'), dtype=np.float16, mode='w+', shape=(count, code_dim))
+    for start in range(0, count, chunk_rows):
+        rows = order[start:start + chunk_rows]
+        chunk = vectors[rows].astype(np.float32)
+        codes[start:start + len(rows)] = chunk @ components.T if components is not None else chunk
+    codes.flush()
+    del codes
+    np.save(os.path.join(directory, 'centroids.npy'), centroids)
+    np.save(os.path.join(directory, 'offsets.npy'), offsets)
+    np.save(os.path.join(directory, 'rows.npy'), order.astype(np.int64))
+    if components is not None:
+        np.save(os.path.join(directory, 'components.npy'), components)
+    meta = {
+        'nlist': nlist,
+        'pca': pca,
+        'code_dim': code_dim,
+        'built_count': count,
+        'rows': os.path.basename(rows_dir),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    link = store.index_path + '.tmp'
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(directory), link)
+    os.replace(link, store.index_path)
+    # Processes still searching an old index keep its files open until they reload
+    for name in os.listdir(store.directory):
+        if name.startswith(f'{INDEX_LINK}-') and name != os.path.basename(directory):
+            shutil.rmtree(os.path.join(store.directory, name), ignore_errors=True)
+    logger.info(f"Built IVF index of {count} embeddings in {store.directory} ({meta['seconds']}s)")
+    return meta
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(model_version):
+    """The process-wide store for a model version's embeddings"""
+    with _stores_lock:
+        if model_version not in _stores:
+            name = model_version.replace(os.sep, '_')
+            _stores[model_version] = EmbeddingStore(os.path.join(get_config()['DIR'], name))
+        return _stores[model_version]
+
+def prune_stores():
+    """
+    Compact every model version's store to the images still in the database,
+    so embeddings of images removed by cleanup don't pile up, and rebuild
+    the IVF indexes compaction drops. Returns the number of rows removed.
+    """
+    directory = get_config()['DIR']
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return 0
+    keep_ids = np.fromiter(Image.objects.values_list('pk', flat=True).iterator(), dtype=np.int64)
+    removed = 0
+    for name in names:
+        if not os.path.isdir(os.path.join(directory, name)):
+            continue
+        store = EmbeddingStore(os.path.join(directory, name))
+        index = store.load_index()
+        pruned = store.compact(keep_ids)
+        removed += pruned
+        nlist = len(index.centroids) if index is not None else None
+        if pruned and nlist and len(store) >= nlist:
+            pca = len(index.components) if index.components is not None else None
+            build_index(store, nlist, pca)
+    return removed
+
+def find_similar(store, vector, k=10, exclude=None):
+    """
+    (Image, similarity) of the k stored images closest to vector, skipping
+    image id exclude and images deleted since their embedding was stored
+    """
+    want = k + 1
+    while True:
+        hits = store.search(vector, want)
+        images = Image.objects.in_bulk([image_id for image_id, _ in hits if image_id != exclude])
+        found = [(images[image_id], score) for image_id, score in hits if image_id in images]
+        if len(found) >= k or len(hits) < want:
+            return found[:k]
+        want *= 4
@@ -0,0 +1,84 @@
+import numpy as np
+
+# Labels as in the training data: 1 for real images, 0 for AI-generated ones
+CLASS_NAMES = {1: 'real', 0: 'fake'}
+
+def prob_real(result):
+    """Probability of a real image from an ImageAnalyzer result"""
+    return result['confidence'] if result['is_real'] else 1 - result['confidence']
+
+def roc_auc(labels, scores):
+    """
+    Area under the ROC curve from the rank-sum statistic, with tied scores
+    given their average rank. None when only one class is present.
+    """
+    labels = np.asarray(labels, dtype=bool)
+    scores = np.asarray(scores, dtype=np.float64)
+    positives = int(labels.sum())
+    negatives = len(labels) - positives
+    if not positives or not negatives:
+        return None
+
+    order = np.argsort(scores, kind='mergesort')
+    _, inverse, counts = np.unique(scores[order], return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    ranks = np.empty(len(scores))
+    ranks[order] = ((ends - counts + 1 + ends) / 2)[inverse]
+    return float((ranks[labels].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+def calibration(labels, probs, bins=10):
+    """
+    Reliability of the predicted probability of a real image: per bin the mean
+    prediction against the observed fraction of real images, the expected
+    calibration error (their count-weighted gap) and the Brier score
+    """
+    labels = np.asarray(labels, dtype=np.float64)
+    probs = np.asarray(probs, dtype=np.float64)
+    edges = np.linspace(0, 1, bins + 1)
+    indices = np.clip(np.digitize(probs, edges[1:-1]), 0, bins - 1)
+
+    rows = []
+    ece = 0.0
+    for index in range(bins):
+        mask = indices == index
+        count = int(mask.sum())
+        row = {'low': round(float(edges[index]), 3), 'high': round(float(edges[index + 1]), 3), 'count': count}
+        if count:
+            predicted = float(probs[mask].mean())
+            observed = float(labels[mask].mean())
+            ece += count / len(probs) * abs(predicted - observed)
+            row.update(mean_predicted=round(predicted, 4), fraction_real=round(observed, 4))
+        rows.append(row)
+    return {
+        'ece': round(ece, 4),
+        'brier': round(float(np.mean((probs - labels) ** 2)), 4),
+        'bins': rows,
+    }
+
+def confusion_matrix(labels, predictions):
+    """Counts by actual class, then predicted class"""
+    matrix = {actual: {predicted: 0 for predicted in CLASS_NAMES.values()} for actual in CLASS_NAMES.values()}
+    for label, prediction in zip(labels, predictions):
+        matrix[CLASS_NAMES[int(label)]][CLASS_NAMES[int(prediction)]] += 1
+    return matrix
+
+def classification_report(labels, probs, threshold=0.5, bins=10):
+    """Accuracy, ROC-AUC, calibration and confusion matrix of P(real) predictions"""
+    labels = np.asarray(labels, dtype=np.int64)
+    probs = np.asarray(probs, dtype=np.float64)
+    predictions = (probs > threshold).astype(np.int64)
+    matrix = confusion_matrix(labels, predictions)
+    auc = roc_auc(labels, probs)
+
+    report = {
+        'images': len(labels),
+        'accuracy': round(float((predictions == labels).mean()), 4) if len(labels) else None,
+        'roc_auc': round(auc, 4) if auc is not None else None,
+        'confusion_matrix': matrix,
+    }
+    # Recall per class: how many real images were called real, and fake ones fake
+    for name, row in matrix.items():
+        total = sum(row.values())
+        report[f'{name}_recall'] = round(row[name] / total, 4) if total else None
+    report['calibration'] = calibration(labels, probs, bins) if len(labels) else None
+    return report
@@ -0,0 +1,238 @@
+import csv
+import io
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from detector.ai_model import INFERENCE, ImageAnalyzer, analyzer as production_analyzer
+from detector.batch import DecodePool, batched, iter_images
+from detector.models import BulkAnalysis
+
+FIELDS = ('path', 'digest', 'is_real', 'confidence', 'model_version', 'source', 'error')
+COUNTERS = ('processed', 'analyzed', 'duplicates', 'failed')
+
+class Command(BaseCommand):
+    help = 'Analyze every image under a directory with the production model, writing results as it goes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directory',
+            help='Directory to scan recursively'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['ndjson', 'csv', 'db'],
+            default='ndjson',
+            help='Write results to --output as NDJSON or CSV, or to the BulkAnalysis table'
+        )
+        parser.add_argument(
+            '--output',
+            help='Results file for the ndjson and csv formats'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Progress file (default: <output>.checkpoint, or analyze_directory.checkpoint for db)'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue after the last file recorded in the checkpoint'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=32,
+            help='Images per inference batch'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Decoding processes'
+        )
+        parser.add_argument(
+            '--progress-every',
+            type=float,
+            default=30,
+            help='Seconds between progress lines'
+        )
+
+    def handle(self, *args, **options):
+        self.directory = os.path.abspath(options['directory'])
+        if not os.path.isdir(self.directory):
+            raise CommandError(f'{self.directory} is not a directory')
+        self.format = options['format']
+        output = options['output']
+        if self.format != 'db' and not output:
+            raise CommandError(f'--output is required for the {self.format} format')
+        self.checkpoint_path = options['checkpoint'] or f"{output or 'analyze_directory'}.checkpoint"
+
+        # A batch-sized analyzer sharing the production model and its settings
+        self.analyzer = ImageAnalyzer(
+            model=production_analyzer.model,
+            max_batch_size=options['batch_size'],
+            channels_last=INFERENCE.get('CHANNELS_LAST', False),
+            bf16=INFERENCE.get('BF16_AUTOCAST', False),
+            model_version=production_analyzer.model_version,
+        )
+        self.state = self._start(options)
+        if self.state['completed']:
+            self.stdout.write(self.style.SUCCESS(f'{self.checkpoint_path} records a completed run, nothing to do'))
+            return
+
+        self.output_file = None
+        if self.format != 'db':
+            mode = 'r+b' if options['resume'] and os.path.exists(output) else 'wb'
+            self.output_file = open(output, mode)
+            # Drop rows written after the last checkpoint; they are redone below
+            self.output_file.truncate(self.state['output_offset'])
+            self.output_file.seek(self.state['output_offset'])
+            if self.format == 'csv' and not self.state['output_offset']:
+                self._write_output([dict(zip(FIELDS, FIELDS))])
+
+        # Content already analyzed in this run, by raw SHA-256
+        self.known = {}
+        self.started = self.last_progress = time.perf_counter()
+        self.counts_at_start = dict(self.state['counts'])
+        try:
+            with DecodePool(options['workers'], with_digest=True) as pool:
+                paths = iter_images(self.directory, after=self.state['last_path'])
+                for batch in batched(pool.imap(paths), options['batch_size']):
+                    self._process(batch)
+                    if time.perf_counter() - self.last_progress >= options['progress_every']:
+                        self._report_progress()
+        except KeyboardInterrupt:
+            raise CommandError(f'Interrupted; run again with --resume to continue from {self.checkpoint_path}')
+        finally:
+            if self.output_file:
+                self.output_file.close()
+
+        self.state['completed'] = True
+        self._save_checkpoint()
+        counts = self.state['counts']
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {counts['processed']} files under {self.directory}: {counts['analyzed']} analyzed, "
+            f"{counts['duplicates']} duplicates, {counts['failed']} failed"
+        ))
+
+    def _start(self, options):
+        """Checkpoint state to continue from, or a fresh one"""
+        if options['resume'] and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+            for key, value in (('directory', self.directory), ('format', self.format),
+                               ('model_version', self.analyzer.model_version)):
+                if state[key] != value:
+                    raise CommandError(f'{self.checkpoint_path} is for {key} {state[key]}, not {value}')
+            self.stdout.write(f"Resuming after {state['last_path']} ({state['counts']['processed']} files done)")
+            return state
+
+        if self.format != 'db' and os.path.exists(options['output']) and os.path.getsize(options['output']):
+            raise CommandError(f"{options['output']} already exists; use --resume or remove it")
+        return {
+            'directory': self.directory,
+            'format': self.format,
+            'output': options['output'],
+            'model_version': self.analyzer.model_version,
+            'started_at': timezone.now().isoformat(),
+            'last_path': None,
+            'output_offset': 0,
+            'counts': dict.fromkeys(COUNTERS, 0),
+            'completed': False,
+        }
+
+    def _process(self, batch):
+        """
+        Analyze one batch of decoded files and record it. Content seen earlier
+        in the run or stored by a previous run for this model is not inferred
+        again, nor is content repeated within the batch.
+        """
+        rows = [None] * len(batch)
+        pending = {}
+        for index, item in enumerate(batch):
+            if item.error:
+                rows[index] = self._row(item, None, 'error')
+            elif bytes.fromhex(item.digest) in self.known:
+                rows[index] = self._row(item, self.known[bytes.fromhex(item.digest)], 'duplicate')
+            else:
+                pending.setdefault(item.digest, []).append(index)
+
+        if pending:
+            stored = BulkAnalysis.objects.filter(
+                model_version=self.analyzer.model_version, digest__in=list(pending), error='',
+            ).values_list('digest', 'is_real', 'confidence_score')
+            for digest, is_real, confidence in stored:
+                if digest in pending:
+                    self.known[bytes.fromhex(digest)] = (is_real, confidence)
+                    for index in pending.pop(digest):
+                        rows[index] = self._row(batch[index], (is_real, confidence), 'duplicate')
+
+        if pending:
+            digests = list(pending)
+            results = self.analyzer.analyze_pixels([batch[pending[digest][0]].pixels for digest in digests])
+            for digest, result in zip(digests, results):
+                verdict = (result['is_real'], result['confidence'])
+                self.known[bytes.fromhex(digest)] = verdict
+                for position, index in enumerate(pending[digest]):
+                    rows[index] = self._row(batch[index], verdict, 'model' if position == 0 else 'duplicate')
+
+        self._write_rows(rows)
+        counts = self.state['counts']
+        counts['processed'] += len(rows)
+        for row in rows:
+            counts[{'model': 'analyzed', 'duplicate': 'duplicates', 'error': 'failed'}[row['source']]] += 1
+        self.state['last_path'] = os.path.relpath(batch[-1].path, self.directory)
+        self._save_checkpoint()
+
+    def _row(self, item, verdict, source):
+        is_real, confidence = verdict or (None, None)
+        return {
+            'path': item.path,
+            'digest': item.digest or '',
+            'is_real': is_real,
+            'confidence': round(confidence, 4) if confidence is not None else None,
+            'model_version': self.analyzer.model_version,
+            'source': source,
+            'error': item.error or '',
+        }
+
+    def _write_rows(self, rows):
+        if self.format == 'db':
+            BulkAnalysis.objects.bulk_create([
+                BulkAnalysis(
+                    path=row['path'], digest=row['digest'], model_version=row['model_version'],
+                    is_real=row['is_real'], confidence_score=row['confidence'], error=row['error'],
+                )
+                for row in rows
+            ], ignore_conflicts=True)  # Rows redone after a resume are already there
+        else:
+            self._write_output(rows)
+
+    def _write_output(self, rows):
+        buffer = io.StringIO()
+        if self.format == 'csv':
+            csv.DictWriter(buffer, FIELDS).writerows(rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(row) + '\n')
+        self.output_file.write(buffer.getvalue().encode())
+        # Flushed before every checkpoint, so a killed run loses nothing it recorded as done
+        self.output_file.flush()
+        self.state['output_offset'] = self.output_file.tell()
+
+    def _save_checkpoint(self):
+        tmp_path = f'{self.checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _report_progress(self):
+        self.last_progress = time.perf_counter()
+        counts = self.state['counts']
+        done = counts['processed'] - self.counts_at_start['processed']
+        rate = done / (self.last_progress - self.started)
+        self.stdout.write(
+            f"{counts['processed']} files: {counts['analyzed']} analyzed, {counts['duplicates']} duplicates, "
+            f"{counts['failed']} failed ({rate:.1f} files/sec), at {self.state['last_path']}"
+        )
@@ -0,0 +1,52 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from detector import analytics
+from detector.models import Image
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily analytics rollups from the Image table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            type=datetime.date.fromisoformat,
+            help='First day to rebuild (YYYY-MM-DD, default: the oldest upload still within the cleanup retention)'
+        )
+        parser.add_argument(
+            '--until',
+            type=datetime.date.fromisoformat,
+            help='Last day to rebuild (YYYY-MM-DD, default: today)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Also rebuild days cleanup has already thinned out, replacing their counts with lower ones'
+        )
+
+    def handle(self, *args, **options):
+        bounds = Image.objects.aggregate(first=Min('uploaded_at'), last=Max('uploaded_at'))
+        if not bounds['first'] and not options['since']:
+            self.stdout.write('No images to backfill from')
+            return
+
+        # Older days have lost images to cleanup; their incremental counts are the better record
+        complete = analytics.first_complete_day()
+        since = options['since'] or max(timezone.localdate(bounds['first']), complete)
+        until = options['until'] or timezone.localdate()
+        if since < complete and not options['force']:
+            raise CommandError(f'Days before {complete} have been partly deleted by cleanup and would lose '
+                               'counts; pass --force to rebuild them anyway')
+        if since > until:
+            raise CommandError('--since must not be after --until')
+
+        # One short transaction per day keeps the write lock brief for live uploads
+        day = since
+        rebuilt = 0
+        while day <= until:
+            if analytics.rebuild_day(day, force=options['force']):
+                rebuilt += 1
+            day += datetime.timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups for {rebuilt} days between {since} and {until}'))
@@ -1,20 +1,44 @@
+import argparse
+import gzip
 import os
 import time
 import shutil
 from datetime import datetime
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.core import management
+from django.db import connection
+from detector.db import sqlite_backup, sqlite_integrity_check
+from detector import accounting, snapshots
 
 class Command(BaseCommand):
     help = 'Create a backup of the database and media files'
 
     def add_arguments(self, parser):
+        config = getattr(settings, 'DB_BACKUP', {})
         parser.add_argument(
             '--include-media',
             action='store_true',
             help='Include media files in the backup'
         )
+        parser.add_argument(
+            '--mode',
+            choices=['sqlite', 'json'],
+            default=config.get('MODE', 'sqlite' if connection.vendor == 'sqlite' else 'json'),
+            help='sqlite: online page copy with the SQLite backup API; json: dumpdata fixture'
+        )
+        parser.add_argument(
+            '--compress',
+            action=argparse.BooleanOptionalAction,
+            default=config.get('COMPRESS', True),
+            help='Gzip the SQLite snapshot'
+        )
+        parser.add_argument(
+            '--verify',
+            action=argparse.BooleanOptionalAction,
+            default=config.get('VERIFY', True),
+            help='Run PRAGMA integrity_check on the SQLite snapshot before keeping it'
+        )
 
     def handle(self, *args, **options):
         # Create backups directory if it doesn't exist
@@ -26,14 +50,12 @@ class Command(BaseCommand):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         
         # Backup database
-        db_backup_path = os.path.join(backup_dir, f'db_backup_{timestamp}.json')
         try:
-            management.call_command('dumpdata', 
-                                 exclude=['contenttypes', 'auth.permission'],
-                                 natural_foreign=True,
-                                 natural_primary=True,
-                                 output=db_backup_path,
-                                 indent=2)
+            if options['mode'] == 'sqlite':
+                db_backup_path = self._backup_sqlite(backup_dir, timestamp, options['compress'], options['verify'])
+            else:
+                db_backup_path = self._backup_json(backup_dir, timestamp)
+            accounting.record('backups', os.path.getsize(db_backup_path))
             self.stdout.write(
                 self.style.SUCCESS(f'Successfully created database backup: {db_backup_path}')
             )
@@ -47,9 +69,18 @@ class Command(BaseCommand):
         if options['include_media']:
             media_backup_path = os.path.join(backup_dir, f'media_backup_{timestamp}')
             try:
-                shutil.copytree(settings.MEDIA_ROOT, media_backup_path)
+                # Files unchanged since the last snapshot are hardlinked, not copied
+                previous = snapshots.list_snapshots(backup_dir)
+                stats = snapshots.create_snapshot(
+                    settings.MEDIA_ROOT, media_backup_path, previous[0] if previous else None
+                )
+                manifest_size = os.path.getsize(os.path.join(media_backup_path, snapshots.MANIFEST))
+                accounting.record('backups', stats['copied_bytes'] + manifest_size, stats['copied'] + 1)
                 self.stdout.write(
-                    self.style.SUCCESS(f'Successfully backed up media files: {media_backup_path}')
+                    self.style.SUCCESS(
+                        f'Successfully backed up media files: {media_backup_path} '
+                        f'({stats["copied"]} copied, {stats["linked"]} linked to the previous snapshot)'
+                    )
                 )
             except Exception as e:
                 self.stderr.write(
@@ -59,6 +90,52 @@ class Command(BaseCommand):
         # Clean up old backups (keep last 5)
         self._cleanup_old_backups(backup_dir)
 
+    def _backup_json(self, backup_dir, timestamp):
+        """Serialize every model with dumpdata; portable across database engines"""
+        db_backup_path = os.path.join(backup_dir, f'db_backup_{timestamp}.json')
+        management.call_command('dumpdata',
+                             exclude=['contenttypes', 'auth.permission'],
+                             natural_foreign=True,
+                             natural_primary=True,
+                             output=db_backup_path,
+                             indent=2)
+        return db_backup_path
+
+    def _backup_sqlite(self, backup_dir, timestamp, compress, verify):
+        """
+        Copy database pages into a consistent snapshot without blocking writers,
+        check it, and optionally gzip it. Work happens under temporary names so
+        a failed run never leaves a backup that looks complete.
+        """
+        if connection.vendor != 'sqlite':
+            raise CommandError('The sqlite backup mode needs a SQLite database; use --mode json')
+
+        snapshot_path = os.path.join(backup_dir, f'db_backup_{timestamp}.sqlite3')
+        partial_path = f'{snapshot_path}.partial'
+        try:
+            started = time.monotonic()
+            sqlite_backup(settings.DATABASES['default']['NAME'], partial_path)
+            self.stdout.write(f'Copied database in {time.monotonic() - started:.1f}s')
+
+            if verify:
+                problems = sqlite_integrity_check(partial_path)
+                if problems:
+                    raise CommandError(f'Snapshot failed integrity check: {"; ".join(problems[:5])}')
+
+            if not compress:
+                os.replace(partial_path, snapshot_path)
+                return snapshot_path
+
+            compressed_path = f'{snapshot_path}.gz'
+            with open(partial_path, 'rb') as src, gzip.open(f'{compressed_path}.partial', 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, length=1024 * 1024)
+            os.replace(f'{compressed_path}.partial', compressed_path)
+            return compressed_path
+        finally:
+            for leftover in (partial_path, f'{snapshot_path}.gz.partial'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
     def _cleanup_old_backups(self, backup_dir):
         """Keep only the 5 most recent backups of each type"""
         db_backups = []
@@ -77,14 +154,19 @@ class Command(BaseCommand):
         # Remove old backups
         for old_backup in db_backups[5:]:
             try:
+                size = os.path.getsize(old_backup)
                 os.remove(old_backup)
+                accounting.record('backups', -size, -1)
                 self.stdout.write(f'Removed old database backup: {old_backup}')
             except Exception as e:
                 self.stderr.write(f'Error removing old backup {old_backup}: {str(e)}')
 
         for old_backup in media_backups[5:]:
             try:
+                # Only files no newer snapshot links to are actually freed
+                size, files = snapshots.snapshot_exclusive_usage(old_backup)
                 shutil.rmtree(old_backup)
+                accounting.record('backups', -size, -files)
                 self.stdout.write(f'Removed old media backup: {old_backup}')
             except Exception as e:
                 self.stderr.write(f'Error removing old backup {old_backup}: {str(e)}')
\ No newline at end of file
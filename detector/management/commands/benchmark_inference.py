@@ -0,0 +1,320 @@
+import copy
+import io
+import os
+import time
+import platform
+import torch
+from torch.profiler import ProfilerActivity, profile
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from detector.ai_model import ImageAnalyzer, INFERENCE_MODES, MODEL_VARIANTS
+from detector.utils.benchmark import (
+    PeakRSSSampler, compare_to_baseline, load_results, summarize_latencies,
+    synthetic_image_bytes, write_results,
+)
+
+RESULT_KEY_FIELDS = ('variant', 'mode', 'source', 'batch_size', 'threads')
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def _str_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+class Command(BaseCommand):
+    help = 'Benchmark ImageAnalyzer throughput, latency and memory across model variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--variants',
+            type=_str_list,
+            default=['resnet50', 'mobilenet_v2'],
+            help=f'Comma separated model variants ({", ".join(MODEL_VARIANTS)})'
+        )
+        parser.add_argument(
+            '--artifact',
+            action='append',
+            default=[],
+            help='Model artifact to benchmark (TorchScript or resnet50 state_dict); can be repeated'
+        )
+        parser.add_argument(
+            '--modes',
+            type=_str_list,
+            default=['fp32'],
+            help=f'Comma separated inference modes ({", ".join(INFERENCE_MODES)})'
+        )
+        parser.add_argument(
+            '--batch-sizes',
+            type=_int_list,
+            default=[1, 4, 8],
+            help='Comma separated batch sizes'
+        )
+        parser.add_argument(
+            '--threads',
+            type=_int_list,
+            default=[torch.get_num_threads()],
+            help='Comma separated torch intra-op thread counts'
+        )
+        parser.add_argument(
+            '--resolutions',
+            type=_int_list,
+            default=[224, 800],
+            help='Comma separated edge lengths of the synthetic source images'
+        )
+        parser.add_argument(
+            '--images',
+            help='Directory of on-disk sample images to benchmark in addition to synthetic ones'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help='Timed batches per combination'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=3,
+            help='Untimed warmup batches per combination'
+        )
+        parser.add_argument(
+            '--profile-allocations',
+            action='store_true',
+            help='Also count CPU tensor allocations per image in a separate profiled pass'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write results as JSON to this path'
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Baseline JSON to compare against; regressions make the command fail'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.10,
+            help='Allowed relative regression against the baseline (default 0.10)'
+        )
+
+    def handle(self, *args, **options):
+        sources = self._load_sources(options)
+        analyzers = self._load_analyzers(options)
+        original_threads = torch.get_num_threads()
+        results = []
+
+        try:
+            for variant, reference, mode_analyzers in analyzers:
+                for mode, analyzer in mode_analyzers:
+                    drift = {
+                        source: self._prediction_drift(reference, analyzer, payloads)
+                        for source, payloads in sources
+                    } if mode != 'fp32' else {}
+                    for threads in options['threads']:
+                        torch.set_num_threads(threads)
+                        for source, payloads in sources:
+                            for batch_size in options['batch_sizes']:
+                                row = self._run_combination(
+                                    analyzer, payloads, batch_size,
+                                    options['iterations'], options['warmup'],
+                                )
+                                if options['profile_allocations']:
+                                    row.update(self._profile_allocations(
+                                        analyzer, payloads, batch_size, options['iterations'],
+                                    ))
+                                row.update(drift.get(source, {}))
+                                row.update(variant=variant, mode=mode, bf16_active=analyzer.bf16,
+                                           source=source, batch_size=batch_size, threads=threads)
+                                results.append(row)
+                                self._display_row(row)
+        finally:
+            torch.set_num_threads(original_threads)
+
+        self._add_speedups(results)
+
+        if options['output']:
+            write_results(
+                options['output'], results,
+                timestamp=timezone.now().isoformat(),
+                torch_version=torch.__version__,
+                machine=platform.machine(),
+                cpu_count=os.cpu_count(),
+            )
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if options['baseline']:
+            self._check_baseline(results, options['baseline'], options['threshold'])
+
+    def _load_sources(self, options):
+        """Build (source name, list of encoded images) pairs"""
+        sources = [
+            (f'synthetic_{edge}', [synthetic_image_bytes((edge, edge), seed=seed) for seed in range(8)])
+            for edge in options['resolutions']
+        ]
+
+        if options['images']:
+            payloads = []
+            for name in sorted(os.listdir(options['images'])):
+                if name.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
+                    with open(os.path.join(options['images'], name), 'rb') as f:
+                        payloads.append(f.read())
+            if not payloads:
+                raise CommandError(f"No images found in {options['images']}")
+            sources.append(('disk', payloads))
+
+        return sources
+
+    def _load_analyzers(self, options):
+        """
+        Build (variant name, fp32 reference analyzer, [(mode, analyzer)]) tuples.
+        Every mode runs a copy of the reference weights so drift is comparable.
+        """
+        for mode in options['modes']:
+            if mode not in INFERENCE_MODES:
+                raise CommandError(f'Unknown mode {mode}. Choose from {", ".join(INFERENCE_MODES)}')
+
+        max_batch_size = max(options['batch_sizes'])
+        references = []
+        for variant in options['variants']:
+            if variant not in MODEL_VARIANTS:
+                raise CommandError(f'Unknown variant {variant}. Choose from {", ".join(MODEL_VARIANTS)}')
+            torch.manual_seed(0)
+            references.append((variant, ImageAnalyzer.from_variant(variant, max_batch_size=max_batch_size)))
+
+        for artifact in options['artifact']:
+            if not os.path.exists(artifact):
+                raise CommandError(f'Artifact not found: {artifact}')
+            references.append((
+                os.path.basename(artifact),
+                ImageAnalyzer.from_variant(artifact=artifact, max_batch_size=max_batch_size),
+            ))
+
+        analyzers = []
+        for variant, reference in references:
+            mode_analyzers = [
+                (mode, reference if mode == 'fp32' else ImageAnalyzer(
+                    model=copy.deepcopy(reference.model), max_batch_size=max_batch_size,
+                    **INFERENCE_MODES[mode]
+                ))
+                for mode in options['modes']
+            ]
+            analyzers.append((variant, reference, mode_analyzers))
+        return analyzers
+
+    def _prediction_drift(self, reference, analyzer, payloads):
+        """Compare a mode's predictions with the fp32 reference on a sample set"""
+        expected = reference.analyze_batch([io.BytesIO(payload) for payload in payloads])
+        actual = analyzer.analyze_batch([io.BytesIO(payload) for payload in payloads])
+
+        def prob_real(result):
+            return result['confidence'] if result['is_real'] else 1 - result['confidence']
+
+        drifts = [abs(prob_real(a) - prob_real(e)) for a, e in zip(actual, expected)]
+        return {
+            'max_drift': round(max(drifts), 6),
+            'mean_drift': round(sum(drifts) / len(drifts), 6),
+            'label_flips': sum(a['is_real'] != e['is_real'] for a, e in zip(actual, expected)),
+        }
+
+    def _add_speedups(self, results):
+        """Annotate non-fp32 rows with their throughput relative to the matching fp32 row"""
+        fp32 = {
+            (row['variant'], row['source'], row['batch_size'], row['threads']): row['throughput']
+            for row in results if row['mode'] == 'fp32'
+        }
+        for row in results:
+            base = fp32.get((row['variant'], row['source'], row['batch_size'], row['threads']))
+            if row['mode'] != 'fp32' and base:
+                row['speedup'] = round(row['throughput'] / base, 3)
+                self.stdout.write(
+                    f"{row['variant']} {row['mode']} {row['source']} batch={row['batch_size']} "
+                    f"threads={row['threads']}: {row['speedup']:.2f}x vs fp32, "
+                    f"max drift {row['max_drift']:.4f}, {row['label_flips']} label flip(s)"
+                )
+
+    def _run_combination(self, analyzer, payloads, batch_size, iterations, warmup):
+        """Time full decode + preprocess + inference for one combination"""
+        def next_batch(step):
+            start = step * batch_size
+            return [io.BytesIO(payloads[(start + i) % len(payloads)]) for i in range(batch_size)]
+
+        for step in range(warmup):
+            analyzer.analyze_batch(next_batch(step))
+
+        latencies = []
+        with PeakRSSSampler() as rss:
+            started = time.perf_counter()
+            for step in range(iterations):
+                batch = next_batch(step)
+                batch_started = time.perf_counter()
+                analyzer.analyze_batch(batch)
+                latencies.append(time.perf_counter() - batch_started)
+            elapsed = time.perf_counter() - started
+
+        row = summarize_latencies(latencies)
+        row['throughput'] = round(batch_size * iterations / elapsed, 2)
+        row['peak_rss_mb'] = rss.peak_mb
+        return row
+
+    def _profile_allocations(self, analyzer, payloads, batch_size, iterations):
+        """
+        Count CPU tensor allocations per image, split into input preparation
+        (decode into the pooled batch) and the whole request including the model.
+        """
+        def batch_at(step):
+            return [io.BytesIO(payloads[(step * batch_size + i) % len(payloads)]) for i in range(batch_size)]
+
+        def prepare_input(images):
+            with analyzer.input_pool.acquire() as buffer:
+                batch = buffer[:len(images)]
+                for index, image in enumerate(images):
+                    analyzer._load_into(image, batch[index])
+                analyzer._normalize(batch)
+
+        stats = {}
+        for stage, run in (('input', prepare_input), ('request', analyzer.analyze_batch)):
+            run(batch_at(0))
+            with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+                for step in range(iterations):
+                    run(batch_at(step))
+            sizes = [event.self_cpu_memory_usage for event in prof.events() if event.self_cpu_memory_usage > 0]
+            images = iterations * batch_size
+            stats[f'{stage}_allocations_per_image'] = round(len(sizes) / images, 2)
+            stats[f'{stage}_allocated_kb_per_image'] = round(sum(sizes) / 1024 / images, 1)
+        return stats
+
+    def _display_row(self, row):
+        self.stdout.write(
+            f"{row['variant']:<24} {row['mode']:<18} {row['source']:<14} batch={row['batch_size']:<3} "
+            f"threads={row['threads']:<3} {row['throughput']:>8.1f} img/s  "
+            f"p50={row['p50_ms']:.1f}ms p95={row['p95_ms']:.1f}ms p99={row['p99_ms']:.1f}ms  "
+            f"peak_rss={row['peak_rss_mb']:.0f}MB"
+        )
+        if 'request_allocations_per_image' in row:
+            self.stdout.write(
+                f"{'':<43} allocations/image: input={row['input_allocations_per_image']} "
+                f"({row['input_allocated_kb_per_image']}KB) "
+                f"request={row['request_allocations_per_image']} "
+                f"({row['request_allocated_kb_per_image']}KB)"
+            )
+
+    def _check_baseline(self, results, baseline_path, threshold):
+        if not os.path.exists(baseline_path):
+            raise CommandError(f'Baseline not found: {baseline_path}')
+
+        regressions = compare_to_baseline(
+            results, load_results(baseline_path), RESULT_KEY_FIELDS, threshold,
+            higher_is_better=('throughput',),
+            lower_is_better=('p95_ms', 'peak_rss_mb'),
+        )
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {baseline_path}'))
+            return
+
+        for regression in regressions:
+            self.stderr.write(self.style.ERROR(
+                f"{regression['variant']} {regression['mode']} {regression['source']} batch={regression['batch_size']} "
+                f"threads={regression['threads']}: {regression['metric']} "
+                f"{regression['baseline']} -> {regression['current']}"
+            ))
+        raise CommandError(f'{len(regressions)} performance regression(s) above {threshold:.0%}')
@@ -0,0 +1,122 @@
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from detector.models import Image
+from detector.search import FTS_SCHEMA, FTS_TABLE, match_expression
+from detector.utils.benchmark import summarize_latencies
+
+WORDS = ['holiday', 'portrait', 'sunset', 'beach', 'family', 'scan', 'render', 'export', 'camera', 'photo']
+RESULTS = ['Real Image', 'AI Generated']
+
+class Command(BaseCommand):
+    help = 'Compare admin search latency with LIKE scans against the FTS5 trigram index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=1_000_000,
+            help='Synthetic Image rows to search'
+        )
+        parser.add_argument(
+            '--terms',
+            default='sunset,IMG_4521,generated,portrait_20',
+            help='Comma separated search terms'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Queries per term and method'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write results as JSON to this path'
+        )
+
+    def handle(self, *args, **options):
+        # Use the real detector_image DDL so the benchmark tracks model changes
+        with connection.schema_editor(collect_sql=True) as editor:
+            editor.create_model(Image)
+        schema = editor.collected_sql
+        terms = [term.strip() for term in options['terms'].split(',') if term.strip()]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = sqlite3.connect(os.path.join(tmp_dir, 'bench.sqlite3'))
+            for statement in schema + FTS_SCHEMA:
+                db.execute(statement)
+
+            started = time.perf_counter()
+            self._populate(db, options['rows'])
+            self.stdout.write(f"Inserted {options['rows']} rows in {time.perf_counter() - started:.1f}s (index kept by triggers)")
+
+            results = []
+            for term in terms:
+                row = {'term': term}
+                for method, sql, params in self._queries(term):
+                    matches, latencies = self._measure(db, sql, params, options['repeat'])
+                    row[f'{method}_matches'] = matches
+                    row[method] = summarize_latencies(latencies)
+                results.append(row)
+                self.stdout.write(
+                    f"{term:<14} matches={row['like_matches']:<8} "
+                    f"LIKE p50={row['like']['p50_ms']:.1f}ms p95={row['like']['p95_ms']:.1f}ms  "
+                    f"FTS p50={row['fts']['p50_ms']:.1f}ms p95={row['fts']['p95_ms']:.1f}ms"
+                )
+                if row['like_matches'] != row['fts_matches']:
+                    self.stderr.write(f"{term}: FTS found {row['fts_matches']} rows, LIKE {row['like_matches']}")
+            db.close()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'rows': options['rows'], 'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def _populate(self, db, rows, batch_size=10_000):
+        rng = random.Random(0)
+        uploaded_at = timezone.now().isoformat()
+        for start in range(0, rows, batch_size):
+            batch = []
+            for index in range(start, min(start + batch_size, rows)):
+                if index % 3:
+                    filename = f'{rng.choice(WORDS)}_{rng.randrange(20000101, 20251231)}.jpg'
+                else:
+                    filename = f'IMG_{rng.randrange(10000)}.jpg'
+                result = rng.choice(RESULTS)
+                batch.append((f'uploads/{index}.jpg', uploaded_at, filename, 50000, 800, 600,
+                              result == 'Real Image', rng.uniform(0.5, 1), result, 'bench'))
+            db.executemany(
+                'INSERT INTO detector_image (image, uploaded_at, original_filename, file_size, image_width, '
+                'image_height, is_real, confidence_score, analysis_result, model_version) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                batch
+            )
+        db.commit()
+
+    def _queries(self, term):
+        # The admin's changelist: matching rows, newest first, one page (it also counts them)
+        like = f'%{term}%'
+        yield 'like', (
+            'SELECT id FROM detector_image WHERE original_filename LIKE ? OR analysis_result LIKE ? '
+            'ORDER BY uploaded_at DESC LIMIT 100'
+        ), (like, like)
+        yield 'fts', (
+            f'SELECT id FROM detector_image WHERE id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?) '
+            'ORDER BY uploaded_at DESC LIMIT 100'
+        ), (match_expression([term]),)
+
+    def _measure(self, db, sql, params, repeat):
+        count_sql = f'SELECT COUNT(*) FROM ({sql.rsplit(" ORDER BY", 1)[0]})'
+        latencies = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            matches = db.execute(count_sql, params).fetchone()[0]
+            db.execute(sql, params).fetchall()
+            latencies.append(time.perf_counter() - started)
+        return matches, latencies
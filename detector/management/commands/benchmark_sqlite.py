@@ -0,0 +1,149 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from detector.db import SQLITE_PROFILES, apply_sqlite_pragmas
+from detector.models import Image
+from detector.utils.benchmark import summarize_latencies
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def _write_uploads(db_path, pragmas, immediate, uploads, think_time, worker_id):
+    """
+    One writer process: create an Image row per upload, read it back and record
+    its analysis, mirroring the statements /analyze/ issues in autocommit mode.
+    """
+    db = sqlite3.connect(db_path, isolation_level=None)
+    apply_sqlite_pragmas(db, pragmas)
+    begin = 'BEGIN IMMEDIATE' if immediate else 'BEGIN'
+    latencies = []
+    errors = 0
+
+    for index in range(uploads):
+        started = time.perf_counter()
+        try:
+            db.execute(begin)
+            cursor = db.execute(
+                'INSERT INTO detector_image (image, uploaded_at, original_filename, file_size, '
+                'image_width, image_height) VALUES (?, ?, ?, ?, ?, ?)',
+                (f'uploads/{worker_id}_{index}.jpg', timezone.now().isoformat(), 'bench.jpg', 50000, 800, 600)
+            )
+            db.execute('COMMIT')
+            row_id = cursor.lastrowid
+
+            if think_time:
+                time.sleep(think_time)  # Inference happens outside any transaction
+
+            db.execute('SELECT id, image FROM detector_image WHERE id = ?', (row_id,)).fetchone()
+            db.execute(begin)
+            db.execute(
+                'UPDATE detector_image SET is_real = ?, confidence_score = ?, analysis_result = ? WHERE id = ?',
+                (True, 0.9, 'Real Image', row_id)
+            )
+            db.execute('COMMIT')
+            latencies.append(time.perf_counter() - started)
+        except sqlite3.OperationalError:
+            errors += 1
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+
+    db.close()
+    return latencies, errors
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent Image writers against SQLite with and without a performance profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles',
+            default='default,high_concurrency',
+            help=f'Comma separated SQLite profiles to compare ({", ".join(SQLITE_PROFILES)})'
+        )
+        parser.add_argument(
+            '--writers',
+            type=_int_list,
+            default=[1, 4, 8],
+            help='Comma separated numbers of concurrent writer processes'
+        )
+        parser.add_argument(
+            '--uploads',
+            type=int,
+            default=200,
+            help='Uploads per writer'
+        )
+        parser.add_argument(
+            '--think-ms',
+            type=float,
+            default=0,
+            help='Simulated analysis time between creating and updating a row'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write results as JSON to this path'
+        )
+
+    def handle(self, *args, **options):
+        profiles = [name.strip() for name in options['profiles'].split(',') if name.strip()]
+        for name in profiles:
+            if name not in SQLITE_PROFILES:
+                raise CommandError(f'Unknown profile {name}. Choose from {", ".join(SQLITE_PROFILES)}')
+
+        # Use the real detector_image DDL so the benchmark tracks model changes
+        with connection.schema_editor(collect_sql=True) as editor:
+            editor.create_model(Image)
+        schema = editor.collected_sql
+
+        results = []
+        for name in profiles:
+            for writers in options['writers']:
+                row = self._run(name, writers, schema, options)
+                results.append(row)
+                self.stdout.write(
+                    f"{name:<18} writers={writers:<3} {row['uploads_per_second']:>8.1f} uploads/s  "
+                    f"p50={row['p50_ms']:.1f}ms p95={row['p95_ms']:.1f}ms p99={row['p99_ms']:.1f}ms  "
+                    f"locked_errors={row['errors']}"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def _run(self, profile, writers, schema, options):
+        pragmas = SQLITE_PROFILES[profile]
+        # The tuned profile pairs with transaction_mode IMMEDIATE, as in settings_prod
+        immediate = profile != 'default'
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'bench.sqlite3')
+            db = sqlite3.connect(db_path)
+            for statement in schema:
+                db.execute(statement)
+            db.commit()
+            db.close()
+
+            jobs = [
+                (db_path, pragmas, immediate, options['uploads'], options['think_ms'] / 1000, worker_id)
+                for worker_id in range(writers)
+            ]
+            started = time.perf_counter()
+            with multiprocessing.Pool(writers) as pool:
+                outcomes = pool.starmap(_write_uploads, jobs)
+            elapsed = time.perf_counter() - started
+
+        latencies = [latency for worker_latencies, _ in outcomes for latency in worker_latencies]
+        row = {
+            'profile': profile,
+            'writers': writers,
+            'uploads': len(latencies),
+            'errors': sum(errors for _, errors in outcomes),
+            'uploads_per_second': round(len(latencies) / elapsed, 2),
+        }
+        row.update(summarize_latencies(latencies))
+        return row
@@ -0,0 +1,104 @@
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from detector import embeddings
+from detector.ai_model import analyzer
+from detector.batch import batched
+from detector.models import Image
+
+class Command(BaseCommand):
+    help = 'Build the IVF index used for similar-image search, optionally embedding images analyzed before the store existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--nlist',
+            type=int,
+            help='Inverted lists (k-means centroids); default about 4 * sqrt(embeddings)'
+        )
+        parser.add_argument(
+            '--pca',
+            type=int,
+            help='Project the indexed vectors to this many dimensions (e.g. 256) to shrink the index'
+        )
+        parser.add_argument(
+            '--sample',
+            type=int,
+            default=100000,
+            help='Embeddings used to train the centroids and projection'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help='k-means iterations'
+        )
+        parser.add_argument(
+            '--min-size',
+            type=int,
+            default=50000,
+            help='Skip building below this many embeddings; exact search is fast enough there'
+        )
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='First embed stored images that have no embedding for the deployed model'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=16,
+            help='Images per inference batch when backfilling'
+        )
+
+    def handle(self, *args, **options):
+        if analyzer.embedding_dim is None:
+            raise CommandError(f'Model {analyzer.model_version} does not provide embeddings')
+        store = embeddings.get_store(analyzer.model_version)
+        if options['backfill']:
+            self._backfill(store, options['batch_size'])
+
+        count = len(store)
+        if count < options['min_size']:
+            self.stdout.write(f'{count} embeddings for {analyzer.model_version}, below --min-size; '
+                              'searches scan them exactly')
+            return
+        nlist = options['nlist'] or int(4 * count ** 0.5)
+        if options['pca'] and not 0 < options['pca'] < store.dim:
+            raise CommandError(f'--pca must be between 1 and {store.dim - 1}')
+        try:
+            meta = embeddings.build_index(store, nlist, options['pca'], options['sample'], options['iterations'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {meta['built_count']} embeddings in {nlist} lists of {meta['code_dim']} dimensions "
+            f"in {meta['seconds']}s"
+        ))
+
+    def _backfill(self, store, batch_size):
+        stored = store.stored_ids()
+        rows = Image.objects.exclude(image='').values_list('pk', 'image').iterator()
+        started = time.perf_counter()
+        added = failed = 0
+        for batch in batched((row for row in rows if row[0] not in stored), batch_size):
+            ids, paths = [], []
+            for pk, name in batch:
+                path = os.path.join(settings.MEDIA_ROOT, name)
+                if os.path.exists(path):
+                    ids.append(pk)
+                    paths.append(path)
+                else:
+                    failed += 1
+            try:
+                results = analyzer.analyze_batch(paths, embeddings=True)
+            except Exception as e:
+                # One unreadable file fails the batch; retry its images one at a time
+                self.stderr.write(f'Batch failed ({e}), retrying images individually')
+                results = [analyzer.analyze_image(path, embeddings=True) for path in paths]
+            kept = [(pk, result['embedding']) for pk, result in zip(ids, results) if result]
+            failed += len(ids) - len(kept)
+            if kept:
+                store.add([pk for pk, _ in kept], [vector for _, vector in kept])
+                added += len(kept)
+        self.stdout.write(f'Backfilled {added} embeddings in {time.perf_counter() - started:.1f}s '
+                          f'({failed} images unreadable)')
@@ -6,6 +6,9 @@ import os
 import psutil
 import json
 from datetime import datetime, timedelta
+from detector import accounting
+from detector.metrics import sampler
+from detector.tasks import TaskStatus
 
 class Command(BaseCommand):
     help = 'Check system health and background task status'
@@ -31,12 +34,14 @@ class Command(BaseCommand):
 
     def _check_health(self):
         """Gather system health information"""
-        process = psutil.Process()
-        
+        # No background sampler runs in a management command
+        metrics = sampler.measure()
+
         # Check disk usage for media and backup directories
-        media_usage = self._get_directory_size(settings.MEDIA_ROOT)
+        usage = accounting.get_usage()
+        media_usage = usage.get('media', {}).get('bytes', 0)
         backup_dir = os.path.join(settings.BASE_DIR, 'backups')
-        backup_usage = self._get_directory_size(backup_dir) if os.path.exists(backup_dir) else 0
+        backup_usage = usage.get('backups', {}).get('bytes', 0)
         
         # Get latest backup info
         latest_backup = self._get_latest_backup_info(backup_dir)
@@ -44,8 +49,8 @@ class Command(BaseCommand):
         return {
             'timestamp': timezone.now().isoformat(),
             'system': {
-                'cpu_percent': psutil.cpu_percent(interval=1),
-                'memory_percent': process.memory_percent(),
+                'cpu_percent': metrics['cpu_percent'],
+                'memory_percent': metrics['memory_percent'],
                 'disk_usage': {
                     'media': self._format_size(media_usage),
                     'backups': self._format_size(backup_usage),
@@ -60,16 +65,6 @@ class Command(BaseCommand):
             'cache_status': self._check_cache_status(),
         }
 
-    def _get_directory_size(self, path):
-        """Calculate total size of a directory"""
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                if not os.path.islink(fp):
-                    total_size += os.path.getsize(fp)
-        return total_size
-
     def _format_size(self, size):
         """Format size in bytes to human readable format"""
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -86,16 +81,16 @@ class Command(BaseCommand):
             return "Unknown"
 
     def _check_task_status(self, task_name):
-        """Check if a background task is running"""
-        last_run = cache.get(f'last_run_{task_name}')
-        is_running = cache.get(f'task_running_{task_name}')
-        
+        """Check if a scheduled job is running"""
+        status = TaskStatus(task_name).as_dict()
+        last_run = status['last_run']
+
         if last_run:
             # Convert datetime to ISO format string for JSON serialization
             last_run = last_run.isoformat()
-        
+
         return {
-            'running': bool(is_running),
+            'running': status['running'],
             'last_run': last_run,
         }
 
@@ -1,9 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from django.conf import settings
+from detector.cleanup import BulkCleanup
 from detector.models import Image
 import datetime
-import os
 
 class Command(BaseCommand):
     help = 'Cleanup old analyzed images to free up storage space'
@@ -20,42 +19,58 @@ class Command(BaseCommand):
             action='store_true',
             help='Only delete images that have been analyzed'
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Rows deleted per transaction (default IMAGE_CLEANUP CHUNK_SIZE or 500)'
+        )
+        parser.add_argument(
+            '--rate-limit',
+            type=float,
+            help='Maximum rows deleted per second, to protect foreground requests'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Threads used to unlink image files'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Progress file that lets an interrupted run with the same options resume where it stopped'
+        )
 
     def handle(self, *args, **options):
         days = options['days']
         analyzed_only = options['analyzed_only']
         cutoff_date = timezone.now() - datetime.timedelta(days=days)
-        
+
         # Build query
         query = Image.objects.filter(uploaded_at__lt=cutoff_date)
         if analyzed_only:
             query = query.exclude(analysis_result__isnull=True)
-        
-        # Get count before deletion
-        total_count = query.count()
-        
-        # Delete images and their files
-        deleted_count = 0
-        failed_count = 0
-        
-        for image in query:
-            try:
-                # The delete() method will handle file deletion through our model's delete() method
-                image.delete()
-                deleted_count += 1
-            except Exception as e:
-                failed_count += 1
-                self.stderr.write(f"Failed to delete image {image.id}: {str(e)}")
-        
+
+        cleanup = BulkCleanup(
+            query,
+            chunk_size=options['chunk_size'],
+            max_rows_per_second=options['rate_limit'],
+            workers=options['workers'],
+            checkpoint_path=options['checkpoint'],
+            progress=self._report_progress,
+        )
+        stats = cleanup.run()
+
         # Report results
         self.stdout.write(
             self.style.SUCCESS(
-                f'Successfully deleted {deleted_count} images older than {days} days'
-                f'{" (analyzed only)" if analyzed_only else ""}'
+                f'Successfully deleted {stats["deleted"]} images older than {days} days'
+                f'{" (analyzed only)" if analyzed_only else ""} in {stats["elapsed"]}s'
             )
         )
-        
-        if failed_count:
+
+        if stats['file_errors']:
             self.stderr.write(
-                self.style.WARNING(f'Failed to delete {failed_count} images')
-            )
\ No newline at end of file
+                self.style.WARNING(f'Failed to delete {stats["file_errors"]} image files')
+            )
+
+    def _report_progress(self, stats, total):
+        self.stdout.write(f'Deleted {stats["deleted"]}/{total} images ({stats["files_deleted"]} files)')
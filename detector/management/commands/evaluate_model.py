@@ -0,0 +1,222 @@
+import collections
+import copy
+import os
+import platform
+import time
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from detector.ai_model import INFERENCE_MODES, MODEL_PATH, MODEL_VARIANTS, ImageAnalyzer
+from detector.batch import DecodePool, iter_images
+from detector.evaluation import classification_report, prob_real
+from detector.utils.benchmark import summarize_latencies, write_results
+
+def _str_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+class Command(BaseCommand):
+    help = 'Evaluate model variants on a labelled real/ and fake/ directory: accuracy, calibration and speed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directory',
+            help='Directory with real/ and fake/ subdirectories (searched recursively)'
+        )
+        parser.add_argument(
+            '--variants',
+            type=_str_list,
+            default=[],
+            help=f'Comma separated model variants ({", ".join(MODEL_VARIANTS)})'
+        )
+        parser.add_argument(
+            '--artifact',
+            action='append',
+            default=[],
+            help='Model artifact to evaluate (TorchScript or resnet50 state_dict); can be repeated. '
+                 'Without variants or artifacts the deployed model is evaluated.'
+        )
+        parser.add_argument(
+            '--modes',
+            type=_str_list,
+            default=['fp32'],
+            help=f'Comma separated inference modes ({", ".join(INFERENCE_MODES)})'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=16,
+            help='Images per inference batch'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Decoding processes'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Evaluate at most this many images per class'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.5,
+            help='Probability of a real image above which it is predicted real'
+        )
+        parser.add_argument(
+            '--bins',
+            type=int,
+            default=10,
+            help='Calibration bins'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the full report as JSON to this path'
+        )
+
+    def handle(self, *args, **options):
+        for class_dir in ('real', 'fake'):
+            if not os.path.isdir(os.path.join(options['directory'], class_dir)):
+                raise CommandError(f"{options['directory']} has no {class_dir}/ subdirectory")
+        analyzers = self._load_analyzers(options)
+
+        labels = []
+        probs = {name: [] for name, _ in analyzers}
+        latencies = {name: [] for name, _ in analyzers}
+        failed = []
+        decode_wait = decode_time = 0.0
+
+        # Decode results come back in path order, so labels queue alongside
+        pending_labels = collections.deque()
+
+        def paths():
+            for path, label in self._labelled_paths(options):
+                pending_labels.append(label)
+                yield path
+
+        started = time.perf_counter()
+        with DecodePool(options['workers']) as pool:
+            decoded = pool.imap(paths())
+            while True:
+                waited = time.perf_counter()
+                batch = []
+                for item in decoded:
+                    label = pending_labels.popleft()
+                    decode_time += item.decode_seconds
+                    if item.error:
+                        failed.append((item.path, item.error))
+                        continue
+                    batch.append((item.pixels, label))
+                    if len(batch) == options['batch_size']:
+                        break
+                decode_wait += time.perf_counter() - waited
+                if not batch:
+                    break
+
+                pixels = [item[0] for item in batch]
+                labels.extend(item[1] for item in batch)
+                for name, analyzer in analyzers:
+                    batch_started = time.perf_counter()
+                    results = analyzer.analyze_pixels(pixels)
+                    latencies[name].append(time.perf_counter() - batch_started)
+                    probs[name].extend(prob_real(result) for result in results)
+        elapsed = time.perf_counter() - started
+
+        if not labels:
+            raise CommandError('No images could be evaluated')
+        for path, error in failed[:20]:
+            self.stderr.write(f'Could not decode {path}: {error}')
+
+        rows = []
+        for name, _ in analyzers:
+            row = {'analyzer': name}
+            row.update(classification_report(labels, probs[name], options['threshold'], options['bins']))
+            row['images_per_second'] = round(len(labels) / sum(latencies[name]), 2)
+            row.update({f'batch_{key}': value for key, value in summarize_latencies(latencies[name]).items()})
+            rows.append(row)
+            self._display_row(row)
+
+        summary = {
+            'images': len(labels),
+            'failed': len(failed),
+            'wall_seconds': round(elapsed, 2),
+            'images_per_second': round(len(labels) / elapsed, 2),
+            # Main process blocked on decoding versus total decode work across workers
+            'decode_wait_seconds': round(decode_wait, 2),
+            'decode_cpu_seconds': round(decode_time, 2),
+            'workers': options['workers'],
+            'batch_size': options['batch_size'],
+        }
+        self.stdout.write(
+            f"{summary['images']} images ({summary['failed']} undecodable) in {summary['wall_seconds']}s: "
+            f"{summary['images_per_second']} images/sec end to end for {len(analyzers)} analyzer(s), "
+            f"{summary['decode_wait_seconds']}s waiting on {options['workers']} decode worker(s)"
+        )
+
+        if options['output']:
+            write_results(
+                options['output'], rows,
+                summary=summary,
+                directory=os.path.abspath(options['directory']),
+                timestamp=timezone.now().isoformat(),
+                torch_version=torch.__version__,
+                machine=platform.machine(),
+                cpu_count=os.cpu_count(),
+            )
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _labelled_paths(self, options):
+        """(path, label) for every image, real ones first"""
+        for class_dir, label in (('real', 1), ('fake', 0)):
+            paths = iter_images(os.path.join(options['directory'], class_dir))
+            for count, path in enumerate(paths):
+                if options['limit'] is not None and count >= options['limit']:
+                    break
+                yield path, label
+
+    def _load_analyzers(self, options):
+        """(name, analyzer) for every variant or artifact in every mode"""
+        for mode in options['modes']:
+            if mode not in INFERENCE_MODES:
+                raise CommandError(f'Unknown mode {mode}. Choose from {", ".join(INFERENCE_MODES)}')
+
+        references = []
+        for variant in options['variants']:
+            if variant not in MODEL_VARIANTS:
+                raise CommandError(f'Unknown variant {variant}. Choose from {", ".join(MODEL_VARIANTS)}')
+            references.append((variant, ImageAnalyzer.from_variant(variant, max_batch_size=options['batch_size'])))
+
+        artifacts = options['artifact']
+        if not artifacts and not options['variants']:
+            artifacts = [os.path.join(settings.BASE_DIR, MODEL_PATH)]
+        for artifact in artifacts:
+            if not os.path.exists(artifact):
+                raise CommandError(f'Artifact not found: {artifact}')
+            analyzer = ImageAnalyzer.from_variant(artifact=artifact, max_batch_size=options['batch_size'])
+            references.append((analyzer.model_version, analyzer))
+
+        analyzers = []
+        for name, reference in references:
+            for mode in options['modes']:
+                analyzer = reference if mode == 'fp32' else ImageAnalyzer(
+                    model=copy.deepcopy(reference.model), max_batch_size=options['batch_size'],
+                    model_version=reference.model_version, **INFERENCE_MODES[mode]
+                )
+                analyzers.append((f'{name} {mode}', analyzer))
+        return analyzers
+
+    def _display_row(self, row):
+        matrix = row['confusion_matrix']
+        auc = f"{row['roc_auc']:.4f}" if row['roc_auc'] is not None else 'n/a'
+        self.stdout.write(
+            f"{row['analyzer']:<36} acc={row['accuracy']:.4f} auc={auc} "
+            f"ece={row['calibration']['ece']:.4f} brier={row['calibration']['brier']:.4f}  "
+            f"{row['images_per_second']:>7.1f} img/s  batch p50={row['batch_p50_ms']:.1f}ms "
+            f"p95={row['batch_p95_ms']:.1f}ms p99={row['batch_p99_ms']:.1f}ms"
+        )
+        self.stdout.write(
+            f"{'':<36} real->real={matrix['real']['real']} real->fake={matrix['real']['fake']} "
+            f"fake->fake={matrix['fake']['fake']} fake->real={matrix['fake']['real']}"
+        )
@@ -0,0 +1,356 @@
+import hashlib
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from detector.utils.benchmark import summarize_latencies, synthetic_image_bytes
+
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+def _str_list(value):
+    return [item.strip().lower() for item in value.split(',') if item.strip()]
+
+def encode_multipart(field, filename, payload, content_type):
+    """Encode a single file upload as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'.encode(),
+        f'Content-Type: {content_type}\r\n\r\n'.encode(),
+        payload,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return body, f'multipart/form-data; boundary={boundary}'
+
+def payload_for_trace_entry(entry):
+    """
+    Rebuild a deterministic upload for a trace entry. The same hash always
+    yields the same bytes, so duplicates in the trace stay duplicates.
+    """
+    edge = max(16, int((entry['size'] / 3) ** 0.5))
+    image_format = entry.get('format', 'jpeg')
+    seed = int(entry['hash'][:8], 16)
+    return synthetic_image_bytes((edge, edge), format=image_format.upper(), seed=seed), image_format
+
+class UploadClient(threading.local):
+    """Per-thread keep-alive connection to the /analyze/ endpoint with a CSRF token"""
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+        self.base_url = url.rstrip('/')
+        self.csrf_token = None
+
+    def _fetch_csrf_token(self):
+        self.connection.request('GET', '/')
+        response = self.connection.getresponse()
+        response.read()
+        for header, value in response.getheaders():
+            if header.lower() == 'set-cookie' and value.startswith('csrftoken='):
+                self.csrf_token = value.split(';')[0].split('=', 1)[1]
+        if not self.csrf_token:
+            raise RuntimeError('Home page did not set a csrftoken cookie')
+
+    def upload(self, payload, image_format):
+        if self.csrf_token is None:
+            self._fetch_csrf_token()
+
+        body, content_type = encode_multipart(
+            'image', f'loadtest.{image_format}', payload, CONTENT_TYPES[image_format]
+        )
+        headers = {
+            'Content-Type': content_type,
+            'Cookie': f'csrftoken={self.csrf_token}',
+            'X-CSRFToken': self.csrf_token,
+            'Referer': f'{self.base_url}/',
+        }
+        try:
+            self.connection.request('POST', '/analyze/', body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            # Drop the broken keep-alive connection; the next request reconnects
+            self.connection.close()
+            raise
+
+class Command(BaseCommand):
+    help = 'Load test the /analyze/ endpoint with synthetic uploads or a replayed trace'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8765',
+            help='Base URL of the server under test'
+        )
+        parser.add_argument(
+            '--start-server',
+            action='store_true',
+            help='Start a local gunicorn for the duration of the test'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=2,
+            help='Gunicorn workers when using --start-server'
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['synthetic', 'replay'],
+            default='synthetic',
+            help='Generate synthetic uploads or replay a recorded trace'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=100,
+            help='Synthetic requests per concurrency level'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=_int_list,
+            default=[1, 2, 4, 8],
+            help='Comma separated concurrency levels (replay uses the highest)'
+        )
+        parser.add_argument(
+            '--duplicate-ratio',
+            type=float,
+            default=0.3,
+            help='Fraction of synthetic uploads that repeat an earlier image'
+        )
+        parser.add_argument(
+            '--formats',
+            type=_str_list,
+            default=['jpeg', 'png'],
+            help='Comma separated synthetic upload formats (jpeg, png)'
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=512,
+            help='Edge length of synthetic images in pixels'
+        )
+        parser.add_argument(
+            '--trace',
+            help='NDJSON trace to replay: one {"t", "hash", "size", "format"} object per line'
+        )
+        parser.add_argument(
+            '--speed',
+            type=float,
+            default=1.0,
+            help='Replay speed multiplier for trace arrival times'
+        )
+        parser.add_argument(
+            '--save-trace',
+            help='Record the last synthetic level as a replayable trace'
+        )
+        parser.add_argument(
+            '--max-error-rate',
+            type=float,
+            default=0.01,
+            help='Highest error rate a level may have to count towards saturation throughput'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=60,
+            help='Per request timeout in seconds'
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the report as JSON to this path'
+        )
+
+    def handle(self, *args, **options):
+        for image_format in options['formats']:
+            if image_format not in CONTENT_TYPES:
+                raise CommandError(f'Unsupported format {image_format}')
+
+        server = self._start_server(options) if options['start_server'] else None
+        try:
+            if options['mode'] == 'replay':
+                levels = [self._run_replay(options)]
+            else:
+                levels = [
+                    self._run_synthetic(options, concurrency, run)
+                    for run, concurrency in enumerate(options['concurrency'])
+                ]
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=30)
+
+        acceptable = [level for level in levels if level['error_rate'] <= options['max_error_rate']]
+        report = {
+            'url': options['url'],
+            'mode': options['mode'],
+            'levels': levels,
+            'saturation_throughput': max((level['throughput'] for level in acceptable), default=0.0),
+        }
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Saturation throughput: {report['saturation_throughput']:.1f} req/s "
+            f"(error rate <= {options['max_error_rate']:.1%})"
+        ))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+
+    def _start_server(self, options):
+        """Start gunicorn with the project config bound to the target URL"""
+        parts = urlsplit(options['url'])
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'realface.settings'))
+        command = [
+            sys.executable, '-m', 'gunicorn', 'realface.wsgi:application',
+            '--config', os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'),
+            '--bind', f'{parts.hostname}:{parts.port}',
+            '--workers', str(options['workers']),
+            '--access-logfile', os.devnull,
+        ]
+        self.stdout.write(f"Starting gunicorn on {parts.hostname}:{parts.port}")
+        server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+        deadline = time.monotonic() + 120
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn exited with code {server.returncode}')
+            try:
+                connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+                connection.request('GET', '/')
+                if connection.getresponse().status == 200:
+                    return server
+            except OSError:
+                pass
+            time.sleep(0.5)
+
+        server.terminate()
+        raise CommandError('gunicorn did not start serving within 120 seconds')
+
+    def _synthetic_workload(self, options, run):
+        """
+        Pre-generate (payload, format, arrival time) tuples so encoding is not
+        timed. Each run gets fresh images so earlier levels don't warm the cache.
+        """
+        rng = random.Random(run)
+        workload = []
+        for index in range(run * options['requests'], (run + 1) * options['requests']):
+            if workload and rng.random() < options['duplicate_ratio']:
+                payload, image_format, _ = rng.choice(workload)
+            else:
+                image_format = rng.choice(options['formats'])
+                payload = synthetic_image_bytes(
+                    (options['size'], options['size']), format=image_format.upper(), seed=index
+                )
+            workload.append((payload, image_format, 0.0))
+        return workload
+
+    def _run_synthetic(self, options, concurrency, run):
+        workload = self._synthetic_workload(options, run)
+        self.stdout.write(f'Running {len(workload)} synthetic uploads at concurrency {concurrency}')
+        level, arrivals = self._execute(options, workload, concurrency, open_loop=False)
+
+        if options['save_trace']:
+            self._save_trace(options['save_trace'], workload, arrivals)
+        return level
+
+    def _run_replay(self, options):
+        if not options['trace']:
+            raise CommandError('--trace is required in replay mode')
+
+        workload = []
+        with open(options['trace']) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    payload, image_format = payload_for_trace_entry(entry)
+                    workload.append((payload, image_format, entry['t'] / options['speed']))
+        workload.sort(key=lambda item: item[2])
+
+        concurrency = max(options['concurrency'])
+        self.stdout.write(f"Replaying {len(workload)} uploads from {options['trace']} at up to {concurrency} in flight")
+        level, _ = self._execute(options, workload, concurrency, open_loop=True)
+        return level
+
+    def _save_trace(self, path, workload, arrivals):
+        with open(path, 'w') as f:
+            for (payload, image_format, _), arrival in zip(workload, arrivals):
+                f.write(json.dumps({
+                    't': round(arrival, 3),
+                    'hash': hashlib.md5(payload).hexdigest(),
+                    'size': len(payload),
+                    'format': image_format,
+                }) + '\n')
+
+    def _execute(self, options, workload, concurrency, open_loop):
+        """
+        Send the workload and collect latencies. In open-loop mode requests are
+        due at their arrival time regardless of how many are still pending;
+        one that waits for a free connection counts that wait in its latency,
+        as a user would see it, and separately as queue delay. Returns the
+        level report and each request's send offset in seconds.
+        """
+        client = UploadClient(options['url'], options['timeout'])
+        latencies = []
+        queue_delays = []
+        arrivals = [0.0] * len(workload)
+        statuses = {}
+        lock = threading.Lock()
+
+        def send(index, payload, image_format, due):
+            started = time.perf_counter()
+            # Closed loop sends whenever a connection frees up; that is its arrival
+            due = run_started + due if open_loop else started
+            arrivals[index] = due - run_started
+            try:
+                status = client.upload(payload, image_format)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - due
+            with lock:
+                latencies.append(elapsed)
+                queue_delays.append(started - due)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        run_started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for index, (payload, image_format, arrival) in enumerate(workload):
+                if open_loop:
+                    delay = arrival - (time.perf_counter() - run_started)
+                    if delay > 0:
+                        time.sleep(delay)
+                executor.submit(send, index, payload, image_format, arrival)
+        elapsed = time.perf_counter() - run_started
+
+        errors = sum(count for status, count in statuses.items() if status != 200)
+        level = {
+            'concurrency': concurrency,
+            'requests': len(latencies),
+            'errors': errors,
+            'error_rate': round(errors / len(latencies), 4) if latencies else 0.0,
+            'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            'statuses': {str(status): count for status, count in statuses.items()},
+        }
+        level.update(summarize_latencies(latencies))
+        if open_loop:
+            level['queue_delay'] = summarize_latencies(queue_delays)
+
+        self.stdout.write(
+            f"concurrency={concurrency:<3} {level['throughput']:>7.1f} req/s  "
+            f"errors={level['error_rate']:.1%}  p50={level['p50_ms']:.0f}ms "
+            f"p95={level['p95_ms']:.0f}ms p99={level['p99_ms']:.0f}ms"
+            + (f"  queued p95={level['queue_delay']['p95_ms']:.0f}ms" if open_loop else '')
+        )
+        return level, arrivals
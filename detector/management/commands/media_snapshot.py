@@ -0,0 +1,62 @@
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from detector import accounting, snapshots
+
+class Command(BaseCommand):
+    help = 'List, verify or restore the incremental media snapshots made by backup_db --include-media'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'action',
+            choices=['list', 'verify', 'restore'],
+        )
+        parser.add_argument(
+            'snapshot',
+            nargs='?',
+            help='Snapshot directory name (default: the newest)'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='verify: also compare SHA-256 checksums instead of only sizes'
+        )
+        parser.add_argument(
+            '--delete-extra',
+            action='store_true',
+            help='restore: remove media files that are not in the snapshot'
+        )
+
+    def handle(self, *args, **options):
+        self.backup_dir = os.path.join(settings.BASE_DIR, 'backups')
+        available = snapshots.list_snapshots(self.backup_dir)
+        if options['action'] == 'list':
+            for path in available:
+                manifest = snapshots.load_manifest(path)
+                size = sum(entry['size'] for entry in manifest['files'].values())
+                self.stdout.write(
+                    f"{os.path.basename(path)}  {len(manifest['files'])} files  "
+                    f"{size / (1024 * 1024):.1f} MB  created {manifest['created']}"
+                )
+            return
+
+        if not available:
+            raise CommandError(f'No media snapshots found in {self.backup_dir}')
+        snapshot_dir = os.path.join(self.backup_dir, options['snapshot']) if options['snapshot'] else available[0]
+        if snapshot_dir not in available:
+            raise CommandError(f'{snapshot_dir} is not a complete media snapshot')
+
+        if options['action'] == 'verify':
+            problems = snapshots.verify_snapshot(snapshot_dir, full=options['full'])
+            for problem in problems[:50]:
+                self.stderr.write(problem)
+            if problems:
+                raise CommandError(f'{len(problems)} problems found in {snapshot_dir}')
+            self.stdout.write(self.style.SUCCESS(f'{snapshot_dir} matches its manifest'))
+        else:
+            stats = snapshots.restore_snapshot(snapshot_dir, str(settings.MEDIA_ROOT), options['delete_extra'])
+            accounting.reconcile(['media'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Restored media from {snapshot_dir}: {stats['copied']} copied, "
+                f"{stats['unchanged']} unchanged, {stats['removed']} removed"
+            ))
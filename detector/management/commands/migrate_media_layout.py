@@ -0,0 +1,167 @@
+import os
+import re
+import time
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from detector import accounting
+from detector.models import Image, MediaBlob
+from detector.storage import image_storage
+
+# Names already in the sharded layout: uploads/ab/cd/<sha256>.<ext>
+SHARDED_NAME = r'^uploads/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.'
+
+class Command(BaseCommand):
+    help = 'Move flat uploads/ files into the sharded content-addressed layout while the site is running'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Image rows updated per transaction'
+        )
+        parser.add_argument(
+            '--rate-limit',
+            type=float,
+            help='Maximum files moved per second, to protect foreground requests'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many rows still use the flat layout'
+        )
+        parser.add_argument(
+            '--sweep-orphans',
+            action='store_true',
+            help='Afterwards, delete files in uploads/ that no row references, '
+                 'including blobs left behind by a delete interrupted before unlinking them'
+        )
+
+    def handle(self, *args, **options):
+        pending = Image.objects.exclude(image='').exclude(image__regex=SHARDED_NAME)
+        total = pending.count()
+        if options['dry_run']:
+            self.stdout.write(f'{total} images still use the flat layout')
+            return
+
+        # Rows drop out of `pending` once moved, so a rerun resumes where the last
+        # run stopped; paging by pk skips rows whose files are missing
+        stats = {'moved': 0, 'deduplicated': 0, 'missing': 0}
+        last_pk = 0
+        started = time.monotonic()
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'image')[:options['batch_size']])
+            if not batch:
+                break
+            self._migrate_batch(batch, stats)
+            last_pk = batch[-1][0]
+            self.stdout.write(f"Moved {stats['moved']}/{total} images ({stats['deduplicated']} duplicates)")
+            if options['rate_limit']:
+                expected = stats['moved'] / options['rate_limit']
+                elapsed = time.monotonic() - started
+                if expected > elapsed:
+                    time.sleep(expected - elapsed)
+
+        if options['sweep_orphans']:
+            stats['orphans'] = self._sweep_orphans()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {stats['moved']} images to the sharded layout in {time.monotonic() - started:.1f}s "
+            f"({stats['deduplicated']} were duplicates, {stats['missing']} files missing"
+            f"{', %d orphans removed' % stats['orphans'] if 'orphans' in stats else ''})"
+        ))
+
+    def _migrate_batch(self, batch, stats):
+        """
+        Link each file under its content-addressed name, point its row there and
+        only then unlink the old name, so readers always find the file under
+        whichever name the database currently holds. Hashing and linking
+        happen before the transaction, which only updates rows and reference
+        counts, so uploads aren't kept waiting for the write lock by disk I/O.
+        """
+        linked = []
+        for pk, old_name in batch:
+            old_path = image_storage.path(old_name)
+            try:
+                size = os.path.getsize(old_path)
+                with open(old_path, 'rb') as f:
+                    digest = image_storage.hash_content(File(f))
+            except FileNotFoundError:
+                stats['missing'] += 1
+                continue
+            ext = os.path.splitext(old_name)[1].lstrip('.').lower() or 'bin'
+            new_name = image_storage.blob_name(digest, ext)
+            if not image_storage.exists(new_name):
+                self._link(old_path, image_storage.path(new_name))
+                accounting.record('media', size)
+            linked.append((pk, old_name, new_name, size))
+
+        retired = []
+        with transaction.atomic():
+            for pk, old_name, new_name, size in linked:
+                # A row deleted or changed since the batch was read keeps its
+                # state; a file linked for it alone is left for --sweep-orphans
+                if not Image.objects.filter(pk=pk, image=old_name).update(image=new_name):
+                    continue
+                added = MediaBlob.objects.filter(name=new_name).update(refcount=F('refcount') + 1)
+                if added:
+                    stats['deduplicated'] += 1
+                else:
+                    MediaBlob.objects.create(name=new_name, size=size, refcount=1)
+                if not image_storage.exists(new_name):
+                    # Its last other reference was released after we linked it
+                    self._link(image_storage.path(old_name), image_storage.path(new_name))
+                retired.append(old_name)
+                stats['moved'] += 1
+
+        image_storage.release(retired)
+
+    def _link(self, source, target):
+        """Hardlink source to target, copying where the filesystem can't link"""
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(source, target)
+        except FileExistsError:
+            pass
+        except OSError:
+            with open(source, 'rb') as f:
+                image_storage._write(os.path.relpath(target, image_storage.location), File(f))
+
+    def _sweep_orphans(self):
+        """
+        Delete top level files in uploads/ that no Image row points to, and
+        sharded files without a MediaBlob row. Files younger than an hour are
+        left alone: their upload may not have committed yet.
+        """
+        directory = image_storage.path(image_storage.prefix)
+        if not os.path.isdir(directory):
+            return 0
+        cutoff = time.time() - 3600
+        names, blobs = [], []
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if os.path.getmtime(path) > cutoff:
+                    continue
+                name = os.path.relpath(path, image_storage.location).replace(os.sep, '/')
+                if filename.endswith('.deleted'):
+                    os.remove(path)  # Renamed aside by a delete that stopped there
+                elif root == directory:
+                    names.append(name)
+                elif re.match(SHARDED_NAME, name):
+                    blobs.append(name)
+
+        removed = 0
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            referenced = set(Image.objects.filter(image__in=chunk).values_list('image', flat=True))
+            orphans = [name for name in chunk if name not in referenced]
+            removed += sum(1 for result in image_storage.release(orphans).values() if result)
+        for start in range(0, len(blobs), 500):
+            chunk = blobs[start:start + 500]
+            tracked = set(MediaBlob.objects.filter(name__in=chunk).values_list('name', flat=True))
+            orphans = [name for name in chunk if name not in tracked]
+            removed += sum(1 for result in image_storage.release(orphans).values() if result)
+        return removed
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from detector import accounting
+
+class Command(BaseCommand):
+    help = 'Recount media and backup storage from disk and correct the usage counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--area',
+            action='append',
+            choices=list(accounting.area_paths()),
+            help='Area to reconcile (repeatable, default all)'
+        )
+
+    def handle(self, *args, **options):
+        drift = accounting.reconcile(options['area'])
+        usage = accounting.get_usage()
+        for area, change in drift.items():
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{area}: {usage[area]['files']} files, {usage[area]['bytes']} bytes "
+                    f"(corrected by {change['files']} files, {change['bytes']} bytes)"
+                )
+            )
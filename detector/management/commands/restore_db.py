@@ -0,0 +1,97 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from django.conf import settings
+from django.core import management
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from detector.db import sqlite_integrity_check
+
+class Command(BaseCommand):
+    help = 'Restore the database from a backup made by backup_db'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'backup',
+            nargs='?',
+            help='Backup file (.sqlite3, .sqlite3.gz or .json); defaults to the newest db_backup_* file'
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Do not ask for confirmation'
+        )
+        parser.add_argument(
+            '--skip-verify',
+            action='store_true',
+            help='Restore without running PRAGMA integrity_check on the snapshot first'
+        )
+
+    def handle(self, *args, **options):
+        backup_path = options['backup'] or self._latest_backup()
+        if not os.path.exists(backup_path):
+            raise CommandError(f'Backup {backup_path} not found')
+
+        if options['interactive']:
+            answer = input(f'This replaces all data in the database with {backup_path}. Type "yes" to continue: ')
+            if answer != 'yes':
+                self.stdout.write('Restore cancelled')
+                return
+
+        started = time.monotonic()
+        if backup_path.endswith('.json'):
+            # loaddata only adds and updates rows, so clear the tables first; a
+            # fixture that fails to load rolls the flush back with it
+            with transaction.atomic():
+                management.call_command('flush', interactive=False, verbosity=0)
+                management.call_command('loaddata', backup_path)
+        else:
+            self._restore_sqlite(backup_path, verify=not options['skip_verify'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Restored database from {backup_path} in {time.monotonic() - started:.1f}s'
+        ))
+
+    def _latest_backup(self):
+        backup_dir = os.path.join(settings.BASE_DIR, 'backups')
+        candidates = [
+            os.path.join(backup_dir, name) for name in os.listdir(backup_dir)
+            if name.startswith('db_backup_') and not name.endswith('.partial')
+        ] if os.path.isdir(backup_dir) else []
+        if not candidates:
+            raise CommandError(f'No database backups found in {backup_dir}')
+        return max(candidates, key=os.path.getmtime)
+
+    def _restore_sqlite(self, backup_path, verify):
+        """
+        Copy the snapshot's pages into the live database with the backup API.
+        Unlike replacing the file, this is safe with WAL sidecar files and open
+        connections, which see the restored data on their next transaction.
+        """
+        if connection.vendor != 'sqlite':
+            raise CommandError('SQLite snapshots can only be restored into a SQLite database')
+
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(backup_path)) as tmp_dir:
+            snapshot_path = backup_path
+            if backup_path.endswith('.gz'):
+                snapshot_path = os.path.join(tmp_dir, 'snapshot.sqlite3')
+                with gzip.open(backup_path, 'rb') as src, open(snapshot_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, length=1024 * 1024)
+
+            if verify:
+                problems = sqlite_integrity_check(snapshot_path)
+                if problems:
+                    raise CommandError(f'Backup failed integrity check: {"; ".join(problems[:5])}')
+
+            connections.close_all()
+            source = sqlite3.connect(f'file:{snapshot_path}?mode=ro', uri=True)
+            target = sqlite3.connect(settings.DATABASES['default']['NAME'], timeout=30)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
@@ -0,0 +1,139 @@
+import ctypes
+import ctypes.util
+import gc
+import logging
+import threading
+import time
+import psutil
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Thresholds are in MB of worker RSS; override any of them with settings.MEMORY_GOVERNOR
+DEFAULT_CONFIG = {
+    'CHECK_INTERVAL': 5,       # Seconds between RSS samples
+    'GC_THRESHOLD_MB': 400,    # Run a full gc.collect() above this
+    'TRIM_THRESHOLD_MB': 450,  # Also return freed heap pages to the OS above this
+    'HARD_LIMIT_MB': None,     # Gracefully recycle the worker above this (None disables)
+    'COOLDOWN': 30,            # Seconds between reclaim actions while still above a threshold
+}
+
+def _load_malloc_trim():
+    """Return glibc's malloc_trim, or None on platforms without it"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+        return libc.malloc_trim
+    except (OSError, AttributeError):
+        return None
+
+class MemoryGovernor:
+    """
+    Samples this worker's RSS and only reclaims memory when it crosses the
+    configured thresholds, instead of collecting on every request.
+    """
+    def __init__(self):
+        self.process = psutil.Process()
+        self.lock = threading.Lock()
+        self.malloc_trim = _load_malloc_trim()
+        # Set by the gunicorn post_worker_init hook; asks the worker to exit gracefully
+        self.recycle_callback = None
+        self.recycling = False
+        self.last_check = 0.0
+        self.last_action = 0.0
+        self.stats = {
+            'checks': 0,
+            'collections': 0,
+            'trims': 0,
+            'recycles': 0,
+            'rss_mb': 0.0,
+            'peak_rss_mb': 0.0,
+            'last_action': None,
+            'last_action_at': None,
+        }
+
+    @property
+    def config(self):
+        return dict(DEFAULT_CONFIG, **getattr(settings, 'MEMORY_GOVERNOR', {}))
+
+    def rss_mb(self):
+        return self.process.memory_info().rss / (1024 * 1024)
+
+    def check(self, **kwargs):
+        """
+        Sample RSS and act on it if due. Safe to call from every request thread;
+        only one thread samples at a time and the rest return immediately.
+        Accepts signal keyword arguments so it can be a request_finished receiver.
+        """
+        config = self.config
+        now = time.monotonic()
+        if now - self.last_check < config['CHECK_INTERVAL']:
+            return
+        if not self.lock.acquire(blocking=False):
+            return
+
+        try:
+            self.last_check = now
+            rss = self.rss_mb()
+            self.stats['checks'] += 1
+            self.stats['rss_mb'] = round(rss, 1)
+            self.stats['peak_rss_mb'] = max(self.stats['peak_rss_mb'], self.stats['rss_mb'])
+
+            if config['HARD_LIMIT_MB'] and rss >= config['HARD_LIMIT_MB']:
+                self._recycle(rss)
+            elif now - self.last_action < config['COOLDOWN']:
+                return
+            elif rss >= config['TRIM_THRESHOLD_MB']:
+                self._collect(rss, trim=True)
+            elif rss >= config['GC_THRESHOLD_MB']:
+                self._collect(rss, trim=False)
+        except Exception as e:
+            logger.error(f"Memory governor check failed: {e}")
+        finally:
+            self.lock.release()
+
+    def _collect(self, rss, trim):
+        gc.collect()
+        self.stats['collections'] += 1
+        action = 'collect'
+
+        if trim and self.malloc_trim is not None:
+            self.malloc_trim(0)
+            self.stats['trims'] += 1
+            action = 'collect+trim'
+
+        freed = rss - self.rss_mb()
+        self._record_action(action)
+        logger.info(f"Memory governor: {action} at {rss:.0f}MB RSS freed {freed:.0f}MB")
+
+    def _recycle(self, rss):
+        if self.recycling:
+            return
+        if self.recycle_callback is None:
+            # Not running under gunicorn; reclaim what we can and keep serving
+            logger.warning(f"Memory governor: RSS {rss:.0f}MB above hard limit but no worker to recycle")
+            self._collect(rss, trim=True)
+            return
+
+        self.recycling = True
+        self.stats['recycles'] += 1
+        self._record_action('recycle')
+        logger.warning(f"Memory governor: RSS {rss:.0f}MB above hard limit, recycling worker")
+        self.recycle_callback()
+
+    def _record_action(self, action):
+        self.last_action = time.monotonic()
+        self.stats['last_action'] = action
+        self.stats['last_action_at'] = timezone.now().isoformat()
+
+    def get_stats(self):
+        """Governor decisions and thresholds for health endpoints"""
+        config = self.config
+        return dict(
+            self.stats,
+            gc_threshold_mb=config['GC_THRESHOLD_MB'],
+            trim_threshold_mb=config['TRIM_THRESHOLD_MB'],
+            hard_limit_mb=config['HARD_LIMIT_MB'],
+        )
+
+governor = MemoryGovernor()
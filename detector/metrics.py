@@ -0,0 +1,161 @@
+import collections
+import logging
+import os
+import threading
+import time
+import psutil
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Override any of these with settings.METRICS
+DEFAULT_CONFIG = {
+    'INTERVAL': 5,         # Seconds between samples
+    'HISTORY': 360,        # Samples kept in the ring buffer (30 minutes at 5s)
+    'LISTEN_PORT': None,   # Port whose accept queue is reported; defaults to $PORT or 8000
+}
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+def listen_queue_depth(port):
+    """
+    Connections waiting in the kernel accept queue of the socket listening on
+    port, i.e. requests no worker has picked up yet. For listening sockets
+    /proc/net/tcp reports that queue as rx_queue. None where unavailable.
+    """
+    depth = None
+    for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(table) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    local_port = int(fields[1].rsplit(':', 1)[1], 16)
+                    if fields[3] == '0A' and local_port == port:  # 0A is LISTEN
+                        depth = (depth or 0) + int(fields[4].split(':')[1], 16)
+        except (OSError, ValueError, IndexError, StopIteration):
+            continue
+    return depth
+
+class MetricsSampler:
+    """
+    Samples system and worker metrics from a background thread into a bounded
+    ring buffer, so health and dashboard endpoints read recent values without
+    blocking on psutil.cpu_percent(interval=1) or a disk stat per request.
+    """
+    def __init__(self):
+        self.process = psutil.Process()
+        self.lock = threading.Lock()
+        self.samples = collections.deque(maxlen=DEFAULT_CONFIG['HISTORY'])
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.in_flight = 0
+
+    @property
+    def config(self):
+        return dict(DEFAULT_CONFIG, **getattr(settings, 'METRICS', {}))
+
+    def request_started(self, **kwargs):
+        """request_started receiver counting requests in progress in this worker"""
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self, **kwargs):
+        """request_finished receiver"""
+        with self.lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+
+    def start(self):
+        """Start the sampling thread in this process"""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        config = self.config
+        # A fresh process after a fork: reset the handle and the buffer size
+        self.process = psutil.Process()
+        self.samples = collections.deque(self.samples, maxlen=config['HISTORY'])
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def _run(self):
+        interval = self.config['INTERVAL']
+        while not self.stop_event.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"Metrics sample failed: {e}")
+            self.stop_event.wait(interval)
+
+    def sample(self):
+        """Take one sample and append it to the ring buffer"""
+        config = self.config
+        port = config['LISTEN_PORT'] or int(os.environ.get('PORT', 8000))
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage(str(settings.MEDIA_ROOT))
+        with self.process.oneshot():
+            rss = self.process.memory_info().rss
+            process_memory = self.process.memory_percent()
+            process_cpu = self.process.cpu_percent(interval=None)
+            open_files = self.process.num_fds() if hasattr(self.process, 'num_fds') else len(self.process.open_files())
+
+        sample = {
+            'timestamp': time.time(),
+            # With interval=None both cpu_percent calls cover the time since the previous sample
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'process_cpu_percent': process_cpu,
+            'rss_mb': round(rss / MB, 1),
+            'memory_total_mb': round(memory.total / MB, 2),
+            'memory_available_mb': round(memory.available / MB, 2),
+            # This worker's share of system memory, and the system-wide use
+            'memory_percent': round(process_memory, 2),
+            'system_memory_percent': memory.percent,
+            'disk_total_gb': round(disk.total / GB, 2),
+            'disk_free_gb': round(disk.free / GB, 2),
+            'disk_used_percent': disk.percent,
+            'open_files': open_files,
+            'in_flight_requests': self.in_flight,
+            'listen_queue': listen_queue_depth(port),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def measure(self, interval=1):
+        """
+        Take one sample whose CPU figures cover the next interval seconds, for
+        one-off callers: the first cpu_percent(interval=None) in a process has
+        nothing to compare with and returns 0.0
+        """
+        psutil.cpu_percent(interval=None)
+        self.process.cpu_percent(interval=None)
+        time.sleep(interval)
+        return self.sample()
+
+    def latest(self):
+        """
+        The most recent sample. The first call in a process without a running
+        sampler starts it and takes one sample inline, which does not block.
+        """
+        if self.thread is None:
+            self.start()
+        try:
+            return self.samples[-1]
+        except IndexError:
+            return self.sample()
+
+    def history(self, seconds=None, fields=None):
+        """Samples from the last seconds (all kept samples by default), optionally only some fields"""
+        samples = list(self.samples)
+        if seconds is not None:
+            cutoff = time.time() - seconds
+            samples = [sample for sample in samples if sample['timestamp'] >= cutoff]
+        if fields:
+            samples = [{key: sample[key] for key in ('timestamp', *fields)} for sample in samples]
+        return samples
+
+sampler = MetricsSampler()
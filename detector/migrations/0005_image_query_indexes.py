@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-18 22:29
+
+import detector.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0004_alter_image_options'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(help_text='Upload JPEG, PNG, or WebP images (max 5MB)', max_length=255, upload_to=detector.models.get_upload_path, validators=[detector.models.validate_image_file]),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['uploaded_at'], name='image_uploaded_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['is_real', 'uploaded_at'], name='image_is_real_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('analysis_result__isnull', True)), fields=['uploaded_at'], name='image_unanalyzed_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-18 22:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0005_image_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('running', models.BooleanField(default=False)),
+                ('last_run', models.DateTimeField(null=True)),
+                ('last_status', models.BooleanField(null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('next_run', models.DateTimeField(null=True)),
+                ('owner', models.CharField(blank=True, max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-18 22:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0006_jobstatus'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('area', models.CharField(max_length=20, unique=True)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('files', models.BigIntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 22:39
+
+import detector.models
+import detector.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0007_storagestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('refcount', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(help_text='Upload JPEG, PNG, or WebP images (max 5MB)', max_length=255, storage=detector.storage.get_image_storage, upload_to=detector.models.get_upload_path, validators=[detector.models.validate_image_file]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-18 22:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0008_mediablob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='model_version',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.CreateModel(
+            name='DailyConfidenceBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('model_version', models.CharField(max_length=100)),
+                ('bucket', models.SmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'model_version', 'bucket'), name='confidence_bucket_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('model_version', models.CharField(max_length=100)),
+                ('uploads', models.IntegerField(default=0)),
+                ('upload_bytes', models.BigIntegerField(default=0)),
+                ('analyzed', models.IntegerField(default=0)),
+                ('real_count', models.IntegerField(default=0)),
+                ('ai_count', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('cache_hits', models.IntegerField(default=0)),
+                ('confidence_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'model_version'), name='rollup_day_version_uniq')],
+            },
+        ),
+    ]
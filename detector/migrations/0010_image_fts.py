@@ -0,0 +1,64 @@
+import logging
+from django.db import migrations, OperationalError
+
+logger = logging.getLogger(__name__)
+
+# Copied from detector.search as it stood for this migration, so later changes
+# there don't alter what migrating from scratch creates
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE detector_image_fts USING fts5(
+        original_filename, analysis_result,
+        content='detector_image', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER detector_image_fts_insert AFTER INSERT ON detector_image BEGIN
+        INSERT INTO detector_image_fts(rowid, original_filename, analysis_result)
+        VALUES (new.id, new.original_filename, new.analysis_result);
+    END""",
+    """CREATE TRIGGER detector_image_fts_delete AFTER DELETE ON detector_image BEGIN
+        INSERT INTO detector_image_fts(detector_image_fts, rowid, original_filename, analysis_result)
+        VALUES ('delete', old.id, old.original_filename, old.analysis_result);
+    END""",
+    """CREATE TRIGGER detector_image_fts_update AFTER UPDATE OF original_filename, analysis_result
+        ON detector_image BEGIN
+        INSERT INTO detector_image_fts(detector_image_fts, rowid, original_filename, analysis_result)
+        VALUES ('delete', old.id, old.original_filename, old.analysis_result);
+        INSERT INTO detector_image_fts(rowid, original_filename, analysis_result)
+        VALUES (new.id, new.original_filename, new.analysis_result);
+    END""",
+    "INSERT INTO detector_image_fts(detector_image_fts) VALUES ('rebuild')",
+]
+
+FTS_DROP = [
+    'DROP TRIGGER IF EXISTS detector_image_fts_insert',
+    'DROP TRIGGER IF EXISTS detector_image_fts_delete',
+    'DROP TRIGGER IF EXISTS detector_image_fts_update',
+    'DROP TABLE IF EXISTS detector_image_fts',
+]
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        for statement in FTS_SCHEMA:
+            schema_editor.execute(statement)
+    except OperationalError as e:
+        # Needs SQLite 3.34+ with FTS5; admin search keeps using LIKE without it
+        logger.warning(f"Skipping full text index for admin search: {e}")
+        for statement in FTS_DROP:
+            schema_editor.execute(statement)
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in FTS_DROP:
+        schema_editor.execute(statement)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0009_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0010_image_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024)),
+                ('digest', models.CharField(max_length=64)),
+                ('model_version', models.CharField(max_length=100)),
+                ('is_real', models.BooleanField(null=True)),
+                ('confidence_score', models.FloatField(null=True)),
+                ('error', models.TextField(blank=True)),
+                ('analyzed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['digest', 'model_version'], name='bulk_digest_version_idx')],
+                'constraints': [models.UniqueConstraint(fields=('path', 'model_version'), name='bulk_path_version_uniq')],
+            },
+        ),
+    ]
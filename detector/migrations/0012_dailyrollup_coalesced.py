@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 23:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0011_bulkanalysis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailyrollup',
+            name='coalesce_timeouts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dailyrollup',
+            name='coalesced',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -1,11 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
 import uuid
 import os
+import time
 from PIL import Image as PILImage
 import mimetypes
 from .utils import optimize_image, get_image_dimensions
-import gc
+from .storage import get_image_storage
+from .thumbnails import thumbnail_url
 
 def validate_image_file(upload):
     # Check file size (max 5MB for Render)
@@ -24,8 +26,6 @@ def validate_image_file(upload):
         img.verify()
         # Close the image to free memory
         img.close()
-        # Force garbage collection
-        gc.collect()
     except Exception:
         raise ValidationError('Upload a valid image. The file you uploaded appears to be corrupted')
 
@@ -34,7 +34,8 @@ def get_upload_path(instance, filename):
     ext = instance._optimized_format if hasattr(instance, '_optimized_format') else filename.split('.')[-1].lower()
     if ext not in ['jpg', 'jpeg', 'png']:
         ext = 'jpg'
-    # Generate a unique filename using UUID
+    # Generate a unique filename using UUID; content-addressed storage keeps
+    # only the extension and names the stored file by its hash
     new_filename = f'{uuid.uuid4().hex[:10]}.{ext}'
     # Return the upload path
     return os.path.join('uploads', new_filename)
@@ -42,6 +43,7 @@ def get_upload_path(instance, filename):
 class Image(models.Model):
     image = models.ImageField(
         upload_to=get_upload_path,
+        storage=get_image_storage,
         max_length=255,
         validators=[validate_image_file],
         help_text='Upload JPEG, PNG, or WebP images (max 5MB)'
@@ -50,6 +52,7 @@ class Image(models.Model):
     is_real = models.BooleanField(null=True)
     confidence_score = models.FloatField(null=True)
     analysis_result = models.TextField(null=True)
+    model_version = models.CharField(max_length=100, blank=True)
     original_filename = models.CharField(max_length=255, blank=True)
     file_size = models.IntegerField(default=0)
     image_width = models.IntegerField(default=0)
@@ -73,21 +76,28 @@ class Image(models.Model):
             if dimensions:
                 self.image_width, self.image_height = dimensions
 
-        super().save(*args, **kwargs)
-        
-        # Force garbage collection after save
-        gc.collect()
+        # The storage adds its file reference in this transaction, so a failed
+        # INSERT takes the reference with it
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        # Delete the image file when the model instance is deleted
-        if self.image:
-            try:
-                storage = self.image.storage
-                if storage.exists(self.image.name):
-                    storage.delete(self.image.name)
-            except Exception:
-                pass  # Don't prevent deletion if file removal fails
-        super().delete(*args, **kwargs)
+        # Drop this row's reference along with the row; the file goes once
+        # that commits and no other Image shares it
+        storage, name = self.image.storage, self.image.name
+        started = time.time()
+        with transaction.atomic():
+            doomed = storage.release_references([name]) if name else []
+            result = super().delete(*args, **kwargs)
+        try:
+            storage.delete_unreferenced(doomed, started)
+        except Exception:
+            pass  # Don't fail the deletion if file removal fails
+        return result
+
+    def thumbnail_url(self, size=320):
+        """URL of a WebP rendition of at most size pixels, created on first use"""
+        return thumbnail_url(self.image, size)
 
     def __str__(self):
         status = self.analysis_result or 'Not analyzed'
@@ -95,3 +105,112 @@ class Image(models.Model):
 
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # Default ordering, date filters and cleanup of analyzed images
+            models.Index(fields=['uploaded_at'], name='image_uploaded_at_idx'),
+            # Admin is_real filter combined with the default ordering
+            models.Index(fields=['is_real', 'uploaded_at'], name='image_is_real_uploaded_idx'),
+            # Cleanup of unanalyzed images only ever looks at this small subset
+            models.Index(
+                fields=['uploaded_at'],
+                condition=models.Q(analysis_result__isnull=True),
+                name='image_unanalyzed_idx',
+            ),
+        ]
+
+class JobStatus(models.Model):
+    """Last known state of a scheduled job, shared by all worker processes"""
+    name = models.CharField(max_length=100, unique=True)
+    running = models.BooleanField(default=False)
+    last_run = models.DateTimeField(null=True)
+    last_status = models.BooleanField(null=True)
+    last_error = models.TextField(blank=True)
+    next_run = models.DateTimeField(null=True)
+    owner = models.CharField(max_length=255, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+class StorageStats(models.Model):
+    """Running byte and file counts of a storage area, kept current on every change"""
+    area = models.CharField(max_length=20, unique=True)
+    bytes = models.BigIntegerField(default=0)
+    files = models.BigIntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.area
+
+class MediaBlob(models.Model):
+    """A content-addressed media file and the number of Image rows that use it"""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+class DailyRollup(models.Model):
+    """Upload and verdict counters for one day and model version, updated as analyses complete"""
+    day = models.DateField()
+    model_version = models.CharField(max_length=100)
+    uploads = models.IntegerField(default=0)
+    upload_bytes = models.BigIntegerField(default=0)
+    analyzed = models.IntegerField(default=0)
+    real_count = models.IntegerField(default=0)
+    ai_count = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    cache_hits = models.IntegerField(default=0)
+    # Uploads answered by an identical upload analyzed at the same time, and
+    # those that gave up waiting for it (see detector.coalesce)
+    coalesced = models.IntegerField(default=0)
+    coalesce_timeouts = models.IntegerField(default=0)
+    confidence_sum = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'model_version'], name='rollup_day_version_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.model_version}"
+
+class DailyConfidenceBucket(models.Model):
+    """Number of analyses per confidence bucket, for one day and model version"""
+    day = models.DateField()
+    model_version = models.CharField(max_length=100)
+    bucket = models.SmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'model_version', 'bucket'], name='confidence_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.model_version} bucket {self.bucket}"
+
+class BulkAnalysis(models.Model):
+    """Result for one file of an offline analyze_directory run"""
+    path = models.CharField(max_length=1024)
+    digest = models.CharField(max_length=64)
+    model_version = models.CharField(max_length=100)
+    is_real = models.BooleanField(null=True)
+    confidence_score = models.FloatField(null=True)
+    error = models.TextField(blank=True)
+    analyzed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['path', 'model_version'], name='bulk_path_version_uniq'),
+        ]
+        indexes = [
+            # Files with content already analyzed by this model are not run again
+            models.Index(fields=['digest', 'model_version'], name='bulk_digest_version_idx'),
+        ]
+
+    def __str__(self):
+        return self.path
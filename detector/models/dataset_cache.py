@@ -0,0 +1,175 @@
+"""
+Decode the dataset once into a memory-mapped uint8 array so training epochs
+read pixels instead of re-decoding every JPEG.
+
+    python dataset_cache.py dataset dataset_cache
+
+writes dataset_cache/images.u8 (N x H x W x 3, resized like inference does)
+and dataset_cache/index.json (shape, labels and a size/mtime signature of
+every source file, used to tell when the cache is stale).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision import transforms
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Label of each class directory: 1 for real images, 0 for AI-generated ones
+CLASS_DIRS = (('real', 1), ('fake', 0))
+IMAGES_FILE = 'images.u8'
+INDEX_FILE = 'index.json'
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+
+def list_images(data_dir):
+    """(paths, labels) of every image under data_dir/real and data_dir/fake"""
+    paths, labels = [], []
+    for class_dir, label in CLASS_DIRS:
+        directory = os.path.join(data_dir, class_dir)
+        if not os.path.exists(directory):
+            continue
+        for img_name in sorted(os.listdir(directory)):
+            if img_name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(directory, img_name))
+                labels.append(label)
+    return paths, labels
+
+def _signature(paths):
+    signature = {}
+    for path in paths:
+        st = os.stat(path)
+        signature[path] = [st.st_size, st.st_mtime_ns]
+    return signature
+
+def _decode(job):
+    """Decode and resize one image in a worker process; None if it can't be read"""
+    path, size = job
+    try:
+        with Image.open(path) as img:
+            # Same bilinear, antialiased resize as transforms.Resize and ImageAnalyzer
+            img = img.convert('RGB').resize(size, Image.Resampling.BILINEAR)
+            return np.asarray(img).tobytes()
+    except Exception as e:
+        print(f'Skipping {path}: {e}')
+        return None
+
+def load_index(cache_dir):
+    with open(os.path.join(cache_dir, INDEX_FILE)) as f:
+        return json.load(f)
+
+def cache_is_current(cache_dir, data_dir):
+    """Whether cache_dir holds exactly the images now in data_dir, unchanged"""
+    try:
+        index = load_index(cache_dir)
+    except (OSError, ValueError):
+        return False
+    paths, _ = list_images(data_dir)
+    return index['sources'] == _signature(paths)
+
+def build_cache(data_dir, cache_dir, size=(224, 224), workers=None):
+    """
+    Decode every image in data_dir into cache_dir with a pool of workers,
+    returning the number cached. Files that fail to decode are left out. The
+    index is written last, so an interrupted build is never mistaken for a cache.
+    """
+    paths, labels = list_images(data_dir)
+    if not paths:
+        raise ValueError(f'No images found in {data_dir}')
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    width, height = size
+    row_bytes = width * height * 3
+    images_path = os.path.join(cache_dir, IMAGES_FILE)
+    images = np.memmap(images_path, dtype=np.uint8, mode='w+', shape=(len(paths), height, width, 3))
+
+    started = time.perf_counter()
+    kept_labels, kept_paths = [], []
+    jobs = [(path, size) for path in paths]
+    with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+        for position, pixels in enumerate(pool.imap(_decode, jobs, chunksize=16)):
+            if pixels is None:
+                continue
+            images[len(kept_labels)] = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3)
+            kept_labels.append(labels[position])
+            kept_paths.append(paths[position])
+    images.flush()
+    del images
+    # Drop the rows reserved for images that failed to decode
+    os.truncate(images_path, len(kept_labels) * row_bytes)
+
+    with open(index_path + '.partial', 'w') as f:
+        json.dump({
+            'shape': [len(kept_labels), height, width, 3],
+            'labels': kept_labels,
+            'paths': kept_paths,
+            'sources': _signature(paths),
+        }, f)
+    os.replace(index_path + '.partial', index_path)
+    elapsed = time.perf_counter() - started
+    print(f'Cached {len(kept_labels)} of {len(paths)} images in {elapsed:.1f}s '
+          f'({len(paths) / elapsed:.1f} images/sec) to {cache_dir}')
+    return len(kept_labels)
+
+def train_augmentation(size=(224, 224)):
+    """Random flips and mild crops, applied to uint8 CHW tensors"""
+    return transforms.Compose([
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomResizedCrop(size[::-1], scale=(0.8, 1.0), ratio=(0.9, 1.1), antialias=True),
+    ])
+
+class CachedImageDataset(Dataset):
+    """
+    ImageDataset over a cache made by build_cache. Items are views of the
+    memory-mapped pixels; only the optional augmentation and the float
+    conversion copy them. The map is opened lazily so each DataLoader worker
+    maps the file itself instead of inheriting it.
+    """
+    def __init__(self, cache_dir, augment=None):
+        self.cache_dir = cache_dir
+        self.augment = augment
+        index = load_index(cache_dir)
+        self.shape = tuple(index['shape'])
+        # Source paths and labels, like ImageDataset.images and .labels
+        self.images = index['paths']
+        self.labels = index['labels']
+        self.pixels = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        if self.pixels is None:
+            # Copy-on-write keeps the array writable for torch without touching the file
+            self.pixels = np.memmap(os.path.join(self.cache_dir, IMAGES_FILE), dtype=np.uint8,
+                                    mode='c', shape=self.shape)
+        image = torch.from_numpy(self.pixels[idx]).permute(2, 0, 1)
+        if self.augment:
+            image = self.augment(image)
+        image = image.float().div_(255).sub_(MEAN).div_(STD)
+        return image, self.labels[idx]
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode a real/fake image dataset into a memory-mapped cache')
+    parser.add_argument('data_dir', help='Directory with real/ and fake/ subdirectories')
+    parser.add_argument('cache_dir', help='Directory to write images.u8 and index.json to')
+    parser.add_argument('--size', type=int, default=224, help='Width and height images are resized to')
+    parser.add_argument('--workers', type=int, default=None, help='Decoding processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the cache is current')
+    args = parser.parse_args()
+
+    if not args.force and cache_is_current(args.cache_dir, args.data_dir):
+        print(f'{args.cache_dir} is up to date')
+        return
+    build_cache(args.data_dir, args.cache_dir, size=(args.size, args.size), workers=args.workers)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+On-disk store of the frozen backbone's penultimate features, so the
+classification head can be trained on them without running ResNet50.
+
+The store holds one float16 row per image in features.f16, keyed in
+index.json by source path, size and mtime together with a fingerprint of the
+backbone weights. Updating it only runs the backbone over images that are new
+or changed since the last run, so retraining on a few new images is cheap.
+"""
+import hashlib
+import json
+import math
+import os
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+
+FEATURES_FILE = 'features.f16'
+INDEX_FILE = 'index.json'
+
+def backbone_fingerprint(model):
+    """Hash of every weight outside the fc head; features depend on nothing else"""
+    digest = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        if not name.startswith('fc.'):
+            digest.update(name.encode())
+            digest.update(tensor.cpu().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+def _source_key(path):
+    st = os.stat(path)
+    return f'{path}:{st.st_size}:{st.st_mtime_ns}'
+
+def _load_store(store_dir, fingerprint):
+    """(rows by key, features) of an existing store for this backbone, or empty"""
+    try:
+        with open(os.path.join(store_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}, None
+    if index['backbone'] != fingerprint or not index['keys']:
+        return {}, None
+    features = np.memmap(os.path.join(store_dir, FEATURES_FILE), dtype=np.float16, mode='r',
+                         shape=(len(index['keys']), index['dim']))
+    return {key: row for row, key in enumerate(index['keys'])}, features
+
+def extract_features(model, dataset, batch_size=64, workers=0):
+    """Run the backbone alone over dataset, yielding float16 feature batches"""
+    head = model.fc
+    model.fc = nn.Identity()
+    model.eval()
+    try:
+        loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=workers)
+        with torch.no_grad():
+            for inputs, _ in loader:
+                yield model(inputs).numpy().astype(np.float16)
+    finally:
+        model.fc = head
+
+def update_features(model, dataset, store_dir, batch_size=64, workers=0):
+    """
+    Bring the store in store_dir up to date with dataset (an unaugmented
+    ImageDataset or CachedImageDataset) and return its features, one row per
+    dataset item in dataset order. Rows for images already in the store are
+    copied over; only the rest go through the backbone.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    fingerprint = backbone_fingerprint(model)
+    keys = [_source_key(path) for path in dataset.images]
+    previous, old_features = _load_store(store_dir, fingerprint)
+    dim = model.fc[0].in_features
+
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    features_path = os.path.join(store_dir, FEATURES_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    features = np.memmap(features_path + '.partial', dtype=np.float16, mode='w+', shape=(len(keys), dim))
+
+    reused = [(row, previous[key]) for row, key in enumerate(keys) if key in previous]
+    if reused:
+        rows, old_rows = map(np.array, zip(*reused))
+        features[rows] = old_features[old_rows]
+    missing = [row for row, key in enumerate(keys) if key not in previous]
+    if missing:
+        started = time.perf_counter()
+        position = 0
+        for batch in extract_features(model, Subset(dataset, missing), batch_size, workers):
+            features[missing[position:position + len(batch)]] = batch
+            position += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f'Extracted features of {len(missing)} images in {elapsed:.1f}s '
+              f'({len(missing) / elapsed:.1f} images/sec)')
+    print(f'Feature store {store_dir}: {len(reused)} reused, {len(missing)} extracted')
+
+    features.flush()
+    del features, old_features
+    os.replace(features_path + '.partial', features_path)
+    with open(index_path + '.partial', 'w') as f:
+        json.dump({'backbone': fingerprint, 'dim': dim, 'keys': keys}, f)
+    os.replace(index_path + '.partial', index_path)
+    return np.memmap(features_path, dtype=np.float16, mode='r', shape=(len(keys), dim))
+
+class FeatureBatches:
+    """
+    Batches of (features, labels) over some rows of a feature store, usable
+    wherever train_model expects a DataLoader
+    """
+    def __init__(self, features, labels, indices, batch_size=256, shuffle=False):
+        self.features = features
+        self.labels = np.asarray(labels)
+        self.indices = np.asarray(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return math.ceil(len(self.indices) / self.batch_size)
+
+    def __iter__(self):
+        order = np.random.permutation(self.indices) if self.shuffle else self.indices
+        for start in range(0, len(order), self.batch_size):
+            # Sorted rows read the memory map sequentially
+            rows = np.sort(order[start:start + self.batch_size])
+            yield torch.from_numpy(self.features[rows].astype(np.float32)), torch.from_numpy(self.labels[rows])
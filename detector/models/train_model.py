@@ -4,33 +4,33 @@ import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms, models
 from PIL import Image
+import argparse
 import os
+import sys
+import time
 import json
+from pathlib import Path
 from tqdm import tqdm
 import numpy as np
+from dataset_cache import CachedImageDataset, build_cache, cache_is_current, list_images, train_augmentation
+from feature_cache import FeatureBatches, update_features
+
+# Share the CPU feature checks used for inference
+sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
+from detector.utils.cpu import cpu_supports_bf16
+
+# Where ImageAnalyzer loads the model from
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'realface_model.pth')
+
+# ResNet50 stages from the head down, in the order --unfreeze makes them trainable
+RESNET_STAGES = ('layer4', 'layer3', 'layer2', 'layer1')
 
 class ImageDataset(Dataset):
     def __init__(self, data_dir, transform=None):
         self.data_dir = data_dir
         self.transform = transform
-        self.images = []
-        self.labels = []
-        
-        # Real images (label 1)
-        real_dir = os.path.join(data_dir, 'real')
-        if os.path.exists(real_dir):
-            for img_name in os.listdir(real_dir):
-                if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    self.images.append(os.path.join(real_dir, img_name))
-                    self.labels.append(1)
-        
-        # AI-generated images (label 0)
-        fake_dir = os.path.join(data_dir, 'fake')
-        if os.path.exists(fake_dir):
-            for img_name in os.listdir(fake_dir):
-                if img_name.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    self.images.append(os.path.join(fake_dir, img_name))
-                    self.labels.append(0)
+        # Real images are labelled 1, AI-generated ones 0
+        self.images, self.labels = list_images(data_dir)
 
     def __len__(self):
         return len(self.images)
@@ -45,103 +45,146 @@ class ImageDataset(Dataset):
 
         return image, label
 
-def train_model(model, train_loader, val_loader, criterion, optimizer, num_epochs=10, device='cpu'):
-    best_acc = 0.0
-    best_model_path = 'realface_model.pth'
-    
-    for epoch in range(num_epochs):
-        print(f'Epoch {epoch+1}/{num_epochs}')
-        print('-' * 10)
-        
-        # Training phase
-        model.train()
-        running_loss = 0.0
-        running_corrects = 0
-        total = 0
-        
-        for inputs, labels in tqdm(train_loader, desc='Training'):
+def _save_atomic(obj, path):
+    """torch.save through a temporary file, so an interrupted run never leaves a truncated file"""
+    tmp_path = f'{path}.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def _run_epoch(model, loader, criterion, optimizer=None, device='cpu', accumulation_steps=1,
+               memory_format=torch.contiguous_format, bf16=False):
+    """
+    One pass over loader, training when an optimizer is given. Returns loss,
+    accuracy and where the time went: waiting on the loader versus computing.
+    """
+    training = optimizer is not None
+    running_loss = 0.0
+    running_corrects = 0
+    total = 0
+    data_time = compute_time = 0.0
+    started = step_started = time.perf_counter()
+
+    with torch.set_grad_enabled(training):
+        for step, (inputs, labels) in enumerate(tqdm(loader, desc='Training' if training else 'Validation'), 1):
+            loaded = time.perf_counter()
+            data_time += loaded - step_started
+
             inputs = inputs.to(device)
+            if inputs.dim() == 4:
+                inputs = inputs.contiguous(memory_format=memory_format)
             labels = labels.to(device)
-            
-            optimizer.zero_grad()
-            
-            outputs = model(inputs)
-            outputs = outputs.squeeze()
+
+            with torch.autocast('cpu', dtype=torch.bfloat16, enabled=bf16):
+                outputs = model(inputs)
+            # The loss is computed in float32 outside autocast
+            outputs = outputs.float().view(-1)
             loss = criterion(outputs, labels.float())
-            
-            loss.backward()
-            optimizer.step()
-            
+
+            if training:
+                (loss / accumulation_steps).backward()
+                if step % accumulation_steps == 0 or step == len(loader):
+                    optimizer.step()
+                    optimizer.zero_grad()
+
             running_loss += loss.item() * inputs.size(0)
             predictions = (outputs >= 0.5).float()
             running_corrects += (predictions == labels).sum().item()
             total += labels.size(0)
+
+            step_started = time.perf_counter()
+            compute_time += step_started - loaded
+
+    elapsed = time.perf_counter() - started
+    return {
+        'loss': running_loss / total,
+        'acc': running_corrects / total,
+        'images_per_second': total / elapsed,
+        'data_time': data_time,
+        'compute_time': compute_time,
+    }
+
+def _print_stats(phase, stats):
+    busy = stats['data_time'] + stats['compute_time']
+    print(f"{phase} Loss: {stats['loss']:.4f} Acc: {stats['acc']:.4f}  "
+          f"{stats['images_per_second']:.1f} images/sec, data wait {stats['data_time']:.1f}s "
+          f"({100 * stats['data_time'] / busy:.0f}%), compute {stats['compute_time']:.1f}s")
+
+def train_model(model, train_loader, val_loader, criterion, optimizer, num_epochs=10, device='cpu',
+                best_model_path=DEFAULT_OUTPUT, saved_model=None, checkpoint_path=None, resume=False,
+                accumulation_steps=1, channels_last=False, bf16=False, best_acc=0.0):
+    """
+    Train model, saving the best state_dict by validation accuracy. When model
+    is only part of the network (the head trained on cached features),
+    saved_model is the full network to save instead.
+
+    After every epoch the model, optimizer, RNG state and best accuracy are
+    written to checkpoint_path; with resume=True training continues from it.
+    Gradients are accumulated over accumulation_steps batches, for a larger
+    effective batch than fits in memory. A data wait share close to 100% means
+    the run is bound by input loading rather than compute.
+
+    best_acc is the accuracy of a model already at best_model_path, from an
+    earlier training phase; only epochs that beat it replace that file. Returns
+    the model and the best accuracy, which stays at best_acc when no epoch ran
+    or none improved on it.
+    """
+    saved_model = saved_model or model
+    start_epoch = 0
+    if resume and checkpoint_path and os.path.exists(checkpoint_path):
+        checkpoint = torch.load(checkpoint_path, map_location='cpu')
+        saved_model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        torch.set_rng_state(checkpoint['rng_state'])
+        start_epoch = checkpoint['epoch']
+        best_acc = checkpoint['best_acc']
+        print(f'Resumed from {checkpoint_path} after epoch {start_epoch} (best accuracy {best_acc:.4f})')
+    elif resume:
+        print(f'No checkpoint at {checkpoint_path}, starting from scratch')
+
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    if channels_last:
+        model.to(memory_format=memory_format)
+    options = {'device': device, 'memory_format': memory_format, 'bf16': bf16}
+
+    for epoch in range(start_epoch, num_epochs):
+        print(f'Epoch {epoch+1}/{num_epochs}')
+        print('-' * 10)
         
-        epoch_loss = running_loss / total
-        epoch_acc = running_corrects / total
-        
-        print(f'Train Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
+        # Training phase
+        model.train()
+        # Frozen layers keep their pretrained batch norm statistics
+        for module in model.modules():
+            if isinstance(module, nn.BatchNorm2d) and not module.weight.requires_grad:
+                module.eval()
+        optimizer.zero_grad()
+        _print_stats('Train', _run_epoch(model, train_loader, criterion, optimizer,
+                                         accumulation_steps=accumulation_steps, **options))
         
         # Validation phase
         model.eval()
-        running_loss = 0.0
-        running_corrects = 0
-        total = 0
-        
-        with torch.no_grad():
-            for inputs, labels in tqdm(val_loader, desc='Validation'):
-                inputs = inputs.to(device)
-                labels = labels.to(device)
-                
-                outputs = model(inputs)
-                outputs = outputs.squeeze()
-                loss = criterion(outputs, labels.float())
-                
-                running_loss += loss.item() * inputs.size(0)
-                predictions = (outputs >= 0.5).float()
-                running_corrects += (predictions == labels).sum().item()
-                total += labels.size(0)
-        
-        val_loss = running_loss / total
-        val_acc = running_corrects / total
-        
-        print(f'Val Loss: {val_loss:.4f} Acc: {val_acc:.4f}')
+        val_stats = _run_epoch(model, val_loader, criterion, **options)
+        _print_stats('Val', val_stats)
         
         # Save best model
-        if val_acc > best_acc:
-            best_acc = val_acc
-            torch.save(model.state_dict(), best_model_path)
+        if val_stats['acc'] > best_acc:
+            best_acc = val_stats['acc']
+            _save_atomic(saved_model.state_dict(), best_model_path)
             print(f'Saved new best model with accuracy: {best_acc:.4f}')
-    
-    return model
 
-def main():
-    # Set device - force CPU for Render compatibility
-    device = torch.device('cpu')
-    print(f'Using device: {device}')
-    
-    # Data transforms
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    
-    # Create datasets
-    data_dir = 'dataset'  # Update this path to your dataset directory
-    dataset = ImageDataset(data_dir, transform=transform)
-    
-    # Split dataset
-    train_size = int(0.8 * len(dataset))
-    val_size = len(dataset) - train_size
-    train_dataset, val_dataset = torch.utils.data.random_split(dataset, [train_size, val_size])
+        if checkpoint_path:
+            _save_atomic({
+                'epoch': epoch + 1,
+                'model': saved_model.state_dict(),
+                'optimizer': optimizer.state_dict(),
+                'rng_state': torch.get_rng_state(),
+                'best_acc': best_acc,
+            }, checkpoint_path)
     
-    # Create data loaders
-    train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True, num_workers=4)
-    val_loader = DataLoader(val_dataset, batch_size=32, shuffle=False, num_workers=4)
-    
-    # Initialize model
-    model = models.resnet50(weights=models.ResNet50_Weights.IMAGENET1K_V2)
+    return model, best_acc
+
+def build_model(weights=None):
+    """ResNet50 with the binary head, from ImageNet weights or a saved state_dict"""
+    model = models.resnet50(weights=None if weights else models.ResNet50_Weights.IMAGENET1K_V2)
     num_features = model.fc.in_features
     model.fc = nn.Sequential(
         nn.Linear(num_features, 1024),
@@ -150,22 +193,152 @@ def main():
         nn.Linear(1024, 1),
         nn.Sigmoid()
     )
-    model = model.to(device)
+    if weights:
+        model.load_state_dict(torch.load(weights, map_location='cpu'))
+    return model
+
+def freeze_backbone(model, trainable_stages=0):
+    """Freeze everything but the head and the last trainable_stages ResNet stages"""
+    trainable = ('fc',) + RESNET_STAGES[:trainable_stages]
+    for name, param in model.named_parameters():
+        param.requires_grad = name.split('.')[0] in trainable
+    return [param for param in model.parameters() if param.requires_grad]
+
+def train_head(model, train_dataset, val_dataset, criterion, args):
+    """
+    Train only model.fc on backbone features cached in args.feature_dir; the
+    backbone runs once per new image instead of twice per image per epoch.
+    Returns the model with the best head and that head's validation accuracy.
+    """
+    freeze_backbone(model)
+    # Features come from unaugmented images, split as for full training
+    features = update_features(model, val_dataset.dataset, args.feature_dir,
+                               batch_size=args.batch_size, workers=args.workers)
+    labels = val_dataset.dataset.labels
+    train_batches = FeatureBatches(features, labels, train_dataset.indices, batch_size=256, shuffle=True)
+    val_batches = FeatureBatches(features, labels, val_dataset.indices, batch_size=256)
+    optimizer = optim.Adam(model.fc.parameters(), lr=args.lr)
+    checkpoint_path = os.path.join(args.checkpoint_dir, 'head.pt')
+    _, best_acc = train_model(model.fc, train_batches, val_batches, criterion, optimizer, num_epochs=args.epochs,
+                              best_model_path=args.output, saved_model=model, bf16=args.bf16,
+                              checkpoint_path=checkpoint_path, resume=args.resume)
+    # Continue from the best head rather than the last one; with --epochs 0
+    # nothing was saved and args.output may not exist at all
+    if best_acc and os.path.exists(args.output):
+        model.load_state_dict(torch.load(args.output, map_location='cpu'))
+    return model, best_acc
+
+def load_datasets(data_dir, cache_dir=None, val_fraction=0.2, seed=0):
+    """
+    Train and validation datasets, split the same way with or without a cache.
+    With cache_dir, images are decoded once into a memory-mapped cache (rebuilt
+    when data_dir changes) and training images are augmented on the fly.
+    """
+    if cache_dir:
+        if not cache_is_current(cache_dir, data_dir):
+            build_cache(data_dir, cache_dir)
+        train_dataset = CachedImageDataset(cache_dir, augment=train_augmentation())
+        val_dataset = CachedImageDataset(cache_dir)
+    else:
+        transform = transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        ])
+        train_dataset = val_dataset = ImageDataset(data_dir, transform=transform)
+
+    indices = torch.randperm(len(train_dataset), generator=torch.Generator().manual_seed(seed)).tolist()
+    val_size = int(val_fraction * len(indices))
+    return (
+        torch.utils.data.Subset(train_dataset, indices[val_size:]),
+        torch.utils.data.Subset(val_dataset, indices[:val_size]),
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the real/fake image classifier')
+    parser.add_argument('--data-dir', default='dataset', help='Directory with real/ and fake/ subdirectories')
+    parser.add_argument('--cache-dir', help='Decode images once into this memory-mapped cache (see dataset_cache.py)')
+    parser.add_argument('--mode', choices=['full', 'head'], default='full',
+                        help='head: freeze the backbone and train the classifier head on cached features')
+    parser.add_argument('--feature-dir', default='feature_cache', help='Feature store used by --mode head')
+    parser.add_argument('--unfreeze', type=int, default=0, choices=range(len(RESNET_STAGES) + 1),
+                        help='After head training, fine-tune this many of the last ResNet stages too')
+    parser.add_argument('--finetune-epochs', type=int, default=2)
+    parser.add_argument('--weights', help='Start from this state_dict (e.g. the deployed model) instead of ImageNet')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='Where to save the best model')
+    parser.add_argument('--checkpoint-dir', default='checkpoints', help='Where to write per-epoch checkpoints')
+    parser.add_argument('--resume', action='store_true', help='Continue from the last checkpoint of this mode')
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--lr', type=float, default=0.001)
+    parser.add_argument('--accumulation-steps', type=int, default=1,
+                        help='Batches per optimizer step; the effective batch is batch-size times this')
+    parser.add_argument('--workers', type=int, default=4, help='DataLoader worker processes')
+    parser.add_argument('--threads', type=int, help='Intra-op threads for the training process (default: torch default)')
+    parser.add_argument('--channels-last', action=argparse.BooleanOptionalAction, default=True,
+                        help='Use the NHWC layout oneDNN convolutions are fastest with')
+    parser.add_argument('--bf16', action=argparse.BooleanOptionalAction, default=None,
+                        help='bfloat16 autocast (default: when the CPU has native bf16 instructions)')
+    args = parser.parse_args()
+    if args.bf16 is None:
+        args.bf16 = cpu_supports_bf16()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+
+    # Set device - force CPU for Render compatibility
+    device = torch.device('cpu')
+    print(f'Using device: {device}, {torch.get_num_threads()} threads, '
+          f'channels_last={args.channels_last}, bf16={args.bf16}')
+    
+    train_dataset, val_dataset = load_datasets(args.data_dir, args.cache_dir)
+    
+    # Create data loaders; persistent workers aren't restarted every epoch
+    loader_options = {'batch_size': args.batch_size, 'num_workers': args.workers}
+    if args.workers:
+        loader_options.update(persistent_workers=True, prefetch_factor=4)
+    train_loader = DataLoader(train_dataset, shuffle=True, **loader_options)
+    val_loader = DataLoader(val_dataset, shuffle=False, **loader_options)
     
-    # Loss function and optimizer
+    # Initialize model
+    model = build_model(args.weights).to(device)
+    
+    # Loss function
     criterion = nn.BCELoss()
-    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    
+    best_acc = 0.0
+    if args.mode == 'head':
+        model, best_acc = train_head(model, train_dataset, val_dataset, criterion, args)
+        if not args.unfreeze:
+            return
+        # Partial unfreezing: the last stages adapt at a lower learning rate
+        params = freeze_backbone(model, args.unfreeze)
+        optimizer = optim.Adam(params, lr=args.lr / 10)
+        num_epochs = args.finetune_epochs
+        checkpoint_path = os.path.join(args.checkpoint_dir, 'finetune.pt')
+    else:
+        optimizer = optim.Adam(model.parameters(), lr=args.lr)
+        num_epochs = args.epochs
+        checkpoint_path = os.path.join(args.checkpoint_dir, 'full.pt')
     
     # Train model
-    model = train_model(
+    model, best_acc = train_model(
         model=model,
         train_loader=train_loader,
         val_loader=val_loader,
         criterion=criterion,
         optimizer=optimizer,
-        num_epochs=10,
-        device=device
+        num_epochs=num_epochs,
+        device=device,
+        best_model_path=args.output,
+        checkpoint_path=checkpoint_path,
+        resume=args.resume,
+        accumulation_steps=args.accumulation_steps,
+        channels_last=args.channels_last,
+        bf16=args.bf16,
+        # Fine-tuning only replaces the best head's weights when it improves on them
+        best_acc=best_acc
     )
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
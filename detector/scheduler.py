@@ -0,0 +1,242 @@
+import datetime
+import logging
+import os
+import random
+import socket
+import threading
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+class CronSchedule:
+    """
+    Standard five field cron expression: minute hour day-of-month month day-of-week.
+    Fields accept *, numbers, ranges (a-b), steps (*/n, a-b/n) and lists (a,b).
+    Day-of-week runs from 0 (Sunday) to 6.
+    """
+    FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.FIELD_RANGES)
+        )
+        # As in cron, a restricted day-of-month OR day-of-week matches when both are set
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = map(int, part.split('-'))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Invalid cron field {field!r}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment):
+        """The first matching minute strictly after moment"""
+        candidate = (moment + datetime.timedelta(minutes=1)).replace(second=0, microsecond=0)
+        limit = candidate + datetime.timedelta(days=5 * 366)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                next_month = candidate.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)
+                candidate = next_month.replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + datetime.timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression {self.expression!r} never matches")
+
+class LeaderLock:
+    """
+    Non-blocking exclusive lock on a file. The OS drops it when the holding
+    process exits, so a crashed leader is replaced on the next attempt.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def acquire(self):
+        if self.handle is not None:
+            return True
+        handle = open(self.path, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            handle.close()
+            return False
+        self.handle = handle
+        return True
+
+    def release(self):
+        if self.handle is not None:
+            self.handle.close()  # Closing the descriptor releases the lock
+            self.handle = None
+
+class Job:
+    def __init__(self, name, func, schedule, jitter=0):
+        self.name = name
+        self.func = func
+        self.schedule = CronSchedule(schedule)
+        self.jitter = jitter
+        self.next_run = None
+
+    def plan_after(self, moment):
+        """Next cron time after moment, delayed by a random jitter"""
+        scheduled = self.schedule.next_after(timezone.localtime(moment))
+        return scheduled + datetime.timedelta(seconds=random.uniform(0, self.jitter))
+
+class Scheduler:
+    """
+    Runs periodic jobs in a background thread of exactly one process.
+    Every gunicorn worker starts a scheduler, but only the one holding the
+    leader lock runs jobs; the others retry the lock periodically and take
+    over if the leader exits. Job status is stored in the database
+    (JobStatus) so every worker reports the same state.
+    """
+    def __init__(self):
+        self.jobs = {}
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.is_leader = False
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.lock = None
+
+    @property
+    def config(self):
+        config = {
+            'ENABLED': True,
+            'LOCK_FILE': os.path.join(settings.BASE_DIR, '.scheduler.lock'),
+            'RETRY_INTERVAL': 60,  # Seconds between attempts to become leader
+            'POLL_INTERVAL': 60,   # Longest sleep between checks for due jobs
+        }
+        config.update(getattr(settings, 'SCHEDULER', {}))
+        return config
+
+    def register(self, name, func, schedule, jitter=0):
+        """Add a job; settings.SCHEDULED_JOBS can override its cron schedule by name"""
+        schedule = getattr(settings, 'SCHEDULED_JOBS', {}).get(name, schedule)
+        self.jobs[name] = Job(name, func, schedule, jitter)
+
+    def start(self):
+        """Start the scheduler thread in this process"""
+        if not self.config['ENABLED']:
+            logger.info("Scheduler disabled")
+            return
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.lock = LeaderLock(self.config['LOCK_FILE'])
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread and give up leadership"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=30)
+        if self.lock is not None:
+            self.lock.release()
+        self.is_leader = False
+
+    def _run(self):
+        config = self.config
+        while not self.stop_event.is_set():
+            try:
+                if not self.lock.acquire():
+                    self.stop_event.wait(config['RETRY_INTERVAL'])
+                    continue
+                if not self.is_leader:
+                    self._become_leader()
+
+                for job in self.jobs.values():
+                    if self.stop_event.is_set():
+                        break
+                    if job.next_run <= timezone.now():
+                        self._run_job(job)
+
+                next_due = min((job.next_run for job in self.jobs.values()), default=None)
+                wait = (next_due - timezone.now()).total_seconds() if next_due else config['POLL_INTERVAL']
+                self.stop_event.wait(min(max(wait, 1), config['POLL_INTERVAL']))
+            except Exception as e:
+                logger.error(f"Scheduler loop error: {e}")
+                self.stop_event.wait(config['RETRY_INTERVAL'])
+            finally:
+                close_old_connections()
+
+    def _become_leader(self):
+        """Plan every job, catching up once on runs missed while no leader was alive"""
+        from .tasks import TaskStatus
+
+        self.is_leader = True
+        logger.info(f"Scheduler leader elected: {self.owner}")
+        now = timezone.now()
+        for job in self.jobs.values():
+            status = TaskStatus(job.name)
+            # A previous leader died mid-run; the flag is stale
+            status.clear_running()
+            last_run = status.last_run
+            job.next_run = job.plan_after(last_run) if last_run else job.plan_after(now)
+            status.set_next_run(job.next_run)
+
+    def _run_job(self, job):
+        from .tasks import TaskStatus
+
+        status = TaskStatus(job.name)
+        status.start(owner=self.owner)
+        try:
+            job.func()
+            status.complete(success=True)
+        except Exception as e:
+            status.complete(success=False, error=f"Error in {job.name} task: {e}")
+        finally:
+            job.next_run = job.plan_after(timezone.now())
+            status.set_next_run(job.next_run)
+
+    def get_jobs_status(self):
+        """Status of every registered job, as recorded by whichever process leads"""
+        from .tasks import TaskStatus
+
+        return {
+            name: dict(TaskStatus(name).as_dict(), schedule=job.schedule.expression)
+            for name, job in self.jobs.items()
+        }
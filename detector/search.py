@@ -0,0 +1,73 @@
+import logging
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from django.utils.text import smart_split, unescape_string_literal
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'detector_image_fts'
+# Trigram tokens match any substring of three or more characters, like icontains
+MIN_TERM_LENGTH = 3
+
+# External content table over detector_image: the index stores only tokens, and
+# the triggers keep it in step with every insert, update and delete
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        original_filename, analysis_result,
+        content='detector_image', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER detector_image_fts_insert AFTER INSERT ON detector_image BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, original_filename, analysis_result)
+        VALUES (new.id, new.original_filename, new.analysis_result);
+    END""",
+    f"""CREATE TRIGGER detector_image_fts_delete AFTER DELETE ON detector_image BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, original_filename, analysis_result)
+        VALUES ('delete', old.id, old.original_filename, old.analysis_result);
+    END""",
+    f"""CREATE TRIGGER detector_image_fts_update AFTER UPDATE OF original_filename, analysis_result
+        ON detector_image BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, original_filename, analysis_result)
+        VALUES ('delete', old.id, old.original_filename, old.analysis_result);
+        INSERT INTO {FTS_TABLE}(rowid, original_filename, analysis_result)
+        VALUES (new.id, new.original_filename, new.analysis_result);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+# Aliases whose index was found; a missing one is checked again on the next
+# search, so the index is picked up once its migration has run
+_fts_aliases = set()
+
+def fts_available(alias='default'):
+    """Whether the FTS index exists; not on other databases or SQLite builds without trigram"""
+    if alias in _fts_aliases:
+        return True
+    connection = connections[alias]
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        if cursor.fetchone() is None:
+            return False
+    _fts_aliases.add(alias)
+    return True
+
+def split_terms(search_term):
+    """Split a search the way the admin does, honouring quoted phrases"""
+    terms = []
+    for bit in smart_split(search_term):
+        if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+            bit = unescape_string_literal(bit)
+        if bit:
+            terms.append(bit)
+    return terms
+
+def match_expression(terms):
+    """An FTS5 query requiring every term somewhere in the indexed columns"""
+    return ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+def filter_fts(queryset, terms):
+    """Restrict an Image queryset to rows whose indexed text contains every term"""
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match_expression(terms)]
+    ))
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+PREFIX = 'media_backup_'
+
+def _copy_and_hash(source, target):
+    """Copy a file preserving its mtime, returning the SHA-256 of what was copied"""
+    hasher = hashlib.sha256()
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        for chunk in iter(lambda: src.read(1024 * 1024), b''):
+            hasher.update(chunk)
+            dst.write(chunk)
+    shutil.copystat(source, target)
+    return hasher.hexdigest()
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def load_manifest(snapshot_dir):
+    with open(os.path.join(snapshot_dir, MANIFEST)) as f:
+        return json.load(f)
+
+def list_snapshots(backup_dir):
+    """Complete snapshots (those with a manifest), newest first"""
+    if not os.path.isdir(backup_dir):
+        return []
+    snapshots = [
+        os.path.join(backup_dir, name) for name in os.listdir(backup_dir)
+        if name.startswith(PREFIX) and os.path.exists(os.path.join(backup_dir, name, MANIFEST))
+    ]
+    return sorted(snapshots, reverse=True)
+
+def create_snapshot(source_dir, snapshot_dir, previous_dir=None):
+    """
+    Snapshot source_dir into snapshot_dir. Files whose size and mtime match the
+    previous snapshot's manifest are hardlinked to it, everything else is
+    copied, so each snapshot only costs the bytes that changed. The snapshot is
+    built under a .partial name and renamed once its manifest is written.
+    Returns stats with the bytes and files actually copied.
+    """
+    previous = load_manifest(previous_dir)['files'] if previous_dir else {}
+    partial_dir = f'{snapshot_dir}.partial'
+    if os.path.exists(partial_dir):
+        shutil.rmtree(partial_dir)
+
+    files = {}
+    stats = {'files': 0, 'linked': 0, 'copied': 0, 'copied_bytes': 0}
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        relative_dir = os.path.relpath(dirpath, source_dir)
+        os.makedirs(os.path.join(partial_dir, relative_dir), exist_ok=True)
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            if os.path.islink(source):
+                continue
+            relative = os.path.normpath(os.path.join(relative_dir, filename)).replace(os.sep, '/')
+            target = os.path.join(partial_dir, relative)
+            st = os.stat(source)
+            entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+            old = previous.get(relative)
+            if old and old['size'] == entry['size'] and old['mtime_ns'] == entry['mtime_ns']:
+                try:
+                    os.link(os.path.join(previous_dir, relative), target)
+                    entry['sha256'] = old['sha256']
+                    stats['linked'] += 1
+                except OSError:
+                    pass  # Previous copy missing or links unsupported; fall back to copying
+            if 'sha256' not in entry:
+                entry['sha256'] = _copy_and_hash(source, target)
+                stats['copied'] += 1
+                stats['copied_bytes'] += entry['size']
+
+            files[relative] = entry
+            stats['files'] += 1
+
+    with open(os.path.join(partial_dir, MANIFEST), 'w') as f:
+        json.dump({
+            'created': timezone.now().isoformat(),
+            'source': str(source_dir),
+            'previous': os.path.basename(previous_dir) if previous_dir else None,
+            'files': files,
+        }, f)
+    os.replace(partial_dir, snapshot_dir)
+    return stats
+
+def verify_snapshot(snapshot_dir, full=False):
+    """
+    Compare a snapshot with its manifest: sizes only by default, which needs no
+    reads, or SHA-256 of every file with full=True. Returns the problems found.
+    """
+    problems = []
+    for relative, entry in load_manifest(snapshot_dir)['files'].items():
+        path = os.path.join(snapshot_dir, relative)
+        try:
+            if os.path.getsize(path) != entry['size']:
+                problems.append(f'{relative}: size differs from manifest')
+            elif full and _hash_file(path) != entry['sha256']:
+                problems.append(f'{relative}: checksum differs from manifest')
+        except OSError:
+            problems.append(f'{relative}: missing')
+    return problems
+
+def restore_snapshot(snapshot_dir, target_dir, delete_extra=False):
+    """
+    Make target_dir match a snapshot, copying only files that are missing or
+    whose size or mtime differ. With delete_extra, files not in the snapshot
+    are removed. Returns stats of what changed.
+    """
+    files = load_manifest(snapshot_dir)['files']
+    stats = {'copied': 0, 'unchanged': 0, 'removed': 0}
+    for relative, entry in files.items():
+        target = os.path.join(target_dir, relative)
+        try:
+            st = os.stat(target)
+            if st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']:
+                stats['unchanged'] += 1
+                continue
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = f'{target}.restore'
+        shutil.copy2(os.path.join(snapshot_dir, relative), partial)
+        os.replace(partial, target)
+        stats['copied'] += 1
+
+    if delete_extra:
+        for dirpath, dirnames, filenames in os.walk(target_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                relative = os.path.relpath(path, target_dir).replace(os.sep, '/')
+                if relative not in files:
+                    os.remove(path)
+                    stats['removed'] += 1
+    return stats
+
+def snapshot_exclusive_usage(snapshot_dir):
+    """Bytes and files that deleting this snapshot would free: those with no other hardlink"""
+    size = files = 0
+    for dirpath, dirnames, filenames in os.walk(snapshot_dir):
+        for filename in filenames:
+            st = os.lstat(os.path.join(dirpath, filename))
+            if st.st_nlink == 1:
+                size += st.st_size
+                files += 1
+    return size, files
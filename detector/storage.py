@@ -0,0 +1,198 @@
+import collections
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from . import accounting
+from .thumbnails import delete_thumbnails
+
+logger = logging.getLogger(__name__)
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each distinct file once, named by the SHA-256 of its bytes and
+    sharded by hash prefix: uploads/ab/cd/abcd....jpg. Saving bytes that are
+    already stored only adds a reference; MediaBlob keeps a reference count
+    per file, and release() unlinks a file once its last reference is gone.
+
+    A reference and the file write it needs happen in one database
+    transaction, joined by the caller's (Image.save wraps the INSERT), so an
+    upload that fails leaves no reference behind. Unlinks happen after the
+    transaction that dropped the last reference commits; a crash in between
+    leaves an orphan file for migrate_media_layout --sweep-orphans.
+    """
+    prefix = 'uploads'
+
+    @classmethod
+    def blob_name(cls, digest, ext):
+        return '/'.join((cls.prefix, digest[:2], digest[2:4], f'{digest}.{ext}'))
+
+    @staticmethod
+    def hash_content(content):
+        hasher = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        content.seek(0)
+        return hasher.hexdigest()
+
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content in _save, never from a collision suffix
+        return name
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        ext = os.path.splitext(name)[1].lstrip('.').lower() or 'bin'
+        name = self.blob_name(self.hash_content(content), ext)
+
+        with transaction.atomic():
+            added = MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+            if not added:
+                MediaBlob.objects.create(name=name, size=content.size, refcount=1)
+            if not added or not self.exists(name):
+                self._write(name, content)
+                accounting.record('media', content.size)
+        return name
+
+    def _write(self, name, content):
+        """Write through a temporary file and rename, so readers never see a partial blob"""
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def release(self, names, executor=None):
+        """
+        Drop one reference per occurrence of each name and unlink files whose
+        last reference went away. Returns {name: result} for every file an
+        unlink was attempted on: True if removed, False if already gone, None
+        on error. Callers holding a transaction use release_references() in
+        it and delete_unreferenced() after it commits instead.
+        """
+        started = time.time()
+        with transaction.atomic():
+            doomed = self.release_references(names)
+        return self.delete_unreferenced(doomed, started, executor)
+
+    def release_references(self, names):
+        """
+        Drop one reference per occurrence of each name, returning the names
+        left without references. Names without a MediaBlob row predate
+        content addressing and are returned as they are.
+        """
+        from .models import MediaBlob
+
+        counts = collections.Counter(name for name in names if name)
+        if not counts:
+            return []
+        tracked = set(MediaBlob.objects.filter(name__in=counts).values_list('name', flat=True))
+        by_count = collections.defaultdict(list)
+        for name in tracked:
+            by_count[counts[name]].append(name)
+        for count, group in by_count.items():
+            MediaBlob.objects.filter(name__in=group).update(refcount=F('refcount') - count)
+        unreferenced = MediaBlob.objects.filter(name__in=tracked, refcount__lte=0)
+        doomed = list(unreferenced.values_list('name', flat=True))
+        unreferenced.delete()
+        return doomed + [name for name in counts if name not in tracked]
+
+    def delete_unreferenced(self, names, started, executor=None):
+        """
+        Unlink files and their thumbnails once release_references() has
+        committed, returning {name: result} as described in release().
+        started is a time.time() from before that transaction began. Each
+        file is renamed aside first and put back if an upload of the same
+        bytes wrote or referenced it again meanwhile.
+        """
+        from .models import MediaBlob
+
+        if not names:
+            return {}
+        run = executor.map if executor else map
+        retired = dict(zip(names, run(lambda name: self._retire(name, started), names)))
+        moved = [name for name, (aside, _) in retired.items() if aside]
+        revived = set(MediaBlob.objects.filter(name__in=moved).values_list('name', flat=True))
+
+        results = {}
+        freed = removed = 0
+        for name, (aside, result) in retired.items():
+            if aside and (result is None or name in revived):
+                self._restore(name, aside)
+                continue
+            results[name] = result
+        finished = [(name, retired[name][0]) for name in results if retired[name][0]]
+        for (name, _), (size, files) in zip(finished, run(lambda item: self._unlink(*item), finished)):
+            freed += size
+            removed += files
+
+        if removed:
+            accounting.record('media', -freed, -removed)
+        return results
+
+    def _retire(self, name, started):
+        """
+        Rename a file aside, returning (new path, True); (new path, None) if it
+        was written after started, by an upload whose reference may not have
+        committed yet; (None, False) if it is already gone and (None, None) on
+        error
+        """
+        path = self.path(name)
+        aside = f'{path}.{uuid.uuid4().hex}.deleted'
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return None, False
+        except OSError as e:
+            logger.warning(f"Failed to delete file {name}: {e}")
+            return None, None
+        try:
+            fresh = os.path.getmtime(aside) >= started
+        except OSError:
+            fresh = False
+        return aside, None if fresh else True
+
+    def _restore(self, name, aside):
+        try:
+            os.link(aside, self.path(name))
+        except FileExistsError:
+            pass  # The new upload already wrote the same bytes
+        except OSError as e:
+            logger.warning(f"Failed to restore file {name}: {e}")
+            return
+        os.remove(aside)
+
+    def _unlink(self, name, aside):
+        """
+        Delete a retired file and its thumbnails, returning the (bytes, files)
+        freed. Runs in executor threads, so it must not touch the database.
+        """
+        try:
+            size = os.path.getsize(aside)
+            os.remove(aside)
+        except OSError as e:
+            logger.warning(f"Failed to delete file {name}: {e}")
+            return 0, 0
+        thumbnail_bytes, thumbnail_files = delete_thumbnails(self, name)
+        return size + thumbnail_bytes, 1 + thumbnail_files
+
+image_storage = ContentAddressedStorage()
+
+def get_image_storage():
+    return image_storage
@@ -1,3 +1,790 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+from unittest import mock
+import numpy as np
+from PIL import Image as PILImage
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from . import accounting, analytics, coalesce, embeddings, evaluation, snapshots, thumbnails, views
+from .cleanup import BulkCleanup
+from .management.commands.analyze_directory import Command as AnalyzeDirectory
+from .management.commands.migrate_media_layout import Command as MigrateMediaLayout
+from .memory import MemoryGovernor
+from .metrics import MetricsSampler
+from .models import DailyRollup, Image, JobStatus, MediaBlob
+from .scheduler import CronSchedule, Job, LeaderLock, Scheduler
+from .storage import ContentAddressedStorage, image_storage
+from .tasks import TaskStatus
 
-# Create your tests here.
+class QueryPlanTests(TestCase):
+    """
+    Make sure the queries run against detector_image use an index instead of
+    scanning or sorting the whole table, which gets linearly slower as it grows.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def assertUsesIndex(self, queryset):
+        sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[-1] for row in cursor.fetchall()]
+
+        for detail in plan:
+            if detail.startswith('SCAN') and 'detector_image' in detail:
+                self.assertIn('INDEX', detail, f'Full table scan in plan {plan} for {sql}')
+            self.assertNotIn('TEMP B-TREE FOR ORDER BY', detail, f'Sort without index in plan {plan} for {sql}')
+
+    def changelist_queryset(self, query=''):
+        request = RequestFactory().get(f'/admin/detector/image/{query}')
+        request.user = self.superuser
+        model_admin = admin.site._registry[Image]
+        return model_admin.get_changelist_instance(request).queryset
+
+    def test_cleanup_queries_use_index(self):
+        threshold = timezone.now() - datetime.timedelta(days=7)
+        self.assertUsesIndex(Image.objects.filter(uploaded_at__lt=threshold, analysis_result__isnull=False))
+        self.assertUsesIndex(Image.objects.filter(uploaded_at__lt=threshold, analysis_result__isnull=True))
+        self.assertUsesIndex(Image.objects.filter(uploaded_at__lt=threshold).exclude(analysis_result__isnull=True))
+
+    def test_admin_changelist_queries_use_index(self):
+        self.assertUsesIndex(self.changelist_queryset())
+        self.assertUsesIndex(self.changelist_queryset('?is_real__exact=1'))
+        self.assertUsesIndex(self.changelist_queryset('?is_real__isnull=True'))
+
+        today = timezone.now().date()
+        week_ago = today - datetime.timedelta(days=7)
+        self.assertUsesIndex(self.changelist_queryset(
+            f'?uploaded_at__gte={week_ago}&uploaded_at__lt={today + datetime.timedelta(days=1)}'
+        ))
+        self.assertUsesIndex(self.changelist_queryset(f'?is_real__exact=0&uploaded_at__gte={week_ago}'))
+
+    def test_dashboard_queries_use_index(self):
+        since = timezone.now() - datetime.timedelta(days=1)
+        self.assertUsesIndex(Image.objects.filter(uploaded_at__gte=since))
+        self.assertUsesIndex(Image.objects.order_by('-uploaded_at')[:10])
+        self.assertUsesIndex(
+            Image.objects.filter(uploaded_at__gte=since).values('is_real').annotate(count=Count('id')).order_by()
+        )
+
+    def test_admin_search_uses_fts_index(self):
+        # bulk_create skips Image.save, which would try to open the files
+        Image.objects.bulk_create([
+            Image(image=f'uploads/{filename}', original_filename=filename, analysis_result=result)
+            for filename, result in [('holiday_sunset.jpg', 'Real Image'), ('IMG_4521.png', 'AI Generated'),
+                                     ('sunrise.jpg', 'Real Image')]
+        ])
+        Image.objects.filter(original_filename='sunrise.jpg').update(original_filename='sunset_2.jpg')
+
+        for query, expected in [('sunset', 2), ('IMG_45', 1), ('"ai gen"', 1), ('sunset real', 2), ('zz', 0)]:
+            queryset = self.changelist_queryset(f'?q={query}')
+            self.assertEqual(queryset.count(), expected, query)
+
+        sql, params = self.changelist_queryset('?q=sunset').query.get_compiler(using='default').as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertIn('SEARCH detector_image USING INTEGER PRIMARY KEY (rowid=?)', plan)
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings = override_settings(MEDIA_ROOT=media_root, THUMBNAILS={'SIZES': (64,)})
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        output = io.BytesIO()
+        PILImage.new('RGB', (32, 32), 'red').save(output, format='JPEG')
+        self.jpeg = output.getvalue()
+
+    def upload(self):
+        return Image.objects.create(image=SimpleUploadedFile('photo.jpg', self.jpeg, content_type='image/jpeg'))
+
+    def test_duplicates_share_a_file_until_the_last_delete(self):
+        first, second = self.upload(), self.upload()
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+        thumbnails.generate_thumbnails(image_storage, name)
+
+        first.delete()
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+        self.assertTrue(image_storage.exists(name))
+
+        second.delete()
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertEqual(os.listdir(os.path.dirname(image_storage.path(name))), [])
+        self.assertFalse(image_storage.exists(thumbnails.thumbnail_name(name, 64)))
+        # Releasing it again finds nothing left to delete
+        self.assertEqual(image_storage.release([name]), {name: False})
+
+    def test_failed_insert_drops_its_reference(self):
+        name = self.upload().image.name
+        with mock.patch.object(Image, '_do_insert', side_effect=IntegrityError), self.assertRaises(IntegrityError):
+            self.upload()
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+
+    def test_upload_between_commit_and_unlink_keeps_its_file(self):
+        image = self.upload()
+        name = image.image.name
+        started = time.time()
+        with transaction.atomic():
+            doomed = image_storage.release_references([name])
+            Image.objects.filter(pk=image.pk).delete()
+        self.upload()
+        os.utime(image_storage.path(name), (0, 0))  # Only its new MediaBlob row tells it apart
+        self.assertEqual(image_storage.delete_unreferenced(doomed, started), {})
+        self.assertTrue(image_storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings = override_settings(MEDIA_ROOT=media_root, THUMBNAILS={'SIZES': (64,)})
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_created_on_first_request(self):
+        output = io.BytesIO()
+        PILImage.new('RGB', (200, 100), 'red').save(output, format='JPEG')
+        image = Image.objects.create(image=SimpleUploadedFile('photo.jpg', output.getvalue()))
+        name = thumbnails.thumbnail_name(image.image.name, 64)
+        self.assertFalse(image_storage.exists(name))
+
+        self.assertEqual(image.thumbnail_url(64), image_storage.url(name))
+        with image_storage.open(name) as f, PILImage.open(f) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (64, 32)))
+        with mock.patch.object(thumbnails, 'generate_thumbnails') as generate:
+            self.assertEqual(image.thumbnail_url(64), image_storage.url(name))
+        generate.assert_not_called()
+
+    def test_falls_back_to_original_when_rendering_fails(self):
+        os.makedirs(image_storage.path('uploads'))
+        with open(image_storage.path('uploads/corrupt.jpg'), 'wb') as f:
+            f.write(b'not an image')
+        Image.objects.bulk_create([Image(image='uploads/corrupt.jpg')])
+        image = Image.objects.get()
+
+        with self.assertLogs('detector.thumbnails', 'WARNING'):
+            self.assertEqual(image.thumbnail_url(64), image.image.url)
+        self.assertFalse(image_storage.exists(thumbnails.thumbnail_name(image.image.name, 64)))
+
+class StorageAccountingTests(TestCase):
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_dir)
+        self.settings = override_settings(BASE_DIR=self.base_dir, MEDIA_ROOT=os.path.join(self.base_dir, 'media'),
+                                          THUMBNAILS={'SIZES': (64,)})
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def upload(self, color):
+        output = io.BytesIO()
+        PILImage.new('RGB', (32, 32), color).save(output, format='JPEG')
+        return Image.objects.create(image=SimpleUploadedFile('photo.jpg', output.getvalue(), content_type='image/jpeg'))
+
+    def test_counters_match_reconciliation(self):
+        # Five backups of each kind already exist, so the next run prunes the oldest
+        backup_dir = os.path.join(self.base_dir, 'backups')
+        source = os.path.join(self.base_dir, 'source')
+        os.makedirs(source)
+        for i in range(5):
+            with open(os.path.join(source, 'file.bin'), 'wb') as f:
+                f.write(bytes([i]) * 100)
+            db_backup = os.path.join(backup_dir, f'db_backup_2020010{i}_000000.json')
+            snapshot = os.path.join(backup_dir, f'{snapshots.PREFIX}2020010{i}_000000')
+            snapshots.create_snapshot(source, snapshot, snapshots.list_snapshots(backup_dir)[0] if i else None)
+            with open(db_backup, 'w') as f:
+                f.write('[]')
+            for path in (db_backup, snapshot):
+                os.utime(path, (1_000_000_000 + i, 1_000_000_000 + i))
+        os.makedirs(settings.MEDIA_ROOT)
+        accounting.reconcile()
+
+        kept, deleted = self.upload('red'), self.upload('blue')
+        thumbnails.generate_thumbnails(image_storage, kept.image.name)
+        thumbnails.generate_thumbnails(image_storage, deleted.image.name)
+        deleted.delete()
+        call_command('backup_db', mode='json', include_media=True, stdout=io.StringIO(), stderr=io.StringIO())
+
+        self.assertEqual(len(os.listdir(backup_dir)), 10)
+        self.assertFalse(os.path.exists(os.path.join(backup_dir, 'db_backup_20200100_000000.json')))
+        self.assertFalse(os.path.exists(os.path.join(backup_dir, f'{snapshots.PREFIX}20200100_000000')))
+        self.assertEqual(accounting.get_usage()['media']['files'], 2)  # The kept upload and its thumbnail
+        self.assertEqual(accounting.reconcile(), {area: {'bytes': 0, 'files': 0} for area in ('media', 'backups')})
+
+class MigrateMediaLayoutTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings = override_settings(MEDIA_ROOT=media_root)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_moves_deduplicates_and_resumes(self):
+        os.makedirs(image_storage.path('uploads'))
+        contents = {'a.jpg': b'same', 'b.jpg': b'same', 'c.png': b'other'}
+        for filename, data in contents.items():
+            with open(image_storage.path(f'uploads/{filename}'), 'wb') as f:
+                f.write(data)
+        a, b, missing, c = Image.objects.bulk_create([
+            Image(image=f'uploads/{filename}') for filename in ('a.jpg', 'b.jpg', 'gone.jpg', 'c.png')
+        ])
+
+        # The first run stops after its first batch of two
+        original = MigrateMediaLayout._migrate_batch
+        def interrupted(command, batch, stats):
+            if batch[0][0] != a.pk:
+                raise KeyboardInterrupt
+            original(command, batch, stats)
+        with mock.patch.object(MigrateMediaLayout, '_migrate_batch', interrupted), \
+                self.assertRaises(KeyboardInterrupt):
+            call_command('migrate_media_layout', batch_size=2, stdout=io.StringIO())
+        call_command('migrate_media_layout', batch_size=2, stdout=io.StringIO())
+
+        same = ContentAddressedStorage.blob_name(hashlib.sha256(b'same').hexdigest(), 'jpg')
+        other = ContentAddressedStorage.blob_name(hashlib.sha256(b'other').hexdigest(), 'png')
+        self.assertEqual(dict(Image.objects.values_list('pk', 'image')),
+                         {a.pk: same, b.pk: same, missing.pk: 'uploads/gone.jpg', c.pk: other})
+        self.assertEqual(dict(MediaBlob.objects.values_list('name', 'refcount')), {same: 2, other: 1})
+        for name, data in ((same, b'same'), (other, b'other')):
+            with image_storage.open(name) as f:
+                self.assertEqual(f.read(), data)
+        self.assertFalse(any(os.path.isfile(image_storage.path(f'uploads/{name}'))
+                             for name in os.listdir(image_storage.path('uploads'))))
+
+class BulkCleanupTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings = override_settings(MEDIA_ROOT=media_root)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_deletes_in_chunks_and_resumes_from_checkpoint(self):
+        os.makedirs(image_storage.path('uploads'))
+        for n in range(11):
+            with open(image_storage.path(f'uploads/{n}.jpg'), 'wb') as f:
+                f.write(b'x')
+        images = Image.objects.bulk_create([
+            Image(image=f'uploads/{n}.jpg', analysis_result='Real Image' if n < 10 else None) for n in range(11)
+        ])
+        old = Image.objects.filter(analysis_result__isnull=False)
+        checkpoint = os.path.join(settings.MEDIA_ROOT, 'cleanup.json')
+
+        def interrupt(stats, total):
+            if stats['chunks'] == 2:
+                raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            BulkCleanup(old, chunk_size=3, checkpoint_path=checkpoint, progress=interrupt).run()
+        self.assertEqual(Image.objects.count(), 5)
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f), {'last_pk': images[5].pk})
+
+        stats = BulkCleanup(old, chunk_size=3, checkpoint_path=checkpoint).run()
+        self.assertEqual((stats['deleted'], stats['files_deleted'], stats['chunks']), (4, 4, 2))
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(list(Image.objects.values_list('pk', flat=True)), [images[10].pk])
+        self.assertEqual(os.listdir(image_storage.path('uploads')), ['10.jpg'])
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.source = os.path.join(self.directory, 'media')
+        os.makedirs(os.path.join(self.source, 'uploads'))
+
+    def write(self, relative, data, mtime):
+        path = os.path.join(self.source, relative)
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, ns=(mtime, mtime))
+
+    def test_incremental_snapshots_round_trip(self):
+        self.write('uploads/a.jpg', b'aaaa', 1_000_000_000)
+        self.write('uploads/b.jpg', b'bbbb', 1_000_000_000)
+        first = os.path.join(self.directory, f'{snapshots.PREFIX}1')
+        self.assertEqual(snapshots.create_snapshot(self.source, first),
+                         {'files': 2, 'linked': 0, 'copied': 2, 'copied_bytes': 8})
+
+        # Same size but a new mtime is a change; a new file is copied too
+        self.write('uploads/b.jpg', b'BBBB', 2_000_000_000)
+        self.write('c.jpg', b'cc', 2_000_000_000)
+        second = os.path.join(self.directory, f'{snapshots.PREFIX}2')
+        self.assertEqual(snapshots.create_snapshot(self.source, second, first),
+                         {'files': 3, 'linked': 1, 'copied': 2, 'copied_bytes': 6})
+        self.assertEqual(snapshots.list_snapshots(self.directory), [second, first])
+        self.assertTrue(os.path.samefile(f'{first}/uploads/a.jpg', f'{second}/uploads/a.jpg'))
+        self.assertFalse(os.path.samefile(f'{first}/uploads/b.jpg', f'{second}/uploads/b.jpg'))
+        manifest_size = os.path.getsize(os.path.join(second, snapshots.MANIFEST))
+        self.assertEqual(snapshots.snapshot_exclusive_usage(second), (6 + manifest_size, 3))  # b, c, manifest
+
+        for snapshot in (first, second):
+            self.assertEqual(snapshots.verify_snapshot(snapshot, full=True), [])
+        with open(f'{second}/uploads/b.jpg', 'wb') as f:
+            f.write(b'XXXX')
+        self.assertEqual(snapshots.verify_snapshot(second), [])
+        self.assertEqual(snapshots.verify_snapshot(second, full=True),
+                         ['uploads/b.jpg: checksum differs from manifest'])
+
+        self.assertEqual(snapshots.restore_snapshot(first, self.source, delete_extra=True),
+                         {'copied': 1, 'unchanged': 1, 'removed': 1})
+        with open(os.path.join(self.source, 'uploads/b.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), b'bbbb')
+        self.assertFalse(os.path.exists(os.path.join(self.source, 'c.jpg')))
+
+@override_settings(METRICS={'HISTORY': 3})
+class MetricsSamplerTests(TestCase):
+    def test_ring_buffer_keeps_the_latest_samples(self):
+        sampler = MetricsSampler()
+        # start() sizes the buffer from settings; no thread actually samples
+        with mock.patch('detector.metrics.threading.Thread'):
+            sampler.start()
+        now = time.time()
+        for age in (40, 30, 20, 10, 0):
+            sampler.sample()['timestamp'] = now - age
+
+        self.assertEqual([sample['timestamp'] for sample in sampler.history()], [now - 20, now - 10, now])
+        self.assertEqual([sample['timestamp'] for sample in sampler.history(seconds=15)], [now - 10, now])
+        self.assertEqual([set(sample) for sample in sampler.history(fields=['rss_mb'])],
+                         [{'timestamp', 'rss_mb'}] * 3)
+        self.assertEqual(sampler.latest()['timestamp'], now)
+        self.assertEqual(len(sampler.samples), 3)
+
+@override_settings(MEMORY_GOVERNOR={'CHECK_INTERVAL': 0, 'GC_THRESHOLD_MB': 400, 'TRIM_THRESHOLD_MB': 450,
+                                     'HARD_LIMIT_MB': 500, 'COOLDOWN': 30})
+class MemoryGovernorTests(TestCase):
+    def setUp(self):
+        self.governor = MemoryGovernor()
+        self.governor.malloc_trim = mock.Mock()
+        self.rss = 0
+        patcher = mock.patch.object(self.governor, 'rss_mb', side_effect=lambda: self.rss)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def check_at(self, rss):
+        self.rss = rss
+        self.governor.check()
+        return self.governor.stats['last_action']
+
+    def test_thresholds(self):
+        self.assertIsNone(self.check_at(399))
+        self.assertEqual(self.check_at(420), 'collect')
+        self.governor.malloc_trim.assert_not_called()
+        # Still above the threshold, but within the cooldown
+        self.governor.stats['last_action'] = None
+        self.assertIsNone(self.check_at(470))
+
+        self.governor.last_action -= 30
+        self.assertEqual(self.check_at(470), 'collect+trim')
+        self.governor.malloc_trim.assert_called_once_with(0)
+        self.assertEqual((self.governor.stats['collections'], self.governor.stats['trims']), (2, 1))
+        self.assertEqual(self.governor.stats['peak_rss_mb'], 470)
+
+    def test_hard_limit_recycles_the_worker_once(self):
+        worker = types.SimpleNamespace(alive=True)
+        # As gunicorn.conf.py wires it up in post_worker_init
+        self.governor.recycle_callback = lambda: setattr(worker, 'alive', False)
+        self.check_at(420)
+        self.assertEqual(self.check_at(520), 'recycle')  # The cooldown doesn't delay it
+        self.assertFalse(worker.alive)
+        self.check_at(530)
+        self.assertEqual(self.governor.stats['recycles'], 1)
+
+    def test_hard_limit_without_a_worker_reclaims_instead(self):
+        self.assertEqual(self.check_at(520), 'collect+trim')
+        self.assertEqual(self.governor.stats['recycles'], 0)
+        self.assertFalse(self.governor.recycling)
+
+class SchedulerTests(TestCase):
+    def test_cron_parsing(self):
+        schedule = CronSchedule('*/15 9-17/4 1,15 * 1-5')
+        self.assertEqual(schedule.minutes, {0, 15, 30, 45})
+        self.assertEqual(schedule.hours, {9, 13, 17})
+        self.assertEqual(schedule.days, {1, 15})
+        self.assertEqual(schedule.months, set(range(1, 13)))
+        self.assertEqual(schedule.weekdays, {1, 2, 3, 4, 5})
+        self.assertEqual(CronSchedule('5/20 * * * *').minutes, {5, 25, 45})
+        for expression in ('* * * *', '60 * * * *', '* 5-2 * * *', '*/0 * * * *', '* * 0 * *', 'a * * * *'):
+            with self.assertRaises(ValueError, msg=expression):
+                CronSchedule(expression)
+
+    def test_next_run(self):
+        friday = datetime.datetime(2024, 3, 1, 17, 50)
+        for expression, expected in [
+            ('17 * * * *', datetime.datetime(2024, 3, 1, 18, 17)),
+            ('50 17 * * *', datetime.datetime(2024, 3, 2, 17, 50)),  # Strictly after
+            ('*/15 9-17 * * 1-5', datetime.datetime(2024, 3, 4, 9, 0)),  # Over the weekend
+            ('0 0 13 * 5', datetime.datetime(2024, 3, 8, 0, 0)),  # The 13th or a Friday
+            ('0 0 13 * 3', datetime.datetime(2024, 3, 6, 0, 0)),
+            ('0 0 29 2 *', datetime.datetime(2028, 2, 29, 0, 0)),
+        ]:
+            self.assertEqual(CronSchedule(expression).next_after(friday), expected, expression)
+        with self.assertRaises(ValueError):
+            CronSchedule('0 0 30 2 *').next_after(friday)
+
+    def test_jitter_delays_within_bound(self):
+        now = timezone.now()
+        on_time = Job('hourly', None, '0 * * * *').plan_after(now)
+        self.assertEqual((on_time.minute, on_time.second), (0, 0))
+        for _ in range(20):
+            delay = (Job('hourly', None, '0 * * * *', jitter=300).plan_after(now) - on_time).total_seconds()
+            self.assertTrue(0 <= delay <= 300, delay)
+
+    def test_new_leader_catches_up_once(self):
+        calls = []
+        scheduler = Scheduler()
+        scheduler.register('missed', lambda: calls.append('missed'), '0 * * * *')
+        scheduler.register('fresh', lambda: calls.append('fresh'), '0 * * * *')
+        now = timezone.now()
+        # The previous leader died during a run three hours ago
+        JobStatus.objects.create(name='missed', last_run=now - datetime.timedelta(hours=3), running=True)
+
+        scheduler._become_leader()
+        missed, fresh = scheduler.jobs['missed'], scheduler.jobs['fresh']
+        self.assertFalse(TaskStatus('missed').is_running)
+        self.assertLess(missed.next_run, now)
+        self.assertGreater(fresh.next_run, now)
+        self.assertEqual(TaskStatus('fresh').next_run, fresh.next_run)
+
+        scheduler._run_job(missed)
+        self.assertEqual(calls, ['missed'])
+        self.assertTrue(TaskStatus('missed').last_status)
+        # One catch-up run, then back on schedule
+        self.assertGreater(missed.next_run, timezone.now())
+
+    def test_only_the_lock_holder_leads(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'scheduler.lock')
+        leader = LeaderLock(path)
+        self.assertTrue(leader.acquire())
+        self.assertFalse(LeaderLock(path).acquire())
+
+        follower = Scheduler()  # No jobs, so electing it doesn't touch the database
+        with override_settings(SCHEDULER={'LOCK_FILE': path, 'RETRY_INTERVAL': 0.01}):
+            follower.start()
+            self.addCleanup(follower.stop)
+            self.assertFalse(follower.is_leader)
+            leader.release()  # As when the leading worker exits
+            deadline = time.monotonic() + 5
+            while not follower.is_leader and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(follower.is_leader)
+            self.assertFalse(leader.acquire())
+            follower.stop()
+            self.assertTrue(leader.acquire())
+        leader.release()
+
+class EmbeddingStoreTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_ivf_search_matches_exact_search(self):
+        images = Image.objects.bulk_create([Image(image=f'uploads/{n}.jpg') for n in range(400)])
+        ids = [image.pk for image in images]
+        vectors = np.random.default_rng(0).standard_normal((400, 32)).astype(np.float32)
+        store = embeddings.EmbeddingStore(self.directory)
+        store.add(ids[:300], vectors[:300])
+        store.add(ids[300:], vectors[300:])
+
+        with override_settings(EMBEDDINGS={'NPROBE': 8, 'CHUNK_ROWS': 64}):
+            exact = store.search(vectors[7], k=5)
+            self.assertEqual(exact[0][0], ids[7])
+            self.assertAlmostEqual(exact[0][1], 1.0, places=2)
+
+            embeddings.build_index(store, nlist=8, pca=16)
+            store.add([ids[7]], vectors[7:8])  # Rows after the index are scanned exactly
+            # Probing every list leaves only the float16 codes as a difference, undone by rescoring
+            approximate = store.search(vectors[7], k=6)
+            self.assertEqual([pk for pk, _ in approximate[:2]], [ids[7], ids[7]])
+            self.assertEqual([pk for pk, _ in approximate[2:]], [pk for pk, _ in exact[1:]])
+
+            # Deleted and excluded images are skipped, and the next closest take their place
+            Image.objects.filter(pk=ids[7]).delete()
+            similar = embeddings.find_similar(store, vectors[7], k=3, exclude=exact[1][0])
+            self.assertEqual([image.pk for image, _ in similar], [pk for pk, _ in exact[2:5]])
+
+    def test_prune_drops_deleted_and_superseded_rows(self):
+        images = Image.objects.bulk_create([Image(image=f'uploads/{n}.jpg') for n in range(100)])
+        ids = [image.pk for image in images]
+        vectors = np.random.default_rng(0).standard_normal((101, 32)).astype(np.float32)
+        store = embeddings.EmbeddingStore(f'{self.directory}/v1')
+        store.add(ids, vectors[:100])
+        store.add(ids[:1], vectors[100:])  # Re-analyzed; only the latest row survives
+        embeddings.build_index(store, nlist=4)
+        Image.objects.filter(pk__in=ids[50:]).delete()
+
+        with override_settings(EMBEDDINGS={'DIR': self.directory}):
+            self.assertEqual(embeddings.prune_stores(), 51)
+            self.assertEqual(embeddings.prune_stores(), 0)
+        # Readers of the old files, like this instance, switch to the new ones
+        self.assertEqual(len(store), 50)
+        self.assertEqual(sorted(store.stored_ids()), ids[:50])
+        np.testing.assert_allclose(store.get(ids[0]), embeddings.normalize(vectors[100]), atol=1e-3)
+        self.assertEqual(store.load_index().built_count, 50)
+        self.assertEqual(store.search(vectors[10], k=1)[0][0], ids[10])
+        store.add([ids[1]], vectors[1:2])
+        self.assertEqual(len(embeddings.EmbeddingStore(f'{self.directory}/v1')), 51)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                             'LOCATION': 'analyze-image-content-tests'}})
+class AnalyzeImageContentTests(TestCase):
+    def test_only_the_verdict_is_cached(self):
+        result = {'is_real': True, 'confidence': 0.8, 'embedding': np.ones(4, dtype=np.float32)}
+        with mock.patch.object(views.analyzer, 'analyze_image', return_value=result) as analyze:
+            self.assertIs(views.analyze_image_content('/media/blobs/ab/cd/abcd.jpg'), result)
+            self.assertEqual(views.analyze_image_content('/media/blobs/ab/cd/abcd.jpg'),
+                             {'is_real': True, 'confidence': 0.8})
+        analyze.assert_called_once()
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.settings = override_settings(COALESCING={'DIR': directory, 'TIMEOUT': 0.5})
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def start(self, flights, func):
+        """Call flights.do('key', func) in a thread; join it for the (result, how)"""
+        outcome = []
+        thread = threading.Thread(target=lambda: outcome.append(flights.do('key', func)))
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        thread.outcome = lambda: thread.join(5) or outcome[0]
+        return thread
+
+    def test_concurrent_calls_share_one_result(self):
+        waiting = threading.Semaphore(0)
+
+        class Flight(coalesce._Flight):
+            """Signals each duplicate that starts waiting on it"""
+            def __init__(self):
+                super().__init__()
+                done_wait = self.done.wait
+                self.done.wait = lambda timeout=None: waiting.release() or done_wait(timeout)
+
+        calls = []
+        def analyze():
+            calls.append(1)
+            for _ in range(3):  # Finish once every duplicate is waiting
+                self.assertTrue(waiting.acquire(timeout=5))
+            return {'result': 'Real Image'}
+
+        flights = coalesce.SingleFlight()
+        with mock.patch.object(coalesce, '_Flight', Flight):
+            threads = [self.start(flights, analyze) for _ in range(4)]
+            outcomes = [thread.outcome() for thread in threads]
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(how for _, how in outcomes), [coalesce.LEADER] + [coalesce.SHARED] * 3)
+        self.assertEqual([result for result, _ in outcomes], [{'result': 'Real Image'}] * 4)
+        self.assertEqual(flights.get_stats()['coalesced_rate'], 0.75)
+
+    def test_other_workers_share_while_waiting_and_reuse_after(self):
+        blocked = threading.Event()
+
+        class Lock(LeaderLock):
+            """Signals when a worker finds the flight's lock taken"""
+            def acquire(self):
+                acquired = super().acquire()
+                if not acquired:
+                    blocked.set()
+                return acquired
+
+        running = threading.Event()
+        def analyze():
+            running.set()
+            self.assertTrue(blocked.wait(5))  # Finish once the other worker is waiting
+            return {'result': 'Real Image'}
+
+        with mock.patch.object(coalesce, 'LeaderLock', Lock):
+            leader = self.start(coalesce.SingleFlight(), analyze)
+            self.assertTrue(running.wait(5))
+            waiter = coalesce.SingleFlight()
+            self.assertEqual(waiter.do('key', analyze), ({'result': 'Real Image'}, coalesce.SHARED))
+            self.assertEqual(leader.outcome(), ({'result': 'Real Image'}, coalesce.LEADER))
+
+            # A worker arriving after the flight ended reads the result it left, but wasn't coalesced
+            late = coalesce.SingleFlight()
+            self.assertEqual(late.do('key', analyze), ({'result': 'Real Image'}, coalesce.LATE))
+        self.assertEqual(waiter.get_stats()['shared_across_workers'], 1)
+        self.assertEqual((late.get_stats()['late_results'], late.get_stats()['coalesced_rate']), (1, 0.0))
+
+    def test_waiters_fall_back_to_running_the_function(self):
+        running, finish = threading.Event(), threading.Event()
+        def analyze():
+            running.set()
+            finish.wait(5)
+            return {}
+
+        flights = coalesce.SingleFlight()
+        leader = self.start(flights, analyze)
+        self.assertTrue(running.wait(5))
+        self.assertEqual(flights.do('key', lambda: {'ran': True}), ({'ran': True}, coalesce.TIMED_OUT))
+        finish.set()
+        self.assertEqual(leader.outcome(), ({}, coalesce.LEADER))
+
+class RollupBackfillTests(TestCase):
+    def create_day(self, days_ago, count):
+        """count analyzed images uploaded days_ago, counted in the rollups as uploads do"""
+        uploaded_at = timezone.now() - datetime.timedelta(days=days_ago)
+        images = Image.objects.bulk_create([
+            Image(image=f'uploads/{days_ago}-{n}.jpg', is_real=True, confidence_score=0.9,
+                  analysis_result='Real Image', model_version='v1', file_size=100)
+            for n in range(count)
+        ])
+        Image.objects.filter(pk__in=[image.pk for image in images]).update(uploaded_at=uploaded_at)
+        for image in Image.objects.filter(pk__in=[image.pk for image in images]):
+            analytics.record_analysis(image)
+        return timezone.localdate(uploaded_at), images
+
+    def test_partly_cleaned_day_keeps_its_counts(self):
+        old_day, old_images = self.create_day(days_ago=7, count=4)
+        recent_day, _ = self.create_day(days_ago=2, count=3)
+        # Cleanup removed part of the old day; the recent one is complete
+        Image.objects.filter(pk__in=[image.pk for image in old_images[:3]]).delete()
+        DailyRollup.objects.filter(day=recent_day).update(uploads=99)
+
+        call_command('backfill_rollups', stdout=io.StringIO())
+        self.assertEqual(DailyRollup.objects.get(day=old_day).uploads, 4)
+        self.assertEqual(DailyRollup.objects.get(day=recent_day).uploads, 3)
+
+        with self.assertRaises(CommandError):
+            call_command('backfill_rollups', since=old_day)
+        with self.assertRaises(ValueError):
+            analytics.rebuild_day(old_day)
+        self.assertEqual(DailyRollup.objects.get(day=old_day).uploads, 4)
+
+        call_command('backfill_rollups', since=old_day, force=True, stdout=io.StringIO())
+        self.assertEqual(DailyRollup.objects.get(day=old_day).uploads, 1)
+
+class RestoreDbTests(TestCase):
+    def test_json_restore_replaces_existing_rows(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        backup = os.path.join(directory, 'db_backup.json')
+        kept, = Image.objects.bulk_create([Image(image='uploads/kept.jpg', original_filename='kept.jpg')])
+        call_command('dumpdata', exclude=['contenttypes', 'auth.permission'], natural_foreign=True,
+                     natural_primary=True, output=backup)
+        Image.objects.bulk_create([Image(image='uploads/later.jpg', original_filename='later.jpg')])
+
+        call_command('restore_db', backup, interactive=False, stdout=io.StringIO())
+        self.assertEqual(list(Image.objects.values_list('pk', 'original_filename')), [(kept.pk, 'kept.jpg')])
+
+class EvaluationTests(TestCase):
+    def test_roc_auc(self):
+        self.assertEqual(evaluation.roc_auc([0, 0, 1, 1], [0.1, 0.2, 0.3, 0.4]), 1.0)
+        self.assertEqual(evaluation.roc_auc([0, 0, 1, 1], [0.4, 0.3, 0.2, 0.1]), 0.0)
+        # Pairs (real, fake): 0.9/0.9 tie counts half, 0.9/0.1 and 0.8/0.1 win, 0.8/0.9 loses
+        self.assertEqual(evaluation.roc_auc([1, 0, 1, 0], [0.9, 0.9, 0.8, 0.1]), 0.625)
+        self.assertEqual(evaluation.roc_auc([1, 0, 1, 0], [0.5] * 4), 0.5)
+        self.assertIsNone(evaluation.roc_auc([1, 1], [0.2, 0.8]))
+        self.assertIsNone(evaluation.roc_auc([], []))
+
+    def test_calibration(self):
+        result = evaluation.calibration([0, 1, 1, 1, 0], [0.1, 0.2, 0.8, 0.9, 1.0], bins=4)
+        # Bin gaps |0.15 - 1/2| and |0.9 - 2/3| weighted by 2/5 and 3/5
+        self.assertEqual(result['ece'], 0.28)
+        self.assertEqual(result['brier'], 0.34)  # (0.01 + 0.64 + 0.04 + 0.01 + 1) / 5
+        self.assertEqual(result['bins'], [
+            {'low': 0.0, 'high': 0.25, 'count': 2, 'mean_predicted': 0.15, 'fraction_real': 0.5},
+            {'low': 0.25, 'high': 0.5, 'count': 0},
+            {'low': 0.5, 'high': 0.75, 'count': 0},
+            {'low': 0.75, 'high': 1.0, 'count': 3, 'mean_predicted': 0.9, 'fraction_real': 0.6667},
+        ])
+        # Inner edges belong to the bin above them
+        self.assertEqual([row['count'] for row in evaluation.calibration([1, 1], [0.5, 0.75], bins=4)['bins']],
+                         [0, 0, 1, 1])
+
+    def test_confusion_matrix(self):
+        self.assertEqual(evaluation.confusion_matrix([1, 1, 0, 0, 0], [1, 0, 0, 0, 1]),
+                         {'real': {'real': 1, 'fake': 1}, 'fake': {'real': 1, 'fake': 2}})
+
+    def test_classification_report(self):
+        # A probability equal to the threshold counts as fake; only real images present
+        report = evaluation.classification_report([1, 1], [0.5, 0.7])
+        self.assertEqual(report['accuracy'], 0.5)
+        self.assertIsNone(report['roc_auc'])
+        self.assertEqual(report['real_recall'], 0.5)
+        self.assertIsNone(report['fake_recall'])
+        self.assertEqual(report['confusion_matrix'], {'real': {'real': 1, 'fake': 1}, 'fake': {'real': 0, 'fake': 0}})
+
+        empty = evaluation.classification_report([], [])
+        self.assertEqual((empty['images'], empty['accuracy'], empty['roc_auc'], empty['calibration']),
+                         (0, None, None, None))
+
+class AnalyzeDirectoryTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.images = os.path.join(self.directory, 'images')
+        os.makedirs(self.images)
+        self.output = os.path.join(self.directory, 'results.ndjson')
+
+    def write_image(self, filename, color):
+        PILImage.new('RGB', (16, 16), color).save(os.path.join(self.images, filename))
+
+    def analyze(self, **options):
+        verdicts = mock.patch('detector.ai_model.ImageAnalyzer.analyze_pixels',
+                              side_effect=lambda images: [{'is_real': True, 'confidence': 0.9}] * len(images))
+        with verdicts:
+            call_command('analyze_directory', self.images, output=self.output, batch_size=2, workers=1,
+                         stdout=io.StringIO(), **options)
+
+    def test_resume_after_interruption(self):
+        # Batches of two: [a, b], [c, d], [e, f]; b repeats a and e repeats c
+        self.write_image('a.png', 'red')
+        shutil.copy(os.path.join(self.images, 'a.png'), os.path.join(self.images, 'b.png'))
+        self.write_image('c.png', 'green')
+        self.write_image('d.png', 'blue')
+        shutil.copy(os.path.join(self.images, 'c.png'), os.path.join(self.images, 'e.png'))
+        with open(os.path.join(self.images, 'f.png'), 'wb') as f:
+            f.write(b'not an image')
+
+        # The second batch is written but the run dies before checkpointing it,
+        # leaving a torn line behind
+        original = AnalyzeDirectory._save_checkpoint
+        def interrupted(command):
+            if command.state['counts']['processed'] > 2:
+                command.output_file.write(b'{"path": "')
+                raise KeyboardInterrupt
+            original(command)
+        with mock.patch.object(AnalyzeDirectory, '_save_checkpoint', interrupted), self.assertRaises(CommandError):
+            self.analyze()
+        with open(f'{self.output}.checkpoint') as f:
+            checkpoint = json.load(f)
+        self.assertEqual(checkpoint['last_path'], 'b.png')
+        self.assertLess(checkpoint['output_offset'], os.path.getsize(self.output))
+
+        self.analyze(resume=True)
+        with open(self.output) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([(os.path.basename(row['path']), row['source']) for row in rows], [
+            ('a.png', 'model'), ('b.png', 'duplicate'), ('c.png', 'model'),
+            ('d.png', 'model'), ('e.png', 'duplicate'), ('f.png', 'error'),
+        ])
+        self.assertEqual(rows[0]['digest'], rows[1]['digest'])
+        self.assertEqual(rows[2]['digest'], rows[4]['digest'])
+        with open(f'{self.output}.checkpoint') as f:
+            checkpoint = json.load(f)
+        self.assertTrue(checkpoint['completed'])
+        self.assertEqual(checkpoint['counts'], {'processed': 6, 'analyzed': 3, 'duplicates': 2, 'failed': 1})
@@ -0,0 +1,96 @@
+import io
+import logging
+import os
+import tempfile
+from django.conf import settings
+from PIL import Image as PILImage
+from . import accounting
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels of each rendition; override with settings.THUMBNAILS
+DEFAULT_CONFIG = {
+    'SIZES': (64, 320),
+    'QUALITY': 80,
+}
+
+def get_config():
+    return dict(DEFAULT_CONFIG, **getattr(settings, 'THUMBNAILS', {}))
+
+def thumbnail_name(image_name, size):
+    """
+    Storage name of a rendition. Upload names never point at different bytes
+    (content hashes, or random names for older files), so neither do these and
+    they can be cached forever: thumbs/320/ab/cd/<digest>.webp
+    """
+    stem = os.path.splitext(image_name)[0]
+    if stem.startswith('uploads/'):
+        stem = stem[len('uploads/'):]
+    return f'thumbs/{size}/{stem}.webp'
+
+def generate_thumbnails(storage, image_name, sizes=None):
+    """Write every missing rendition of an image, returning their names by size"""
+    config = get_config()
+    sizes = sizes or config['SIZES']
+    names = {size: thumbnail_name(image_name, size) for size in sizes}
+    missing = [size for size, name in names.items() if not storage.exists(name)]
+    if not missing:
+        return names
+
+    with storage.open(image_name, 'rb') as f, PILImage.open(f) as img:
+        img.draft('RGB', (max(missing), max(missing)))  # JPEG decodes at reduced scale
+        img = img.convert('RGB')
+        # Largest first, so each smaller rendition is resized from the previous one
+        for size in sorted(missing, reverse=True):
+            img.thumbnail((size, size), PILImage.Resampling.LANCZOS)
+            output = io.BytesIO()
+            img.save(output, format='WEBP', quality=config['QUALITY'], method=4)
+            _write(storage.path(names[size]), output.getvalue())
+            accounting.record('media', output.tell())
+    return names
+
+def thumbnail_url(image_field, size):
+    """URL of a rendition, generating it on first use; the original on failure"""
+    name = thumbnail_name(image_field.name, size)
+    storage = image_field.storage
+    try:
+        if not storage.exists(name):
+            generate_thumbnails(storage, image_field.name)
+        return storage.url(name)
+    except Exception as e:
+        logger.warning(f"Failed to create thumbnail for {image_field.name}: {e}")
+        return image_field.url
+
+def delete_thumbnails(storage, image_name):
+    """
+    Remove every rendition of an image whose file is gone, returning the
+    (bytes, files) freed for the caller to record
+    """
+    freed = removed = 0
+    for size in get_config()['SIZES']:
+        path = storage.path(thumbnail_name(image_name, size))
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            freed += size
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to delete thumbnail {path}: {e}")
+    return freed, removed
+
+def _write(path, data):
+    """Write through a temporary file so concurrent requests never serve a partial image"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
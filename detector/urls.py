@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('analyze/', views.analyze_image, name='analyze'),
+    path('similar/', views.similar_images, name='similar_upload'),
+    path('similar/<int:image_id>/', views.similar_images, name='similar_images'),
     path('debug/', views.debug_info, name='debug'),
     path('health/', views.health_check, name='health_check'),
 ]
\ No newline at end of file
@@ -0,0 +1,102 @@
+import io
+import json
+import threading
+import numpy as np
+import psutil
+from PIL import Image as PILImage
+
+def summarize_latencies(samples):
+    """
+    Summarize latency samples (in seconds) as milliseconds percentiles
+    """
+    if not samples:
+        return {'mean_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0}
+    values = np.asarray(samples, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+    }
+
+def synthetic_image_bytes(size, format='JPEG', seed=0):
+    """
+    Encode a deterministic noise image of the given (width, height) size
+    """
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    output = io.BytesIO()
+    PILImage.fromarray(pixels, 'RGB').save(output, format=format)
+    return output.getvalue()
+
+class PeakRSSSampler:
+    """
+    Track the peak resident set size of this process while the context is active.
+    ru_maxrss cannot be reset between runs, so RSS is polled from a thread instead.
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop_event.set()
+        self._thread.join()
+        self._sample()
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / (1024 * 1024), 1)
+
+def load_results(path):
+    """Load benchmark results written by write_results"""
+    with open(path) as f:
+        return json.load(f)
+
+def write_results(path, results, **metadata):
+    """Write benchmark results and run metadata as JSON"""
+    with open(path, 'w') as f:
+        json.dump(dict(metadata, results=results), f, indent=2)
+
+def compare_to_baseline(results, baseline, key_fields, threshold,
+                        higher_is_better=(), lower_is_better=()):
+    """
+    Compare results to a baseline run and return a list of regressions.
+    A metric regresses when it is worse than the baseline by more than
+    threshold (a fraction, e.g. 0.1 for 10%).
+    """
+    def key(row):
+        return tuple(row.get(field) for field in key_fields)
+
+    baseline_rows = {key(row): row for row in baseline.get('results', [])}
+    regressions = []
+
+    for row in results:
+        base = baseline_rows.get(key(row))
+        if base is None:
+            continue
+        for metric in higher_is_better:
+            if base.get(metric) and row[metric] < base[metric] * (1 - threshold):
+                regressions.append(dict(zip(key_fields, key(row)), metric=metric,
+                                        baseline=base[metric], current=row[metric]))
+        for metric in lower_is_better:
+            if base.get(metric) and row[metric] > base[metric] * (1 + threshold):
+                regressions.append(dict(zip(key_fields, key(row)), metric=metric,
+                                        baseline=base[metric], current=row[metric]))
+    return regressions
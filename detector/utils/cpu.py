@@ -0,0 +1,31 @@
+import torch
+
+# CPU flags that give oneDNN native bfloat16 kernels instead of slow emulation
+BF16_CPU_FLAGS = {'avx512_bf16', 'amx_bf16'}
+
+def cpu_flags():
+    """
+    Return the CPU feature flags from /proc/cpuinfo, or None where it is unavailable
+    """
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return None
+
+def cpu_supports_bf16():
+    """
+    Check whether bfloat16 autocast will run on native instructions
+    """
+    try:
+        if not torch.backends.mkldnn.is_available() or not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+            return False
+    except (AttributeError, RuntimeError):
+        return False
+
+    flags = cpu_flags()
+    # Without /proc/cpuinfo trust oneDNN's own check
+    return flags is None or bool(flags & BF16_CPU_FLAGS)
@@ -1,7 +1,6 @@
 from PIL import Image as PILImage
 import io
 from django.core.files.base import ContentFile
-import gc
 
 def optimize_image(image_file, max_size=(800, 800), quality=85):
     """
@@ -36,7 +35,6 @@ def optimize_image(image_file, max_size=(800, 800), quality=85):
     # Clean up
     img.close()
     output.close()
-    gc.collect()
     
     return content_file, format.lower()
 
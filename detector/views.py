@@ -4,14 +4,17 @@ from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.core.cache import cache
 from django.views.decorators.http import require_http_methods
-from cache_memoize import cache_memoize
 from .models import Image
 from .ai_model import analyzer
+from .memory import governor
+from .metrics import sampler
+from .thumbnails import generate_thumbnails
+from .coalesce import LATE, SHARED, TIMED_OUT, flights
+from . import analytics, embeddings
 import os
 import logging
 import traceback
 import hashlib
-import psutil
 import sys
 
 logger = logging.getLogger(__name__)
@@ -69,29 +72,31 @@ def health_check(request):
     media_dir_exists = os.path.exists(settings.MEDIA_ROOT)
     media_dir_writable = os.access(settings.MEDIA_ROOT, os.W_OK) if media_dir_exists else False
     
-    # Get memory usage for debugging
-    memory_info = psutil.virtual_memory()
-    disk_info = psutil.disk_usage('/')
+    # Latest background sample; never blocks the probe on psutil calls
+    metrics = sampler.latest()
     
     health_data = {
         'status': 'ok',
         'message': 'Service is healthy',
         'python_version': sys.version,
         'media_directory': {
-            'path': settings.MEDIA_ROOT,
+            'path': str(settings.MEDIA_ROOT),
             'exists': media_dir_exists,
             'writable': media_dir_writable
         },
         'memory': {
-            'total_mb': round(memory_info.total / (1024 * 1024), 2),
-            'available_mb': round(memory_info.available / (1024 * 1024), 2),
-            'used_percent': memory_info.percent
+            'total_mb': metrics['memory_total_mb'],
+            'available_mb': metrics['memory_available_mb'],
+            'used_percent': metrics['system_memory_percent']
         },
         'disk': {
-            'total_gb': round(disk_info.total / (1024 * 1024 * 1024), 2),
-            'free_gb': round(disk_info.free / (1024 * 1024 * 1024), 2),
-            'used_percent': disk_info.percent
-        }
+            'total_gb': metrics['disk_total_gb'],
+            'free_gb': metrics['disk_free_gb'],
+            'used_percent': metrics['disk_used_percent']
+        },
+        'metrics': metrics,
+        'memory_governor': governor.get_stats(),
+        'coalescing': flights.get_stats()
     }
     
     return JsonResponse(health_data)
@@ -103,14 +108,91 @@ def get_image_hash(image_file):
         hasher.update(chunk)
     return hasher.hexdigest()
 
-@cache_memoize(timeout=3600)  # Cache analysis results for 1 hour
+def store_embedding(img_instance, embedding):
+    """Keep an analyzed image's embedding for similarity search; never fails the request"""
+    if embedding is None:
+        return
+    try:
+        embeddings.get_store(img_instance.model_version).add([img_instance.id], embedding)
+    except Exception as e:
+        logger.warning(f"Could not store embedding of image {img_instance.id}: {e}")
+
 def analyze_image_content(image_path):
-    """Analyze image content with caching"""
+    """
+    Analyze image content, caching the verdict for an hour. The embedding is
+    only returned when the model ran and is never cached; images analyzed from
+    the cache get theirs from build_embedding_index.
+    """
+    cache_key = f'verdict_{hashlib.sha256(image_path.encode()).hexdigest()}'
+    verdict = cache.get(cache_key)
+    if verdict is not None:
+        return verdict
     try:
-        return analyzer.analyze_image(image_path)
+        result = analyzer.analyze_image(image_path, embeddings=embeddings.get_config()['ENABLED'])
     except Exception as e:
         logger.error(f"Error in analyze_image_content: {str(e)}\n{traceback.format_exc()}")
         return None
+    if result:
+        cache.set(cache_key, {key: value for key, value in result.items() if key != 'embedding'}, timeout=3600)
+    return result
+
+class AnalysisFailed(Exception):
+    """The model could not analyze a saved upload, which has been deleted again"""
+
+def analyze_upload(image_file, image_hash):
+    """Save, analyze and cache an upload, returning the response data"""
+    # Create and save image instance (this will trigger validation)
+    img_instance = Image.objects.create(image=image_file)
+    
+    # Get the full path of the saved image
+    image_path = os.path.join(settings.MEDIA_ROOT, img_instance.image.name)
+
+    # Render thumbnails now so the response and the admin never wait on them
+    try:
+        generate_thumbnails(img_instance.image.storage, img_instance.image.name)
+    except Exception as e:
+        logger.warning(f"Thumbnail generation failed: {e}")
+    
+    # Analyze the image using our AI model with caching
+    try:
+        result = analyze_image_content(image_path)
+        
+        if result:
+            img_instance.is_real = result['is_real']
+            img_instance.confidence_score = result['confidence']
+            img_instance.analysis_result = 'Real Image' if result['is_real'] else 'AI Generated'
+            img_instance.model_version = analyzer.model_version
+            img_instance.save()
+            analytics.record_analysis(img_instance)
+            store_embedding(img_instance, result.get('embedding'))
+            
+            response_data = {
+                'status': 'success',
+                'result': img_instance.analysis_result,
+                'confidence': result['confidence'],
+                'image_url': img_instance.image.url,
+                'thumbnail_url': img_instance.thumbnail_url(320),
+                'details': {
+                    'size': img_instance.file_size,
+                    'width': img_instance.image_width,
+                    'height': img_instance.image_height,
+                    'filename': img_instance.original_filename
+                }
+            }
+            
+            # Cache the results
+            cache.set(f'analysis_{image_hash}', response_data, timeout=3600)
+            
+            return response_data
+        else:
+            raise Exception("Analysis failed to produce a result")
+            
+    except Exception as e:
+        logger.error(f"Error analyzing image: {str(e)}\n{traceback.format_exc()}")
+        analytics.record_failure(img_instance, analyzer.model_version)
+        # Delete the uploaded file if analysis fails
+        img_instance.delete()
+        raise AnalysisFailed() from e
 
 @require_http_methods(["POST"])
 def analyze_image(request):
@@ -145,52 +227,25 @@ def analyze_image(request):
         # Check if we have cached results for this image
         cached_result = cache.get(f'analysis_{image_hash}')
         if cached_result:
+            analytics.record_cache_hit(analyzer.model_version)
             return JsonResponse(cached_result)
 
-        # Create and save image instance (this will trigger validation)
-        img_instance = Image.objects.create(image=image_file)
-        
-        # Get the full path of the saved image
-        image_path = os.path.join(settings.MEDIA_ROOT, img_instance.image.name)
-        
-        # Analyze the image using our AI model with caching
+        # Identical uploads arriving together share one analysis
         try:
-            result = analyze_image_content(image_path)
-            
-            if result:
-                img_instance.is_real = result['is_real']
-                img_instance.confidence_score = result['confidence']
-                img_instance.analysis_result = 'Real Image' if result['is_real'] else 'AI Generated'
-                img_instance.save()
-                
-                response_data = {
-                    'status': 'success',
-                    'result': img_instance.analysis_result,
-                    'confidence': result['confidence'],
-                    'image_url': img_instance.image.url,
-                    'details': {
-                        'size': img_instance.file_size,
-                        'width': img_instance.image_width,
-                        'height': img_instance.image_height,
-                        'filename': img_instance.original_filename
-                    }
-                }
-                
-                # Cache the results
-                cache.set(f'analysis_{image_hash}', response_data, timeout=3600)
-                
-                return JsonResponse(response_data)
-            else:
-                raise Exception("Analysis failed to produce a result")
-                
-        except Exception as e:
-            logger.error(f"Error analyzing image: {str(e)}\n{traceback.format_exc()}")
-            # Delete the uploaded file if analysis fails
-            img_instance.delete()
+            response_data, how = flights.do(image_hash, lambda: analyze_upload(image_file, image_hash))
+        except AnalysisFailed:
             return JsonResponse({
                 'status': 'error',
                 'message': 'Failed to analyze image. Please try again.'
             }, status=500)
+        if how == SHARED:
+            analytics.record_coalesced(analyzer.model_version)
+        elif how == LATE:
+            # A finished analysis another worker left behind, like a cache hit
+            analytics.record_cache_hit(analyzer.model_version)
+        elif how == TIMED_OUT:
+            analytics.record_coalesce_timeout(analyzer.model_version)
+        return JsonResponse(response_data)
             
     except ValidationError as e:
         logger.warning(f"Validation error: {str(e)}")
@@ -205,3 +260,65 @@ def analyze_image(request):
             'status': 'error',
             'message': 'An unexpected error occurred. Please try again.'
         }, status=500)
+
+def _similar_response(store, vector, request, exclude=None):
+    try:
+        k = min(max(int(request.GET.get('k', 10)), 1), 50)
+    except ValueError:
+        k = 10
+    matches = embeddings.find_similar(store, vector, k, exclude=exclude)
+    return JsonResponse({
+        'status': 'success',
+        'model_version': analyzer.model_version,
+        'results': [
+            {
+                'id': image.id,
+                'similarity': round(score, 4),
+                'thumbnail_url': image.thumbnail_url(320),
+                'result': image.analysis_result,
+                'confidence': image.confidence_score,
+                'uploaded_at': image.uploaded_at.isoformat(),
+            }
+            for image, score in matches
+        ]
+    })
+
+@require_http_methods(["GET", "POST"])
+def similar_images(request, image_id=None):
+    """
+    Previously analyzed images most similar to a stored image (GET with its
+    id) or to an uploaded one (POST, which is analyzed but not stored)
+    """
+    if not embeddings.get_config()['ENABLED']:
+        return JsonResponse({'status': 'error', 'message': 'Similarity search is disabled'}, status=404)
+    store = embeddings.get_store(analyzer.model_version)
+
+    if image_id is not None:
+        vector = store.get(image_id)
+        if vector is None:
+            return JsonResponse({
+                'status': 'error',
+                'message': f'No embedding stored for image {image_id} with model {analyzer.model_version}'
+            }, status=404)
+        return _similar_response(store, vector, request, exclude=image_id)
+
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST an image or GET similar/<id>/'}, status=405)
+    if getattr(request, 'limited', False):
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Rate limit exceeded. Please wait before trying again.'
+        }, status=429)
+    image_file = request.FILES.get('image')
+    if not image_file:
+        return JsonResponse({'status': 'error', 'message': 'No image file provided'}, status=400)
+    if image_file.size > 5 * 1024 * 1024:
+        return JsonResponse({'status': 'error', 'message': 'Image file size exceeds the maximum allowed (5.0MB)'}, status=400)
+    try:
+        result = analyzer.analyze_batch([image_file], embeddings=True)[0]
+    except Exception as e:
+        logger.warning(f"Could not analyze image for similarity search: {e}")
+        return JsonResponse({'status': 'error', 'message': 'Could not read the image'}, status=400)
+    if 'embedding' not in result:
+        return JsonResponse({'status': 'error', 'message': 'The deployed model does not provide embeddings'}, status=404)
+    return _similar_response(store, result['embedding'], request)
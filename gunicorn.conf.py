@@ -30,4 +30,24 @@ tmp_upload_dir = None
 
 # SSL
 keyfile = None
-certfile = None
\ No newline at end of file
+certfile = None
+
+# Server hooks
+def post_worker_init(worker):
+    # Let the memory governor retire this worker gracefully above its hard limit;
+    # the worker finishes in-flight requests and the arbiter starts a fresh one
+    from detector.memory import governor
+    governor.recycle_callback = lambda: setattr(worker, 'alive', False)
+
+    # Sample this worker's metrics in the background for /health/ and the dashboard
+    from detector.metrics import sampler
+    sampler.start()
+
+    # Every worker runs a scheduler; the one holding the leader lock runs the jobs
+    from detector.tasks import scheduler
+    scheduler.start()
+
+def worker_exit(server, worker):
+    # Hand leadership to another worker straight away
+    from detector.tasks import scheduler
+    scheduler.stop()
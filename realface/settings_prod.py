@@ -14,17 +14,25 @@ SQLITE_PATH = os.environ.get('SQLITE_PATH', BASE_DIR)
 import os
 os.makedirs(os.path.join(SQLITE_PATH, 'media'), exist_ok=True)
 
-# Register maintenance middleware for production
-MIDDLEWARE = ['detector.middleware.MaintenanceMiddleware'] + MIDDLEWARE
-
 # Database settings - Use SQLite with persistent storage on Render
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(SQLITE_PATH, 'db.sqlite3'),
+        # Reuse connections across requests instead of reconnecting (and re-applying PRAGMAs) each time
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Take the write lock when a transaction starts so busy_timeout applies,
+            # rather than failing when a read transaction later tries to write
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# SQLite PRAGMAs applied to each connection, see detector.db.SQLITE_PROFILES
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'high_concurrency')
+
 # Use local memory cache if Redis is not configured
 CACHES = {
     'default': {
@@ -38,6 +46,34 @@ import sys
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5 * 1024 * 1024  # 5MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5 * 1024 * 1024  # 5MB
 
+# Memory governor thresholds (MB of worker RSS) sized for Render's 512MB instances
+MEMORY_GOVERNOR = {
+    'GC_THRESHOLD_MB': int(os.environ.get('MEMORY_GC_THRESHOLD_MB', 350)),
+    'TRIM_THRESHOLD_MB': int(os.environ.get('MEMORY_TRIM_THRESHOLD_MB', 400)),
+    'HARD_LIMIT_MB': int(os.environ.get('MEMORY_HARD_LIMIT_MB', 470)) or None,  # 0 disables recycling
+}
+
+# CPU inference options, see detector.ai_model.ImageAnalyzer
+INFERENCE = {
+    'CHANNELS_LAST': os.environ.get('INFERENCE_CHANNELS_LAST', 'False').lower() == 'true',
+    # Falls back to float32 automatically on CPUs without AVX512-BF16/AMX
+    'BF16_AUTOCAST': os.environ.get('INFERENCE_BF16_AUTOCAST', 'False').lower() == 'true',
+}
+
+# Similar-image search, see detector.embeddings
+EMBEDDINGS = {
+    'ENABLED': os.environ.get('EMBEDDINGS_ENABLED', 'True').lower() == 'true',
+    'NPROBE': int(os.environ.get('EMBEDDINGS_NPROBE', 8)),
+    # On the persistent disk with the database, so vectors survive redeploys like their Image rows
+    'DIR': os.path.join(SQLITE_PATH, 'embeddings'),
+}
+
+# Identical uploads analyzed at the same time share one analysis, see detector.coalesce
+COALESCING = {
+    'ENABLED': os.environ.get('COALESCING_ENABLED', 'True').lower() == 'true',
+    'TIMEOUT': float(os.environ.get('COALESCING_TIMEOUT', 30)),
+}
+
 # Security settings
 SECURE_SSL_REDIRECT = True
 SESSION_COOKIE_SECURE = True
@@ -82,4 +118,10 @@ LOGGING = {
             'propagate': False,
         },
     },
-}
\ No newline at end of file
+}
+
+# Periodic jobs run in whichever gunicorn worker holds this lock
+SCHEDULER = {
+    'ENABLED': os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true',
+    'LOCK_FILE': os.path.join(SQLITE_PATH, 'scheduler.lock'),
+}